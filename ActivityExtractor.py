@@ -3,19 +3,16 @@ Module for Activity Extractor
 """
 # !/usr/bin/python3
 
-from amazon import AmazonActivityExtractor
-from hulu import HuluActivityExtractor
-from netflix import NetflixActivityExtractor
 from configparser import ConfigParser
 import argparse
+import blocking
+import contextlib
+import profiling
+import progress
+import records
+import services
 import sys
 
-SUPPORTED_SERVICES = {
-    'amazon': AmazonActivityExtractor,
-    'hulu': HuluActivityExtractor,
-    'netflix': NetflixActivityExtractor
-}
-
 
 class ActivityExtractor:
     """
@@ -31,6 +28,9 @@ class ActivityExtractor:
 
         self.url = None
 
+        # Registered service named in self.args, see services.py
+        self.service = None
+
         self.service_class = None
 
     def run(self) -> None:
@@ -52,10 +52,12 @@ class ActivityExtractor:
         """
         Check whether service in self.args is supported
         """
-        if self.args.service not in SUPPORTED_SERVICES:
+        # Only the selected service's module gets imported, when it runs
+        self.service = services.get(self.args.service)
+        if self.service is None:
             print('Service not supported')
             print('Supported services include:')
-            for s in SUPPORTED_SERVICES.keys():
+            for s in services.names():
                 print('  %s' % s)
             sys.exit(2)
 
@@ -74,17 +76,13 @@ class ActivityExtractor:
         # Get url for browser
         self.url = parser.get(parsing_dictionary['service'], 'url')
 
-        if self.args.email is None:
-            self.args.email = parser.get(parsing_dictionary['service'], 'email')
-
-        if self.args.password is None:
-            self.args.password = parser.get(parsing_dictionary['service'],
-                                            'password')
-
-        # Netflix has an extra parameter for profile_name
-        if self.args.service == 'netflix':
-            self.args.user = parser.get(parsing_dictionary['service'],
-                                        'profile_name')
+        # Credentials, resources to block (the service's blocking profile by
+        # default), engine and extra keys the service reads, e.g. Netflix's
+        # profile_name, unless given on the command line
+        config = self.service.read_config(parser, parsing_dictionary['service'])
+        for parameter, value in config.items():
+            if getattr(self.args, parameter, None) is None:
+                setattr(self.args, parameter, value)
 
     def check_credentials(self):
         """
@@ -100,19 +98,76 @@ class ActivityExtractor:
                   + 'add password into \'userconfig.ini\''
                   + 'or provide password using --password')
             sys.exit(2)
+        if self.args.resume and self.args.incremental:
+            print('--resume and --incremental can\'t be used together')
+            sys.exit(2)
+        try:
+            self.args.block = blocking.parse_kinds(self.args.block)
+        except ValueError as error:
+            print(error)
+            sys.exit(2)
 
     def run_process(self):
         """
         Take the given arguments in self.args and call the given service class
         """
-        self.service_class = SUPPORTED_SERVICES[self.args.service]({
+        parameters = {
             'url': self.url,
             'email': self.args.email,
             'password': self.args.password,
-            'user': self.args.user
-        })
+            'user': self.args.user,
+            'prune': self.args.prune,
+            'resume': self.args.resume,
+            'incremental': self.args.incremental,
+            'sessions': self.args.sessions,
+            'block': self.args.block,
+            'window': self.args.window,
+            'engine': self.args.engine,
+            'fast_path': self.args.fast_path,
+            'all_profiles': self.args.all_profiles,
+            'database': self.args.database,
+            'format': self.args.format,
+            'record': self.args.record,
+            'site': self.args.site,
+            'prefetch': self.args.prefetch
+        }
+        for parameter in self.service.config_keys.values():
+            parameters[parameter] = getattr(self.args, parameter)
+
+        # Hand the run to the extraction daemon if one is running, which has
+        # browsers and sessions warm, and follow its output from here
+        if not self.args.local:
+            # Only needed here, and heavier than a plain run
+            import daemon
+            finished = daemon.run_remote(self.args.service, parameters, self.args.profile, self.args.daemon_port,
+                                         self.args.events)
+            if finished is not None:
+                if finished['type'] == 'failed':
+                    sys.exit(1)
+                return
+
+        if self.args.profile:
+            profiling.start()
+
+        self.service_class = self.service(parameters)
+
+        # Progress is drawn as a bar, with everything printed going above it
+        bar = progress.BarRenderer()
+        renderers = [bar]
+        if self.args.events:
+            renderers.append(progress.JsonRenderer(self.args.events))
+        progress.start(self.args.service, renderers)
 
-        self.service_class.get_activity()
+        try:
+            with contextlib.redirect_stdout(bar):
+                self.service_class.get_activity()
+        finally:
+            progress.stop()
+            if self.args.profile:
+                # Write out where the time went, even if the run failed
+                trace_path = '%s_trace.json' % self.args.service
+                profiling.stop(trace_path).print_summary()
+                print('Trace written to \'%s\'' % trace_path)
 
     def init_arguments(self):
         """
@@ -126,16 +181,91 @@ class ActivityExtractor:
             help='Specify streaming service to get viewing activity from.')
         parser.add_argument('--email=',
                             dest='email',
-                            nargs=1,
                             help='Specify email address.')
         parser.add_argument('--password=',
                             dest='password',
-                            nargs=1,
                             help='Specify password required for login.')
         parser.add_argument('--user=',
                             dest='user',
-                            nargs=1,
                             help='Specify user (Only required for Netflix).')
+        parser.add_argument('--prune',
+                            action='store_true',
+                            help='Remove rows from the page as they are read, '
+                                 'keeping browser memory flat (Netflix only).')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='Continue an interrupted run from its last '
+                                 'checkpoint (Hulu and Amazon only).')
+        parser.add_argument('--incremental',
+                            action='store_true',
+                            help='Only extract activity newer than the previous '
+                                 'run and add it to the existing output.')
+        parser.add_argument('--scroll',
+                            dest='fast_path',
+                            action='store_false',
+                            help='Always scroll through the \'Viewing activity\' page instead '
+                                 'of fetching the data behind it (Netflix only).')
+        parser.add_argument('--all-profiles',
+                            action='store_true',
+                            help='Extract every profile, writing one output per '
+                                 'profile (Netflix only).')
+        parser.add_argument('--no-session',
+                            dest='sessions',
+                            action='store_false',
+                            help='Always log in instead of restoring a saved session.')
+        parser.add_argument('--block=',
+                            dest='block',
+                            help='Comma-separated resources not to load: images, media, '
+                                 'fonts, trackers, or none (default: per-service profile).')
+        parser.add_argument('--window=',
+                            dest='window',
+                            type=int,
+                            default=1,
+                            help='Number of history pages to load at once (Hulu only).')
+        parser.add_argument('--engine=',
+                            dest='engine',
+                            choices=['browser', 'http'],
+                            help='Read history pages in the browser, or fetch them over '
+                                 'plain HTTP after logging in (Hulu and Amazon only).')
+        parser.add_argument('--no-prefetch',
+                            dest='prefetch',
+                            action='store_false',
+                            help='Click through history pages instead of loading the next '
+                                 'one in a second tab while reading the current one (Amazon only).')
+        parser.add_argument('--database=',
+                            dest='database',
+                            help='Also add the activity to this SQLite database, '
+                                 'which builds up across runs.')
+        parser.add_argument('--format=',
+                            dest='format',
+                            choices=records.FORMATS,
+                            default='txt',
+                            help='Output format: txt (default), csv or jsonl.')
+        parser.add_argument('--record',
+                            action='store_true',
+                            help='Save every history page read in snapshots/, to be '
+                                 're-parsed later with snapshots.py.')
+        parser.add_argument('--site=',
+                            dest='site',
+                            help='Load the service\'s pages from this origin instead, '
+                                 'e.g. a fixtures.py server.')
+        parser.add_argument('--profile',
+                            action='store_true',
+                            help='Time every phase and WebDriver command, printing a summary '
+                                 'and writing a Chrome trace to [service]_trace.json.')
+        parser.add_argument('--events=',
+                            dest='events',
+                            help='Append progress and events (e.g. backoffs) to this '
+                                 'file as JSON lines.')
+        parser.add_argument('--local',
+                            action='store_true',
+                            help='Run here even if an extraction daemon is running.')
+        parser.add_argument('--daemon-port=',
+                            dest='daemon_port',
+                            type=int,
+                            default=8765,
+                            help='Port the extraction daemon listens on '
+                                 '(default: 8765, as in daemon.py).')
 
         # Assign command line arguments to class variable
         self.args = parser.parse_args()
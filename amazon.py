@@ -1,12 +1,37 @@
 #!/usr/bin/python3
 
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from http_engine import HttpEngine, FETCH_ERRORS
+from urllib.parse import urljoin
+import bulk
 import common
+import drivers
+import profiling
+import progress
+import ratelimit
+import rowparser
+import sessions
 import time
 
 SERVICE = 'AMAZON'
 
+HISTORY_URL = 'https://www.amazon.com/gp/yourstore/iyr/ref=pd_ys_iyr_edit_watched?ie=UTF8&collection=watched'
+
+# Each 'iyrListItemTitle' element holds one title
+ROW_SPEC = {
+    'rows': '[id*="iyrListItemTitle"]',
+    'cells': None,
+    'fields': ['text']
+}
+
+# Link to the next page of viewing activity
+NEXT_SELECTOR = '#iyrNext'
+
+# Seconds the next page may take to replace the current one
+PAGE_TIMEOUT = 30
+
 
 class AmazonActivityExtractor:
 
@@ -16,25 +41,46 @@ class AmazonActivityExtractor:
 
     def __init__(self, parameters):
         self.parameters = parameters
+        # Pages are loaded from parameters['site'] instead if it is given
+        self.history_url = common.site_url(parameters, HISTORY_URL)
         self.driver = None
-        self.activity_list = []
+        # Paces requests to Amazon, see ratelimit.py
+        self.limiter = None
+        self.session = None
+        # What the activity is written into, see common.open_output
+        self.output = None
+        # Rows written by the run, None unless it finished
+        self.rows = None
+        # Whether a page didn't load in time, leaving the run to be resumed
+        self.timed_out = False
 
     def get_activity(self):
         """
         The main function that lets the user download their Amazon activity
+        Returns: number of rows written, or None if the run didn't finish
         """
         self.login_amazon()
+        return self.rows
 
+    @profiling.phase('login')
     def login_amazon(self):
         """
         Logs into Amazon
         """
-        
         print('Logging into Amazon')
 
-        # Initialising PhantomJS driver
-        self.driver = webdriver.PhantomJS()
-        self.driver.get(self.parameters['url'])
+        # Initialising driver
+        self.driver = drivers.get_driver(self.parameters, SERVICE)
+        self.limiter = ratelimit.for_service(SERVICE, self.history_url)
+
+        # Skip the login flow if a saved session is still valid
+        if self.parameters.get('sessions', True):
+            self.session = sessions.SessionStore(SERVICE, self.parameters['email'], self.parameters['password'])
+            if self.session.restore(self.driver, self.history_url, self.is_logged_in):
+                self.navigate_pages()
+                return
+
+        self.driver.get(common.site_url(self.parameters, self.parameters['url']))
 
         # Clearing email textbox and typing in user's email
         self.driver.find_element_by_id('ap_email').clear()
@@ -45,40 +91,243 @@ class AmazonActivityExtractor:
         self.driver.find_element_by_id('ap_password').send_keys(self.parameters['password'])
 
         # Clicking on submit button
+        self.limiter.wait()
         self.driver.find_element_by_id('signInSubmit').click()
 
-        # Navigate to viewing activity page
-        self.driver.get('https://www.amazon.com/gp/yourstore/iyr/ref=pd_ys_iyr_edit_watched?ie=UTF8&collection=watched')
+        # Navigate to viewing activity page, which asks for credentials again if they were wrong
+        if not self.is_logged_in():
+            print('Error: Incorrect Credentials.\n'
+                  + '       Please check if you entered the correct email and password in \'userconfig.ini\'')
+            drivers.release_driver(self.parameters, self.driver)
+            return
+
+        # Save the logged-in session for later runs
+        if self.session is not None:
+            self.session.save(self.driver.get_cookies())
 
         self.navigate_pages()
 
+    @profiling.phase('login')
+    def is_logged_in(self):
+        """
+        Checks whether the browser session is logged in, leaving it on the viewing activity page
+        Returns: Boolean
+        """
+        self.driver.get(self.history_url)
+        return not self.driver.find_elements_by_id('ap_email')
+
+    @profiling.phase('navigation')
     def navigate_pages(self):
         """
         Navigates to the Viewing History page
         """
         print('Retrieving viewing activity...')
 
-        # List that is filled with strings of viewing activity
-        self.activity_list = []
+        # Output that viewing activity is streamed into page by page
+        self.output = common.open_output(SERVICE, self.parameters)
+
+        current_page = 1
+        if self.output.resume_state is not None:
+            current_page = common.resume_page(self.driver, self.output.resume_state, self.next_page)
 
-        done = False
+        if current_page is not None and self.parameters.get('engine') == 'http':
+            current_page = self.read_pages_over_http(current_page)
+
+        # Load each next page in a second tab while the current one is read
+        prefetch = self.parameters.get('prefetch', True)
+
+        done = current_page is None
+        row_list = None
         while not done:
-            self.get_page_activity()
-            try:
-                self.driver.find_element_by_id('iyrNext').click()
-                time.sleep(1)
-            except WebDriverException:
+            next_tab = self.open_next_page() if prefetch else None
+            reached = self.get_page_activity(current_page, row_list)
+            self.output.checkpoint(page=current_page, url=self.driver.current_url)
+            row_list = None
+            if reached:
+                done = True
+                if next_tab is not None:
+                    self.close_tab(next_tab)
+            elif next_tab is not None:
+                row_list = self.switch_to_page(next_tab)
+                done = row_list is None
+                current_page += 1
+            elif self.next_page():
+                current_page += 1
+            else:
                 done = True
 
-        common.output_activity(SERVICE, self.activity_list)
+        # Close driver
+        drivers.release_driver(self.parameters, self.driver)
 
-    def get_page_activity(self):
+        if self.timed_out:
+            # Keep the checkpoint to resume from, and the watermark where it was,
+            # since the older pages haven't been read
+            self.output.abandon()
+        else:
+            self.rows = self.output.finish()
+
+    @profiling.phase('extraction')
+    def read_pages_over_http(self, current_page):
         """
-        Gets all viewing activity on current page
+        Reads the pages from the current one on over plain HTTP with the
+        browser's cookies, following the 'iyrNext' links
+        Returns: None once done, or the page the browser is left on to read the
+                 rest from, if a page failed or has no rows over HTTP
         """
+        print('Fetching pages over HTTP')
+        engine = HttpEngine(self.driver, limiter=self.limiter)
+        url = self.driver.current_url
+        first_page = current_page
+        try:
+            while url:
+                try:
+                    url, html = engine.fetch(url)
+                except FETCH_ERRORS as error:
+                    print('Page %d couldn\'t be fetched: %s' % (current_page, error))
+                    return self.browse_from(url, current_page)
+
+                row_list, found = rowparser.parse_page(html, ROW_SPEC, [NEXT_SELECTOR])
+                links = [attrs['href'] for attrs in found[NEXT_SELECTOR] if attrs.get('href')]
+                # Only the last page may be empty, anything else isn't a page of
+                # activity, e.g. one that is only filled in by scripts
+                if not row_list and (links or current_page == first_page):
+                    print('No activity found on page %d over HTTP' % current_page)
+                    return self.browse_from(url, current_page)
+                if not row_list:
+                    return None
+
+                self.output.record(html, current_page)
+                reached = self.add_page(row_list, current_page)
+                self.output.checkpoint(page=current_page, url=url)
+                if reached:
+                    return None
 
-        # List that contains all row elements on viewing activity page
-        row_list = self.driver.find_elements_by_xpath('//*[contains(@id, "iyrListItemTitle")]')
+                url = urljoin(url, links[0]) if links else None
+                current_page += 1
+            return None
+        finally:
+            engine.close()
+
+    @profiling.phase('navigation')
+    def browse_from(self, url, current_page):
+        """
+        Loads page current_page at url in the browser, for the pages that
+        couldn't be read over HTTP
+        Returns: current_page
+        """
+        print('Reading the rest in the browser')
+        if url != self.driver.current_url:
+            with self.limiter.request():
+                self.driver.get(url)
+        return current_page
+
+    @profiling.phase('navigation')
+    def next_page(self):
+        """
+        Clicks through to the next page of viewing activity, once the budget
+        allows, and waits until the current page's rows are gone and the next
+        page's rows are there
+        Returns: Boolean
+        """
+        self.limiter.wait()
+        try:
+            rows = self.driver.find_elements_by_css_selector(ROW_SPEC['rows'])
+            old = rows[0] if rows else self.driver.find_element_by_tag_name('html')
+            start = time.time()
+            self.driver.find_element_by_id('iyrNext').click()
+            WebDriverWait(self.driver, PAGE_TIMEOUT).until(EC.staleness_of(old))
+            WebDriverWait(self.driver, PAGE_TIMEOUT).until(self.loaded_rows)
+        except TimeoutException:
+            self.limiter.report('timeout')
+            print('The next page didn\'t load, run again with --resume to carry on')
+            self.timed_out = True
+            return False
+        except WebDriverException:
+            return False
+        self.limiter.success(time.time() - start)
+        return True
+
+    @profiling.phase('navigation')
+    def open_next_page(self):
+        """
+        Starts loading the page the 'iyrNext' link points to in a new tab,
+        without switching to it
+        Returns: (window handle, time it was opened), or None if there is no
+                 link to follow, in which case next_page clicks through instead
+        """
+        links = self.driver.find_elements_by_id('iyrNext')
+        url = links[0].get_attribute('href') if links else None
+        if not url or not url.startswith('http'):
+            return None
+
+        self.limiter.wait()
+        handles = set(self.driver.window_handles)
+        try:
+            self.driver.execute_script('window.open(arguments[0]);', url)
+            return (set(self.driver.window_handles) - handles).pop(), time.time()
+        except (WebDriverException, KeyError):
+            return None
+
+    @profiling.phase('navigation')
+    def switch_to_page(self, tab):
+        """
+        Closes the current tab and switches to tab, as returned by
+        open_next_page, once its rows are there
+        Returns: the rows read from it, or None if they didn't load
+        """
+        handle, opened = tab
+        self.driver.close()
+        self.driver.switch_to.window(handle)
+        try:
+            row_list = WebDriverWait(self.driver, PAGE_TIMEOUT).until(self.loaded_rows)
+        except TimeoutException:
+            self.limiter.report('timeout')
+            print('The next page didn\'t load, run again with --resume to carry on')
+            self.timed_out = True
+            return None
+        self.limiter.success(time.time() - opened)
+        return row_list
+
+    def close_tab(self, tab):
+        """
+        Closes tab, as returned by open_next_page, without leaving the current one
+        """
+        current = self.driver.current_window_handle
+        self.driver.switch_to.window(tab[0])
+        self.driver.close()
+        self.driver.switch_to.window(current)
+
+    def loaded_rows(self, driver):
+        """
+        Reads the current page's rows once it has finished loading, so a page
+        that is still arriving isn't read in part
+        Returns: list of rows, empty until then
+        """
+        if driver.execute_script('return document.readyState;') != 'complete':
+            return []
+        return bulk.extract_rows(driver, ROW_SPEC)
+
+    @profiling.phase('extraction')
+    def get_page_activity(self, current_page, row_list=None):
+        """
+        Gets all viewing activity on current page, unless its rows were
+        already read into row_list while waiting for them
+        Returns: Boolean, whether an incremental run reached activity it already has
+        """
+
+        # Read every row on the current page in one call
+        if row_list is None:
+            row_list = bulk.extract_rows(self.driver, ROW_SPEC)
+        if self.output.recording:
+            self.output.record(self.driver.page_source, current_page)
+        return self.add_page(row_list, current_page)
+
+    def add_page(self, row_list, current_page):
+        """
+        Writes out the rows read from page current_page
+        Returns: Boolean, whether an incremental run reached activity it already has
+        """
+        reached = self.output.write(row_list)
+        progress.set_page(current_page)
 
-        for row in row_list:
-            self.activity_list.append(row.text + '\n')
+        return reached
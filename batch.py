@@ -0,0 +1,360 @@
+"""
+Module for extracting activity from many accounts at once
+"""
+# !/usr/bin/python3
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from configparser import ConfigParser
+from multiprocessing.util import Finalize
+import argparse
+import blocking
+import contextlib
+import drivers
+import multiprocessing
+import os
+import profiling
+import progress
+import records
+import services
+import sys
+import time
+
+# Accounts of one service that may run at the same time unless --limit says otherwise
+DEFAULT_SERVICE_LIMIT = 2
+
+# Warm browsers of the current worker process, shared by the accounts it runs
+worker_pool = None
+
+
+def init_worker(browsers, max_jobs):
+    """
+    Starts a worker process's driver pool with one browser of each given kind
+    """
+    global worker_pool
+    worker_pool = drivers.DriverPool(max_jobs=max_jobs)
+    # Worker processes skip atexit handlers, so quit the browsers through multiprocessing
+    Finalize(worker_pool, worker_pool.close, exitpriority=10)
+    for browser in browsers:
+        worker_pool.prelaunch(browser, 1)
+
+
+def run_account(account):
+    """
+    Extracts one account's activity inside its own output directory, with the
+    extractor's messages and progress going to 'extractor.log' there. Its
+    counts are also put in account['progress'] for the batch's combined bar.
+    Returns: (number of rows written, seconds taken)
+    """
+    start = time.time()
+    os.makedirs(account['output'], exist_ok=True)
+    os.chdir(account['output'])
+
+    driver = worker_pool.acquire(drivers.browser_for(account['service']))
+    parameters = dict(account['parameters'], driver=driver)
+    try:
+        with open('extractor.log', 'w') as log:
+            # What is printed goes through the bar, so progress lines never split a log line
+            bar = progress.BarRenderer(log)
+            renderers = [bar, progress.SharedRenderer(account['progress'], account['name'])]
+            if account['events']:
+                renderers.append(progress.JsonRenderer('events.jsonl'))
+            with contextlib.redirect_stdout(bar):
+                progress.start(account['name'], renderers)
+                if account['profiling']:
+                    profiling.start()
+                try:
+                    rows = services.get(account['service'])(parameters).get_activity()
+                finally:
+                    progress.stop()
+                    if account['profiling']:
+                        profiling.stop('trace.json').print_summary()
+    finally:
+        worker_pool.release(driver)
+
+    # Extractors print their errors instead of raising, and only count rows once a run finishes
+    if rows is None:
+        raise RuntimeError('no activity was written, see %s'
+                           % os.path.join(account['output'], 'extractor.log'))
+
+    return rows, time.time() - start
+
+
+class BatchRunner:
+    """
+    Runs the accounts listed in a manifest on a bounded pool of worker
+    processes, without running more than a set number of accounts of any one
+    service at the same time
+    """
+
+    def __init__(self):
+        """
+        Initialize a new BatchRunner object
+        """
+        self.args = None
+
+        self.accounts = []
+
+        # Per-service concurrency limits
+        self.limits = {}
+
+    def run(self) -> None:
+        """
+        Main function to read the manifest and extract every account in it
+        """
+        self.init_arguments()
+        self.read_manifest()
+        self.check_accounts()
+        results = self.run_accounts()
+        self.print_summary(results)
+
+        # Exit with an error if any account failed
+        if any(error is not None for _, error in results.values()):
+            sys.exit(1)
+
+    def read_manifest(self) -> None:
+        """
+        Read accounts from the manifest. Every section whose name starts with a
+        service name is one account, e.g. [HULU] or [HULU work]. Sections
+        without a url use the url of the plain [SERVICE] section.
+        """
+        parser = ConfigParser()
+        parser.optionxform = str
+        if not parser.read(self.args.manifest):
+            print('Manifest \'%s\' not found' % self.args.manifest)
+            sys.exit(2)
+
+        for section in parser.sections():
+            service = section.split()[0].lower()
+            name = '_'.join(section.lower().split())
+
+            url = parser.get(section, 'url', fallback=None)
+            if url is None:
+                url = parser.get(service.upper(), 'url', fallback=None)
+
+            self.accounts.append({
+                'name': name,
+                'service': service,
+                'output': os.path.abspath(os.path.join(self.args.output, name)),
+                'profiling': self.args.profile,
+                'events': self.args.events,
+                'parameters': {
+                    'url': url,
+                    'email': parser.get(section, 'email', fallback=None),
+                    'password': parser.get(section, 'password', fallback=None),
+                    'prune': self.args.prune,
+                    'resume': self.args.resume,
+                    'incremental': self.args.incremental,
+                    'sessions': self.args.sessions,
+                    'block': parser.get(section, 'block', fallback=None),
+                    'window': self.args.window,
+                    'engine': self.args.engine or parser.get(section, 'engine', fallback='browser'),
+                    'fast_path': self.args.fast_path,
+                    'all_profiles': self.args.all_profiles,
+                    # Workers run in each account's output directory, so they need the absolute path
+                    'database': os.path.abspath(self.args.database) if self.args.database else None,
+                    'format': self.args.format,
+                    'record': self.args.record,
+                    'prefetch': self.args.prefetch
+                }
+            })
+
+            # Extra keys the service reads, e.g. Netflix's profile_name
+            registered = services.get(service)
+            if registered is not None:
+                for key, parameter in registered.config_keys.items():
+                    self.accounts[-1]['parameters'][parameter] = parser.get(section, key, fallback=None)
+
+    def check_accounts(self) -> None:
+        """
+        Check whether every account has a supported service and full credentials
+        """
+        for account in self.accounts:
+            if services.get(account['service']) is None:
+                print('[%s] Service not supported' % account['name'])
+                sys.exit(2)
+            for key in ('url', 'email', 'password'):
+                if account['parameters'][key] is None:
+                    print('[%s] %s is missing' % (account['name'], key))
+                    sys.exit(2)
+            if account['service'] == 'netflix' and account['parameters'].get('user') is None \
+                    and not self.args.all_profiles:
+                print('[%s] profile_name is missing' % account['name'])
+                sys.exit(2)
+            try:
+                account['parameters']['block'] = blocking.parse_kinds(account['parameters']['block'])
+            except ValueError as error:
+                print('[%s] %s' % (account['name'], error))
+                sys.exit(2)
+
+        for limit in self.args.limit:
+            service, _, count = limit.partition('=')
+            if not count.isdigit() or int(count) < 1:
+                print('--limit must look like service=N with N of at least 1')
+                sys.exit(2)
+            self.limits[service.lower()] = int(count)
+
+        if self.args.resume and self.args.incremental:
+            print('--resume and --incremental can\'t be used together')
+            sys.exit(2)
+
+    def run_accounts(self):
+        """
+        Run every account on the worker pool, starting a queued account as soon
+        as a worker and its service's limit allow it
+        Returns: dict of account name to (result, error message)
+        """
+        queue = list(self.accounts)
+        running = {}
+        results = {}
+        start = time.time()
+
+        # Every worker keeps one warm browser of each kind the accounts need
+        browsers = sorted(set(drivers.browser_for(account['service']) for account in self.accounts))
+
+        print('Extracting %d account(s) with %d worker(s)' % (len(queue), self.args.workers))
+
+        # Workers put their accounts' counts in a shared dict, drawn as one bar
+        manager = multiprocessing.Manager()
+        shared = manager.dict()
+        view = progress.AggregateView(shared).start()
+
+        with manager, ProcessPoolExecutor(max_workers=self.args.workers, initializer=init_worker,
+                                 initargs=(browsers, self.args.recycle)) as executor:
+            while queue or running:
+                # Start every queued account whose service is under its limit
+                for account in list(queue):
+                    if len(running) >= self.args.workers:
+                        break
+                    service = account['service']
+                    active = sum(1 for a in running.values() if a['service'] == service)
+                    if active < self.limits.get(service, DEFAULT_SERVICE_LIMIT):
+                        queue.remove(account)
+                        running[executor.submit(run_account, dict(account, progress=shared))] = account
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    account = running.pop(future)
+                    try:
+                        rows, elapsed = future.result()
+                        results[account['name']] = ((rows, elapsed), None)
+                        status = '%d rows in %.0fs' % (rows, elapsed)
+                    except Exception as error:
+                        results[account['name']] = (None, str(error) or type(error).__name__)
+                        status = 'FAILED: %s' % results[account['name']][1]
+
+                    failed = sum(1 for _, error in results.values() if error is not None)
+                    view.print('[%d/%d done, %d failed, %d running, %.0fs] %s: %s'
+                               % (len(results), len(self.accounts), failed, len(running),
+                                  time.time() - start, account['name'], status))
+
+            view.stop()
+
+        return results
+
+    def print_summary(self, results) -> None:
+        """
+        Print a table of every account's result
+        """
+        print('\nSummary:')
+        for account in self.accounts:
+            result, error = results[account['name']]
+            if error is None:
+                print('  %-30s ok      %8d rows  %6.0fs' % (account['name'], result[0], result[1]))
+            else:
+                print('  %-30s failed  %s' % (account['name'], error))
+
+        succeeded = sum(1 for _, error in results.values() if error is None)
+        print('%d succeeded, %d failed' % (succeeded, len(results) - succeeded))
+
+    def init_arguments(self):
+        """
+        Initialize command line argument parser and define acceptable arguments
+        """
+        parser = argparse.ArgumentParser(
+            description='Gets viewing activity from many streaming service '
+                        'accounts in parallel.')
+        parser.add_argument('manifest',
+                            nargs='?',
+                            default='userconfig.ini',
+                            help='Config file with one section per account, '
+                                 'e.g. [HULU] or [HULU work] (default: userconfig.ini).')
+        parser.add_argument('--output=',
+                            dest='output',
+                            default='batch_output',
+                            help='Directory that each account\'s output goes under.')
+        parser.add_argument('--workers=',
+                            dest='workers',
+                            type=int,
+                            default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: one per core).')
+        parser.add_argument('--limit=',
+                            dest='limit',
+                            action='append',
+                            default=[],
+                            help='Most accounts of a service to run at once, e.g. '
+                                 '--limit=hulu=1 (default: %d).' % DEFAULT_SERVICE_LIMIT)
+        parser.add_argument('--recycle=',
+                            dest='recycle',
+                            type=int,
+                            default=25,
+                            help='Replace a worker\'s browser after this many accounts.')
+        parser.add_argument('--prune',
+                            action='store_true',
+                            help='Remove rows from the page as they are read (Netflix only).')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='Continue interrupted accounts from their last checkpoint.')
+        parser.add_argument('--incremental',
+                            action='store_true',
+                            help='Only extract activity newer than the previous run.')
+        parser.add_argument('--window=',
+                            dest='window',
+                            type=int,
+                            default=1,
+                            help='Number of history pages to load at once (Hulu only).')
+        parser.add_argument('--engine=',
+                            dest='engine',
+                            choices=['browser', 'http'],
+                            help='Read history pages in the browser, or over plain HTTP (Hulu and Amazon only).')
+        parser.add_argument('--scroll',
+                            dest='fast_path',
+                            action='store_false',
+                            help='Always scroll through the \'Viewing activity\' page (Netflix only).')
+        parser.add_argument('--all-profiles',
+                            action='store_true',
+                            help='Extract every profile of each Netflix account.')
+        parser.add_argument('--no-session',
+                            dest='sessions',
+                            action='store_false',
+                            help='Always log in instead of restoring a saved session.')
+        parser.add_argument('--no-prefetch',
+                            dest='prefetch',
+                            action='store_false',
+                            help='Click through history pages instead of loading the next one '
+                                 'in a second tab (Amazon only).')
+        parser.add_argument('--database=',
+                            dest='database',
+                            help='SQLite database every account\'s activity is also added to.')
+        parser.add_argument('--format=',
+                            dest='format',
+                            choices=records.FORMATS,
+                            default='txt',
+                            help='Output format: txt (default), csv or jsonl.')
+        parser.add_argument('--profile',
+                            action='store_true',
+                            help='Time every phase and WebDriver command of each account, '
+                                 'writing a summary to its log and a Chrome trace to its trace.json.')
+        parser.add_argument('--record',
+                            action='store_true',
+                            help='Save every history page read in each account\'s snapshots/.')
+        parser.add_argument('--events',
+                            action='store_true',
+                            help='Write each account\'s progress and events (e.g. backoffs) '
+                                 'to its events.jsonl as JSON lines.')
+
+        # Assign command line arguments to class variable
+        self.args = parser.parse_args()
+
+if __name__ == "__main__":
+    runner = BatchRunner()
+    runner.run()
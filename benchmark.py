@@ -0,0 +1,241 @@
+"""
+Module for measuring how fast each extractor reads histories of different
+sizes from the local fixture server
+"""
+# !/usr/bin/python3
+
+from concurrent.futures import ProcessPoolExecutor
+from fixtures import FixtureServer, LOGIN_PATHS
+import argparse
+import contextlib
+import drivers
+import json
+import multiprocessing
+import os
+import profiling
+import resource
+import services
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def peak_memory():
+    """
+    Returns the most memory this process has used, in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_extraction(service, site, login_url, options, directory):
+    """
+    Extracts service's history from the fixture server at site inside
+    directory, in a process of its own so its memory use is its own
+    Returns: dict of results
+    """
+    os.chdir(directory)
+    extractor_class = services.get(service).load()
+
+    profiling.start()
+    driver = drivers.create_driver(drivers.browser_for(service), headless=True)
+
+    parameters = {
+        'url': login_url,
+        'site': site,
+        'email': 'bench@example.com',
+        'password': 'bench',
+        'user': 'Bench',
+        'sessions': False,
+        'block': [],
+        'window': options['window'],
+        'engine': options['engine'],
+        'fast_path': options['fast_path'],
+        'prefetch': options['prefetch'],
+        'format': 'jsonl',
+        'driver': driver
+    }
+    try:
+        with open('extractor.log', 'w') as log, contextlib.redirect_stdout(log):
+            extractor_class(parameters).get_activity()
+        browser_memory = drivers.memory_usage(driver)
+    finally:
+        driver.quit()
+    profiler = profiling.stop()
+
+    output_path = '%s_activity.jsonl' % service.lower()
+    rows = 0
+    if os.path.exists(output_path):
+        with open(output_path, 'rb') as file:
+            rows = sum(1 for _ in file)
+
+    return {
+        'rows': rows,
+        'wall': profiler.wall(),
+        'phases': profiler.phases,
+        'commands': [sum(count for count, _ in profiler.commands.values()),
+                     sum(seconds for _, seconds in profiler.commands.values())],
+        'memory': peak_memory(),
+        'browser_memory': browser_memory
+    }
+
+
+def cold_start(service_names, repeat=3):
+    """
+    Times fresh interpreters doing nothing, showing the command line help, and
+    loading each service's extractor, taking the fastest of repeat runs
+    Returns: dict of seconds by what was timed
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    commands = [('interpreter', ['-c', 'pass']), ('--help', ['ActivityExtractor.py', '--help'])]
+    commands += [('load ' + name, ['-c', 'import services; services.get(%r).load()' % name])
+                 for name in service_names]
+
+    timings = {}
+    for label, arguments in commands:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + arguments, cwd=directory, stdout=subprocess.DEVNULL, check=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+    return timings
+
+
+def benchmark(service, size, options):
+    """
+    Serves a history of size rows for service and times extracting it
+    Returns: dict of results
+    """
+    fixture = FixtureServer(service, size, options['latency']).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory, \
+                ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            future = pool.submit(run_extraction, service, fixture.site, fixture.login_url, options, directory)
+            result = future.result()
+    finally:
+        fixture.stop()
+
+    result.update({
+        'service': service,
+        'size': size,
+        'mode': mode_name(service, options),
+        'requests': fixture.requests,
+        'pages': fixture.last_page(),
+        'rows_per_second': result['rows'] / result['wall'] if result['wall'] else 0.0
+    })
+    return result
+
+
+def mode_name(service, options):
+    """
+    Returns a short description of how service's pages are read with options
+    """
+    if service == 'NETFLIX':
+        return 'api' if options['fast_path'] else 'scroll'
+    mode = options['engine']
+    if service == 'AMAZON' and mode == 'browser' and not options['prefetch']:
+        mode = 'click'
+    if service == 'HULU' and options['window'] > 1:
+        mode += ' x%d' % options['window']
+    return mode
+
+
+def print_result(result):
+    """
+    Prints a result's totals and the time spent in each phase
+    """
+    browser_memory = result['browser_memory']
+    print('%-8s %8d  %-10s %8.1f s %9.0f rows/s %6.0f ms/page  %6.0f MB  %s  %5d requests%s' % (
+        result['service'], result['size'], result['mode'], result['wall'], result['rows_per_second'],
+        1000 * result['wall'] / result['pages'],
+        result['memory'], 'browser %5.0f MB' % browser_memory if browser_memory else 'browser     ? MB',
+        result['requests'], '' if result['rows'] == result['size'] else
+        '  (wrote %d rows, expected %d)' % (result['rows'], result['size'])))
+    for name, (seconds, calls) in sorted(result['phases'].items(), key=lambda item: -item[1][0]):
+        print('    %-12s %8.2f s  %6d call(s)' % (name, seconds, calls))
+    print('    %-12s %8.2f s  %6d command(s)' % ('webdriver', result['commands'][1], result['commands'][0]))
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Compares results with those saved in baseline_path
+    Returns: Boolean, False if any run got slower by more than tolerance
+    """
+    with open(baseline_path) as file:
+        saved = json.load(file)
+    baseline = dict(((result['service'], result['size'], result['mode']), result) for result in saved['results'])
+
+    passed = True
+    print('\nCompared with \'%s\':' % baseline_path)
+    for label, seconds in results['cold_start'].items():
+        if saved['cold_start'].get(label):
+            print('%-28s %+6.0f%%' % ('cold start, ' + label, (seconds / saved['cold_start'][label] - 1) * 100))
+    results = results['results']
+    for result in results:
+        before = baseline.get((result['service'], result['size'], result['mode']))
+        if before is None or not before['rows_per_second']:
+            continue
+        change = result['rows_per_second'] / before['rows_per_second'] - 1
+        slower = change < -tolerance
+        passed = passed and not slower
+        print('%-8s %8d  %-10s %+6.0f%%%s' % (result['service'], result['size'], result['mode'], change * 100,
+                                             '  SLOWER' if slower else ''))
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Times extraction of made-up histories served by a local fixture server.')
+    parser.add_argument('services', nargs='*', default=['netflix', 'hulu', 'amazon'],
+                        help='Services to benchmark (default: all).')
+    parser.add_argument('--rows=', dest='rows', default='100,1000,10000',
+                        help='Comma-separated history sizes to run (default: 100,1000,10000).')
+    parser.add_argument('--latency=', dest='latency', type=float, default=0.0,
+                        help='Seconds the fixture server adds to every response.')
+    parser.add_argument('--engine=', dest='engine', choices=['browser', 'http'], default='browser',
+                        help='How Hulu and Amazon pages are read.')
+    parser.add_argument('--window=', dest='window', type=int, default=1,
+                        help='Number of Hulu pages to load at once.')
+    parser.add_argument('--scroll', dest='fast_path', action='store_false',
+                        help='Scroll the Netflix \'Viewing activity\' page instead of using its API.')
+    parser.add_argument('--no-prefetch', dest='prefetch', action='store_false',
+                        help='Click through Amazon pages instead of loading the next one in a second tab.')
+    parser.add_argument('--save=', dest='save', help='Save the results to this JSON file.')
+    parser.add_argument('--compare=', dest='compare', help='Compare rows/s with results saved earlier.')
+    parser.add_argument('--tolerance=', dest='tolerance', type=float, default=0.2,
+                        help='Largest drop in rows/s --compare accepts (default: 0.2).')
+    args = parser.parse_args()
+
+    options = {
+        'latency': args.latency,
+        'engine': args.engine,
+        'window': args.window,
+        'fast_path': args.fast_path,
+        'prefetch': args.prefetch
+    }
+    service_names = [service.upper() for service in args.services]
+    for service in service_names:
+        if service not in LOGIN_PATHS:
+            print('Service \'%s\' not supported' % service)
+            sys.exit(2)
+
+    timings = cold_start([service.lower() for service in service_names])
+    print('Cold start: ' + ', '.join('%s %.0f ms' % (label, seconds * 1000) for label, seconds in timings.items()))
+
+    results = []
+    for service in service_names:
+        for size in [int(size) for size in args.rows.split(',')]:
+            result = benchmark(service, size, options)
+            print_result(result)
+            results.append(result)
+
+    results = {'cold_start': timings, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
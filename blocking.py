@@ -0,0 +1,149 @@
+"""
+Module for blocking the page resources extraction doesn't need
+"""
+# !/usr/bin/python3
+
+import argparse
+import re
+
+# URL patterns of every kind of resource that can be blocked
+RESOURCE_PATTERNS = {
+    'images': ['*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.svg*', '*.ico*'],
+    'media': ['*.mp4*', '*.webm*', '*.m4s*', '*.m3u8*', '*.mpd*'],
+    'fonts': ['*.woff*', '*.ttf*', '*.otf*', '*.eot*'],
+    'trackers': [
+        '*google-analytics.com*',
+        '*googletagmanager.com*',
+        '*doubleclick.net*',
+        '*scorecardresearch.com*',
+        '*facebook.net*',
+        '*omtrdc.net*',
+        '*demdex.net*',
+        '*krxd.net*',
+        '*amazon-adsystem.com*',
+        '*adnxs.com*',
+        '*moatads.com*'
+    ]
+}
+
+# Kinds of resources blocked for each service by default. Netflix keeps its
+# images, since the profile icons have to be visible to be clicked. Other
+# services block nothing unless told to.
+PROFILES = {
+    'AMAZON': ['images', 'media', 'fonts', 'trackers'],
+    'HULU': ['images', 'media', 'fonts', 'trackers'],
+    'NETFLIX': ['media', 'fonts', 'trackers']
+}
+
+# Aborts PhantomJS requests whose URL matches one of the given expressions
+PHANTOM_BLOCK_SCRIPT = '''
+var patterns = arguments[0].map(function (p) { return new RegExp(p, 'i'); });
+this.onResourceRequested = function (request, network) {
+    for (var i = 0; i < patterns.length; i++) {
+        if (patterns[i].test(request.url)) { network.abort(); return; }
+    }
+};
+'''
+
+# Load time of the current page and the bytes it transferred, where the browser reports them
+MEASURE_SCRIPT = '''
+var timing = window.performance.timing;
+var bytes = null;
+if (window.performance.getEntriesByType) {
+    var entries = window.performance.getEntriesByType('navigation')
+        .concat(window.performance.getEntriesByType('resource'));
+    if (entries.length) {
+        bytes = 0;
+        for (var i = 0; i < entries.length; i++) {
+            bytes += entries[i].transferSize || entries[i].encodedBodySize || 0;
+        }
+    }
+}
+return {load: timing.loadEventEnd - timing.navigationStart, bytes: bytes};
+'''
+
+
+def parse_kinds(value):
+    """
+    Returns the kinds of resources listed in a comma-separated value, an empty
+    list for 'none', or None if value is None
+    """
+    if value is None:
+        return None
+    kinds = [kind.strip().lower() for kind in value.split(',') if kind.strip()]
+    if kinds == ['none']:
+        return []
+    for kind in kinds:
+        if kind not in RESOURCE_PATTERNS:
+            raise ValueError('Unknown resource kind \'%s\', expected one of: %s'
+                             % (kind, ', '.join(sorted(RESOURCE_PATTERNS))))
+    return kinds
+
+
+def patterns_for(kinds):
+    """
+    Returns the URL patterns of the given kinds of resources
+    """
+    patterns = []
+    for kind in kinds:
+        patterns.extend(RESOURCE_PATTERNS[kind])
+    return patterns
+
+
+def apply_blocking(driver, kinds):
+    """
+    Makes driver skip every request for the given kinds of resources. Calling
+    it again replaces the previous rules, and an empty list turns blocking off.
+    """
+    patterns = patterns_for(kinds)
+
+    if hasattr(driver, 'execute_cdp_cmd'):
+        # Chrome
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    elif driver.name == 'phantomjs':
+        driver.command_executor._commands['executePhantomScript'] = \
+            ('POST', '/session/$sessionId/phantom/execute')
+        expressions = ['^' + re.escape(pattern).replace('\\*', '.*') + '$' for pattern in patterns]
+        driver.execute('executePhantomScript', {'script': PHANTOM_BLOCK_SCRIPT, 'args': [expressions]})
+
+
+def measure(driver):
+    """
+    Returns the current page's load time in ms and the bytes it transferred
+    (None where the browser doesn't report sizes)
+    """
+    return driver.execute_script(MEASURE_SCRIPT)
+
+
+def compare(service, url):
+    """
+    Loads url in a fresh browser with and without service's blocking profile
+    and prints the load time and bytes transferred of both
+    """
+    # Imported here so parsing --block doesn't have to load Selenium
+    import drivers
+
+    results = {}
+    for label, kinds in (('off', []), ('on', PROFILES.get(service, []))):
+        driver = drivers.create_driver(drivers.browser_for(service), headless=True)
+        try:
+            apply_blocking(driver, kinds)
+            driver.get(url)
+            results[label] = measure(driver)
+        finally:
+            driver.quit()
+
+    for label in ('off', 'on'):
+        bytes_loaded = results[label]['bytes']
+        print('Blocking %-3s  %6d ms  %s' % (label, results[label]['load'],
+                                            'unknown size' if bytes_loaded is None else '%d KB' % (bytes_loaded / 1024)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compares page load time and size with resource blocking on and off.')
+    parser.add_argument('service', help='Service whose blocking profile to use.')
+    parser.add_argument('url', help='Page to load.')
+    args = parser.parse_args()
+    compare(args.service.upper(), args.url)
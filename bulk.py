@@ -0,0 +1,70 @@
+"""
+Module for extracting every row on a page in a single WebDriver call
+"""
+
+# Running totals of the WebDriver calls made, and the calls that reading each
+# row and cell one element at a time would have needed on top of those
+stats = {
+    'calls': 0,
+    'calls_saved': 0
+}
+
+# Walks every row matching spec.rows and returns its cells as an object keyed
+# by spec.fields. Without spec.cells the whole row text fills the first field.
+# When arguments[1] is set the rows are removed from the page once read.
+BULK_EXTRACT_SCRIPT = '''
+var spec = arguments[0], remove = arguments[1];
+var text = function (el) { return (el.innerText || el.textContent || '').trim(); };
+var rows = document.querySelectorAll(spec.rows);
+var out = [];
+for (var i = 0; i < rows.length; i++) {
+    var record = {};
+    if (spec.cells) {
+        var cells = rows[i].querySelectorAll(spec.cells);
+        for (var j = 0; j < spec.fields.length; j++) {
+            record[spec.fields[j]] = j < cells.length ? text(cells[j]) : '';
+        }
+    } else {
+        record[spec.fields[0]] = text(rows[i]);
+    }
+    out.push(record);
+}
+if (remove) {
+    for (var k = 0; k < rows.length; k++) {
+        rows[k].parentNode.removeChild(rows[k]);
+    }
+}
+return out;
+'''
+
+
+def extract_rows(driver, spec, remove=False):
+    """
+    Returns every row matching spec as a list of dicts keyed by spec['fields']
+    If remove is True the rows are also removed from the page
+
+    spec is a dict with:
+      'rows'   : CSS selector for the row elements
+      'cells'  : CSS selector for the cells inside a row, or None to use the row text
+      'fields' : names given to the cells, in order
+    """
+    rows = driver.execute_script(BULK_EXTRACT_SCRIPT, spec, remove) or []
+
+    # Reading rows one by one costs one call to find the rows, then either
+    # one .text per row, or a find_elements and a .text for every cell
+    if spec.get('cells'):
+        per_row = 2 * len(spec['fields'])
+    else:
+        per_row = 1
+    stats['calls'] += 1
+    stats['calls_saved'] += len(rows) * per_row
+
+    return rows
+
+
+def report():
+    """
+    Prints how many WebDriver calls bulk extraction has saved so far
+    """
+    print('Bulk extraction used %d WebDriver call(s), saving %d'
+          % (stats['calls'], stats['calls_saved']))
@@ -1,17 +1,377 @@
+from urllib.parse import urlsplit
+import bulk
 import codecs
+import json
+import os
+import profiling
+import progress
+import records
+import shutil
+import store
+import time
 
+# File holding the newest entry seen for every service and account
+WATERMARK_PATH = 'watermarks.json'
 
-def output_activity(service, activity_list):
+# Called with every batch of records flushed, e.g. to stream them out of a daemon job
+listener = None
+
+
+class ActivitySink:
+
+    """
+    Streams viewing activity records into 'SERVICE_activity.txt' as they are
+    extracted, or into a .csv or .jsonl file for those output formats
+
+    Records are buffered and written in batches to 'SERVICE_activity.txt.new',
+    flushed every flush_interval seconds, and fsynced whenever a checkpoint is
+    recorded. The file only replaces the output on close, so a run that fails
+    leaves the previous output as it was. The checkpoint file
+    'SERVICE_checkpoint.json' records the last completed page or cursor, so a
+    crashed run keeps everything up to its last checkpoint.
+
+    With resume=True the sink picks up from the previous run's checkpoint, if
+    there is one, and exposes it as resume_state.
+
+    With incremental=True the existing output is put after the new records on
+    close, since history pages list the newest entries first.
+
+    With a database path every flushed batch is also added to that activity
+    database (see store.py) under account and profile.
+    """
+
+    def __init__(self, service, tag=None, resume=False, incremental=False, buffer_size=500, flush_interval=5.0,
+                 database=None, account='', profile='', output_format='txt'):
+        # Outputs with a tag (e.g. a profile name) are kept apart as 'SERVICE_TAG_activity.txt'
+        name = service.lower() if tag is None else '%s_%s' % (service.lower(), tag)
+        self.name = name
+        self.output_format = output_format
+        self.output_path = '%s_activity.%s' % (name, output_format)
+        self.path = self.output_path + '.new'
+        self.incremental = incremental
+        self.checkpoint_path = '%s_checkpoint.json' % name
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.count = 0
+        self.last_flush = time.time()
+        self.resume_state = None
+        self.service = service
+        self.account = account
+        self.profile = profile
+        self.store = store.ActivityStore(database) if database else None
+
+        if resume:
+            self.resume_state = read_checkpoint(name, output_format)
+            if self.resume_state is None:
+                print('No checkpoint found, starting from the beginning')
+
+        if self.resume_state is not None:
+            print('Resuming activity in \'%s\' after %d rows' % (self.path, self.resume_state['rows']))
+            # Drop anything written after the last checkpoint
+            with open(self.path, 'r+b') as file:
+                file.truncate(self.resume_state['offset'])
+            self.count = self.resume_state['rows']
+            self.file = codecs.open(self.path, 'a', encoding='utf8')
+        else:
+            # A checkpoint left by an earlier run points into the output this one replaces
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            print('Writing activity to \'%s\'' % self.path)
+            self.file = codecs.open(self.path, 'w+', encoding='utf8')
+            self.file.write(records.header(output_format))
+
+    def write(self, entries):
+        """
+        Adds records (see records.Activity) to the output, writing them out
+        once the buffer fills up or flush_interval has passed
+        """
+        self.buffer.extend(entries)
+        self.count += len(entries)
+        profiling.add_rows(len(entries))
+        progress.add_rows(len(entries))
+        if len(self.buffer) >= self.buffer_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    @profiling.phase('output')
+    def flush(self, sync=False):
+        """
+        Writes buffered records to the output file, and to disk if sync is True
+        """
+        if self.buffer:
+            self.file.write(records.serialize(self.buffer, self.output_format))
+            if self.store is not None:
+                self.store.add(self.service, self.account, self.profile, self.buffer)
+            if listener is not None:
+                listener(self.buffer)
+            self.buffer = []
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+        self.last_flush = time.time()
+
+    @profiling.phase('output')
+    def checkpoint(self, **state):
+        """
+        Syncs the output and records state (e.g. page=, url=) as the last
+        completed point of the run
+        """
+        self.flush(sync=True)
+        state['rows'] = self.count
+        state['offset'] = self.file.tell()
+
+        # Write to a temporary file first so a crash never leaves a half-written checkpoint
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    @profiling.phase('output')
+    def close(self):
+        """
+        Writes out what is left, replaces the output with it and removes the
+        checkpoint, since the run finished
+        """
+        self.flush(sync=True)
+
+        # Merge the new records into the existing output
+        if self.incremental:
+            print('Adding %d new entries to \'%s\'' % (self.count, self.output_path))
+            if os.path.exists(self.output_path):
+                with open(self.output_path, 'rb') as file:
+                    # The new file already starts with the header
+                    file.seek(len(records.header(self.output_format).encode('utf8')))
+                    shutil.copyfileobj(file, self.file.stream)
+                self.flush(sync=True)
+        self.file.close()
+        os.replace(self.path, self.output_path)
+
+        if self.store is not None:
+            self.store.close()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        print('Process finished')
+
+    @profiling.phase('output')
+    def abandon(self):
+        """
+        Writes out what is left but leaves the output as it was, keeping the
+        unfinished file and its checkpoint for a run with resume=True
+        """
+        self.flush(sync=True)
+        self.file.close()
+        if self.store is not None:
+            self.store.close()
+
+
+class HighWaterMark:
+
+    """
+    Tracks the newest entry already extracted for a service and account, so an
+    incremental run can stop as soon as it reaches it
+    """
+
+    def __init__(self, service, account):
+        self.key = '%s:%s' % (service, account)
+        # Newest entry from the previous run, and newest entry seen in this run
+        self.seen = read_watermarks().get(self.key)
+        self.newest = None
+
+    def filter(self, entries):
+        """
+        Returns the records that are newer than the stored entry, and whether the
+        stored entry was reached. entries must be ordered newest first.
+        Returns: (list, Boolean)
+        """
+        # Entries are stored as lines of text output, so compare records in that form
+        lines = [entry.line() for entry in entries]
+        if self.newest is None and lines:
+            self.newest = lines[0]
+        if self.seen is not None and self.seen in lines:
+            return entries[:lines.index(self.seen)], True
+        return entries, False
+
+    def save(self):
+        """
+        Stores the newest entry seen in this run for the next one
+        """
+        if self.newest is None:
+            return
+        watermarks = read_watermarks()
+        watermarks[self.key] = self.newest
+        with open(WATERMARK_PATH, 'w') as file:
+            json.dump(watermarks, file, indent=2)
+
+
+class ActivityOutput:
+
+    """
+    Everything an extraction writes into: its ActivitySink, plus the
+    HighWaterMark of an incremental run and the SnapshotRecorder of a
+    recorded one (see open_output)
+
+    A run that read everything ends with finish(). One that stopped part way,
+    e.g. on a page that didn't load, ends with abandon(), which keeps the
+    previous output, the checkpoint to resume from and the stored watermark.
+    """
+
+    def __init__(self, service, sink, watermark=None, recorder=None):
+        self.service = service
+        self.sink = sink
+        self.watermark = watermark
+        self.recorder = recorder
+        self.resume_state = sink.resume_state
+        # Whether the run stops at the activity the previous run ended with
+        self.incremental = watermark is not None
+        # Whether pages have to be handed to record(), worth checking before reading a page's source
+        self.recording = recorder is not None
+
+    def write(self, row_list):
+        """
+        Writes out rows read from a history page, newest first
+        Returns: Boolean, whether an incremental run reached activity it already has
+        """
+        entries = records.normalize(self.service, row_list)
+        reached = False
+        if self.watermark is not None:
+            entries, reached = self.watermark.filter(entries)
+        self.sink.write(entries)
+        return reached
+
+    def record(self, content, page=None):
+        """
+        Saves the HTML of a history page, if the run is recorded
+        """
+        if self.recorder is not None:
+            self.recorder.record(content, page)
+
+    def record_rows(self, rows, page=None):
+        """
+        Saves rows read from data rather than a page, if the run is recorded
+        """
+        if self.recorder is not None:
+            self.recorder.record_rows(rows, page)
+
+    def checkpoint(self, **state):
+        """
+        Records state (e.g. page=, url=) as the last completed point of the run
+        """
+        self.sink.checkpoint(**state)
+
+    def finish(self):
+        """
+        Replaces the output with everything read, and stores the newest entry
+        for the next incremental run
+        Returns: number of records written
+        """
+        bulk.report()
+        self.sink.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.watermark is not None:
+            self.watermark.save()
+        return self.sink.count
+
+    def abandon(self):
+        """
+        Ends a run that didn't read everything, leaving the previous output
+        and watermark as they were
+        Returns: number of records written
+        """
+        bulk.report()
+        self.sink.abandon()
+        if self.recorder is not None:
+            self.recorder.close()
+        return self.sink.count
+
+
+def open_output(service, parameters, tag=None, profile=None, resumable=True):
+    """
+    Opens the output of an extraction of service with parameters, resuming
+    the last checkpoint if parameters['resume'] is set and the service can
+    resume. Outputs with a tag (e.g. a profile name) are kept apart, and
+    profile keeps the watermark and stored activity of one profile apart.
+    Returns: ActivityOutput
+    """
+    # snapshots.py imports this module
+    import snapshots
+
+    incremental = parameters.get('incremental')
+    account = parameters['email']
+    sink = ActivitySink(service, tag=tag, resume=resumable and parameters.get('resume'), incremental=incremental,
+                        database=parameters.get('database'), account=account, profile=profile or '',
+                        output_format=parameters.get('format', 'txt'))
+    watermark = None
+    if incremental:
+        # Stop at the newest entry extracted by the previous run
+        watermark = HighWaterMark(service, account if profile is None else account + '/' + profile)
+    recorder = None
+    if parameters.get('record'):
+        recorder = snapshots.SnapshotRecorder(sink.name, sink.resume_state, incremental=incremental)
+    return ActivityOutput(service, sink, watermark, recorder)
+
+
+def read_watermarks():
+    """
+    Returns the stored newest entry of every service and account
+    """
+    if not os.path.exists(WATERMARK_PATH):
+        return {}
+    with open(WATERMARK_PATH) as file:
+        return json.load(file)
+
+
+def read_checkpoint(name, output_format='txt'):
+    """
+    Returns the checkpoint left by an interrupted run writing to
+    'NAME_activity.txt.new' (or .csv, .jsonl), or None
+    """
+    path = '%s_checkpoint.json' % name.lower()
+    output_path = '%s_activity.%s.new' % (name.lower(), output_format)
+    # A checkpoint is only usable if the unfinished output it points into still exists
+    if not os.path.exists(path) or not os.path.exists(output_path):
+        return None
+    with open(path) as file:
+        checkpoint = json.load(file)
+    # ... and still holds everything up to it
+    if checkpoint['offset'] > os.path.getsize(output_path):
+        print('\'%s\' is shorter than its checkpoint says, so it can\'t be resumed' % output_path)
+        return None
+    return checkpoint
+
+
+def resume_page(driver, checkpoint, next_page):
+    """
+    Moves driver to the page after the one recorded in checkpoint. The recorded
+    URL is loaded directly when it differs from the current one, otherwise the
+    earlier pages are skipped by calling next_page without reading them.
+    Returns: the page number now displayed, or None if no pages are left
+    """
+    page = checkpoint['page']
+    print('Skipping to page %d' % (page + 1))
+
+    if checkpoint.get('url') and checkpoint['url'] != driver.current_url:
+        driver.get(checkpoint['url'])
+    else:
+        for _ in range(page - 1):
+            if not next_page():
+                return None
+
+    if not next_page():
+        return None
+    return page + 1
+
+
+def site_url(parameters, url):
     """
-    Outputs viewing activity into 'SERVICE_activity.txt'
+    Returns url moved onto the origin in parameters['site'] (e.g. a local
+    fixture server), or url unchanged if no site is given
     """
-    print('Writing activity to \'%s_activity.txt\'' % service.lower())
-    # Open output file
-    file = codecs.open('%s_activity.txt' % service.lower(), 'w+', encoding='utf8')
-    # Write to file
-    for item in activity_list:
-        file.write(item)
+    site = parameters.get('site')
+    if not site:
+        return url
+    parts = urlsplit(url)
+    return site.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
 
-    # Close output file
-    file.close()
-    print('Process finished')
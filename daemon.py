@@ -0,0 +1,638 @@
+"""
+Module for running extractions as jobs of a long-running daemon, which keeps
+the configuration, browsers and logged-in sessions warm between jobs and
+takes jobs over a local HTTP API
+"""
+# !/usr/bin/python3
+
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import blocking
+import common
+import contextlib
+import hashlib
+import hmac
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import profiling
+import progress
+import records
+import secrets
+import services
+import sys
+import threading
+import time
+
+# Address the daemon listens on. Only local processes can reach it, since jobs carry credentials.
+HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Names the daemon is reached by. Anything else in a request's Host header came
+# through a web page resolving its own name to this address.
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+
+# File holding the token every request to the daemon on a port must carry. Only
+# the user who started the daemon can read it, so web pages and other users
+# can't submit jobs.
+TOKEN_PATH = os.path.join(os.path.expanduser('~'), '.activity_extractor_daemon_%d.token')
+
+# Seconds a client waits for the daemon to answer before running the job itself
+CONNECT_TIMEOUT = 2.0
+
+# Finished jobs whose events are kept for clients that ask for them later
+KEPT_JOBS = 100
+
+# Parameters of a job that neither the request nor 'userconfig.ini' sets, as the command line defaults them
+DEFAULT_PARAMETERS = {
+    'user': None,
+    'prune': False,
+    'resume': False,
+    'incremental': False,
+    'sessions': True,
+    'block': None,
+    'window': 1,
+    'engine': None,
+    'fast_path': True,
+    'all_profiles': False,
+    'database': None,
+    'format': 'txt',
+    'record': False,
+    'site': None,
+    'prefetch': True
+}
+
+# Job states once it can't send any more events
+FINISHED = ('done', 'failed')
+
+
+class EventWriter:
+
+    """
+    Stands in for stdout while a job runs, sending what is printed as log
+    events a line (or a progress bar update) at a time
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.text = ''
+
+    def write(self, text):
+        self.text += text
+        if '\n' in text or '\r' in text:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.text:
+            self.events.put({'type': 'log', 'text': self.text})
+            self.text = ''
+
+
+def run_job(job, events):
+    """
+    Runs a job in a daemon worker process, on one of the worker's warm
+    browsers and in the directory the job was submitted from. What the
+    extractor prints and every batch of records it writes are put on events.
+    Returns: number of records written
+    """
+    # Only worker processes need the browser stack
+    import batch
+    import drivers
+
+    written = 0
+
+    def send_rows(entries):
+        nonlocal written
+        written += len(entries)
+        events.put({'type': 'rows', 'rows': [dict(zip(records.FIELDS, entry.values())) for entry in entries]})
+
+    os.chdir(job['directory'])
+    common.listener = send_rows
+    writer = EventWriter(events)
+    # Progress goes out as a log line every few seconds, and what is printed goes
+    # through the bar too, so the two never interleave within a line
+    bar = progress.BarRenderer(writer)
+    driver = batch.worker_pool.acquire(drivers.browser_for(job['service']))
+    try:
+        with contextlib.redirect_stdout(bar):
+            renderers = [bar]
+            if job['events']:
+                renderers.append(progress.JsonRenderer(job['events']))
+            progress.start(job['service'], renderers)
+            if job['profile']:
+                profiling.start()
+            try:
+                services.get(job['service'])(dict(job['parameters'], driver=driver)).get_activity()
+            finally:
+                progress.stop()
+                if job['profile']:
+                    trace_path = '%s_trace.json' % job['service']
+                    profiling.stop(trace_path).print_summary()
+                    print('Trace written to \'%s\'' % trace_path)
+    finally:
+        writer.flush()
+        common.listener = None
+        batch.worker_pool.release(driver)
+    return written
+
+
+class Job:
+
+    """
+    An extraction submitted to the daemon, with every event it has sent so far
+
+    Events are dicts with a 'type': 'log' (with the 'text' printed), 'rows'
+    (with the records written, as dicts of records.FIELDS), and finally
+    'done' (with the 'rows' written and 'seconds' taken) or 'failed' (with
+    the 'error'). Once the job has finished and nobody is following it, its
+    row events are dropped, leaving the log and the counts.
+    """
+
+    def __init__(self, number, key, service, directory, parameters, profile, events_path):
+        self.id = str(number)
+        self.key = key
+        self.service = service
+        self.directory = directory
+        self.parameters = parameters
+        self.profile = profile
+        self.events_path = events_path
+        self.state = 'queued'
+        self.events = []
+        # Number of follow() calls in progress, which read self.events by index
+        self.followers = 0
+        self.rows = 0
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.changed = threading.Condition()
+
+    def add(self, event):
+        """
+        Adds an event, waking up everyone following the job
+        """
+        with self.changed:
+            if event['type'] == 'rows':
+                self.rows += len(event['rows'])
+            elif event['type'] in FINISHED:
+                self.state = event['type']
+                self.error = event.get('error')
+                self.finished = time.time()
+            self.events.append(event)
+            self.compact()
+            self.changed.notify_all()
+
+    def compact(self):
+        """
+        Drops the row events of a finished job that nobody is following, as
+        they hold every record extracted. Called with self.changed held.
+        """
+        if self.state in FINISHED and not self.followers:
+            self.events = [event for event in self.events if event['type'] != 'rows']
+
+    def follow(self, rows=True):
+        """
+        Yields the job's events from the first one, waiting for new ones
+        until the job finishes. Row events are left out unless rows is True.
+        """
+        with self.changed:
+            self.followers += 1
+        try:
+            index = 0
+            while True:
+                with self.changed:
+                    while index == len(self.events) and self.state not in FINISHED:
+                        self.changed.wait()
+                    events = self.events[index:]
+                    index = len(self.events)
+                for event in events:
+                    if rows or event['type'] != 'rows':
+                        yield event
+                if not events:
+                    return
+        finally:
+            with self.changed:
+                self.followers -= 1
+                self.compact()
+
+    def spec(self):
+        """
+        Returns what run_job needs to know of the job
+        """
+        return {'service': self.service, 'directory': self.directory,
+                'parameters': self.parameters, 'profile': self.profile, 'events': self.events_path}
+
+    def summary(self):
+        """
+        Returns the job's state, without its parameters since they hold credentials
+        """
+        return {'id': self.id, 'service': self.service, 'directory': self.directory,
+                'state': self.state, 'rows': self.rows, 'error': self.error,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+
+class ExtractionDaemon:
+
+    """
+    Runs submitted jobs on a pool of worker processes that each keep warm
+    browsers (see batch.init_worker), and answers the HTTP API
+
+    Jobs run in the order they were submitted, at most limits[service] of a
+    service at a time, and never two of one service in the same directory,
+    since they would write the same output. A job identical to one that is
+    queued or running isn't run again; whoever submitted it follows the
+    running one instead.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, workers=1, limits=None, recycle=25, config_path='userconfig.ini'):
+        # Only the daemon needs the browser stack, not clients
+        import batch
+        import drivers
+
+        self.workers = workers
+        self.limits = limits or {}
+        self.default_limit = batch.DEFAULT_SERVICE_LIMIT
+        self.config_path = config_path
+        self.config = None
+        self.config_time = None
+        self.read_config()
+
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.queue = []
+        self.running = {}
+        self.numbers = itertools.count(1)
+
+        # Take the port first, so a second daemon fails before launching any browsers
+        self.server = ThreadingHTTPServer((HOST, port), DaemonHandler)
+        self.server.daemon_threads = True
+        self.server.extraction_daemon = self
+        self.port = self.server.server_address[1]
+        self.token = write_token(TOKEN_PATH % self.port)
+
+        # Workers keep one warm browser of each kind the configured services use
+        browsers = sorted(set(drivers.browser_for(section.split()[0]) for section in self.config.sections()
+                              if services.get(section.split()[0]) is not None))
+        context = multiprocessing.get_context('spawn')
+        self.manager = context.Manager()
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                            initializer=batch.init_worker, initargs=(browsers, recycle))
+        # Workers start when work is submitted, so start them all now rather than on the first jobs
+        for _ in range(workers):
+            self.executor.submit(os.getpid)
+
+    def read_config(self):
+        """
+        Returns the parsed 'userconfig.ini', reading it again only if it changed
+        """
+        try:
+            modified = os.path.getmtime(self.config_path)
+        except OSError:
+            modified = None
+        if self.config is None or modified != self.config_time:
+            parser = ConfigParser()
+            parser.optionxform = str
+            parser.read(self.config_path)
+            self.config = parser
+            self.config_time = modified
+        return self.config
+
+    def complete(self, service, given):
+        """
+        Fills in the parameters a request leaves out from the service's section
+        of 'userconfig.ini', then the command line defaults. A request that
+        points the job at another url or site has to bring its own credentials.
+        Returns: dict of parameters
+        Raises: ValueError if credentials are missing or block is invalid
+        """
+        config = self.read_config()
+        section = service.name.upper()
+        parameters = dict(DEFAULT_PARAMETERS)
+        parameters.update((key, value) for key, value in given.items() if value is not None)
+        # The configured credentials are only ever typed into the configured site
+        redirected = parameters.get('url') is not None or parameters.get('site') is not None
+
+        if parameters.get('url') is None:
+            parameters['url'] = config.get(section, 'url', fallback=None)
+        for parameter, value in service.read_config(config, section).items():
+            if redirected and parameter in ('email', 'password'):
+                continue
+            if parameters.get(parameter) is None:
+                parameters[parameter] = value
+
+        for key in ('url', 'email', 'password'):
+            if parameters[key] is None:
+                raise ValueError('%s is missing, add it to the [%s] section of \'%s\' or to the request'
+                                 % (key, section, self.config_path))
+        if isinstance(parameters['block'], str):
+            parameters['block'] = blocking.parse_kinds(parameters['block'])
+        return parameters
+
+    def submit(self, request):
+        """
+        Queues the job a request describes, unless an identical one is queued or running
+        Returns: (Job, Boolean whether the job was already queued or running)
+        Raises: ValueError if the job can't be run
+        """
+        service = services.get(request.get('service') or '')
+        if service is None:
+            raise ValueError('Service \'%s\' not supported' % request.get('service'))
+        directory = request.get('directory') or os.getcwd()
+        if not os.path.isabs(directory) or not os.path.isdir(directory):
+            raise ValueError('directory must be an existing absolute path')
+        parameters = self.complete(service, request.get('parameters') or {})
+        profile = bool(request.get('profile'))
+        events_path = request.get('events')
+
+        key = hashlib.sha256(json.dumps([service.name, directory, parameters, profile, events_path],
+                                        sort_keys=True).encode('utf8')).hexdigest()
+        with self.lock:
+            for job in self.queue + list(self.running):
+                if job.key == key:
+                    return job, True
+            job = Job(next(self.numbers), key, service.name, directory, parameters, profile, events_path)
+            self.jobs[job.id] = job
+            self.queue.append(job)
+            self.dispatch()
+        return job, False
+
+    def dispatch(self):
+        """
+        Starts every queued job that a worker and its service's limit allow.
+        Called with self.lock held.
+        """
+        for job in list(self.queue):
+            if len(self.running) >= self.workers:
+                break
+            same_service = [other for other in self.running if other.service == job.service]
+            if len(same_service) >= self.limits.get(job.service, self.default_limit):
+                continue
+            if any(other.directory == job.directory for other in same_service):
+                continue
+
+            self.queue.remove(job)
+            events = self.manager.Queue()
+            job.state = 'running'
+            job.started = time.time()
+            future = self.executor.submit(run_job, job.spec(), events)
+            self.running[job] = future
+            threading.Thread(target=self.collect, args=(job, future, events), daemon=True).start()
+
+    def collect(self, job, future, events):
+        """
+        Passes a running job's events on to the Job until it finishes, then
+        starts whatever was waiting for it
+        """
+        while True:
+            try:
+                job.add(events.get(timeout=0.5))
+            except Empty:
+                if future.done():
+                    break
+        # Anything sent between the last wait and the job finishing
+        while True:
+            try:
+                job.add(events.get_nowait())
+            except Empty:
+                break
+
+        try:
+            rows = future.result()
+            job.add({'type': 'done', 'rows': rows, 'seconds': time.time() - job.started})
+        except Exception as error:
+            job.add({'type': 'failed', 'error': str(error) or type(error).__name__})
+
+        with self.lock:
+            del self.running[job]
+            finished = [old for old in self.jobs.values() if old.state in FINISHED]
+            for old in finished[:-KEPT_JOBS]:
+                del self.jobs[old.id]
+            self.dispatch()
+
+    def serve(self):
+        """
+        Answers the HTTP API until interrupted, then stops the workers and their browsers
+        """
+        print('Extraction daemon listening on http://%s:%d with %d worker(s)'
+              % (HOST, self.server.server_address[1], self.workers))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print('Stopping')
+        finally:
+            self.server.server_close()
+            with contextlib.suppress(OSError):
+                os.remove(TOKEN_PATH % self.port)
+            self.executor.shutdown(wait=True)
+            self.manager.shutdown()
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+
+    """
+    Answers the daemon's HTTP API:
+      POST /jobs             submits a job: {"service": ..., "parameters": {...},
+                             "directory": ..., "profile": false, "events": path}
+      GET  /jobs             lists the jobs
+      GET  /jobs/ID          returns a job's state
+      GET  /jobs/ID/events   streams a job's events as JSON lines until it
+                             finishes, without rows if ?rows=0
+
+    Every request needs an 'Authorization: Bearer TOKEN' header with the
+    token in TOKEN_PATH, and jobs are only taken as application/json.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def authorized(self):
+        """
+        Checks the request was sent to a local name and carries the daemon's
+        token, answering it with an error if not
+        Returns: Boolean
+        """
+        daemon = self.server.extraction_daemon
+        host = self.headers.get('Host', '')
+        if host not in ['%s:%d' % (name, daemon.port) for name in LOCAL_HOSTS]:
+            self.respond({'error': 'unexpected host'}, 403)
+            return False
+        token = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(token.encode('utf8'), ('Bearer ' + daemon.token).encode('utf8')):
+            self.respond({'error': 'missing or wrong token'}, 401)
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        daemon = self.server.extraction_daemon
+        parts = urlsplit(self.path)
+        path = parts.path.strip('/').split('/')
+
+        if path == ['jobs']:
+            with daemon.lock:
+                jobs = [job.summary() for job in daemon.jobs.values()]
+            return self.respond(jobs)
+
+        job = daemon.jobs.get(path[1]) if len(path) in (2, 3) and path[0] == 'jobs' else None
+        if job is None:
+            return self.respond({'error': 'not found'}, 404)
+        if len(path) == 2:
+            return self.respond(job.summary())
+        if path[2] != 'events':
+            return self.respond({'error': 'not found'}, 404)
+
+        rows = parse_qs(parts.query).get('rows', ['1'])[0] != '0'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            for event in job.follow(rows):
+                self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf8') + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped following, the job keeps running
+            pass
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        daemon = self.server.extraction_daemon
+        if self.path.rstrip('/') != '/jobs':
+            return self.respond({'error': 'not found'}, 404)
+        if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+            return self.respond({'error': 'jobs must be sent as application/json'}, 415)
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            job, joined = daemon.submit(request)
+        except ValueError as error:
+            return self.respond({'error': str(error)}, 400)
+        self.respond(dict(job.summary(), joined=joined), 202)
+
+    def respond(self, data, status=200):
+        """
+        Sends data as JSON
+        """
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def write_token(path):
+    """
+    Writes a new random token to path, readable by the current user only
+    Returns: the token
+    """
+    token = secrets.token_hex(32)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # A file left by an earlier daemon keeps its mode, so set it again
+    os.chmod(path, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write(token)
+    return token
+
+
+def read_token(path):
+    """
+    Returns the token written by the daemon, or None if no daemon of this user wrote one
+    """
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def run_remote(service, parameters, profile=False, port=DEFAULT_PORT, events_path=None):
+    """
+    Submits a job to the daemon listening on port, if there is one, and prints
+    its output as it runs. Output files (and the JSON lines progress log at
+    events_path, if given) are written in the current directory, as if the
+    job ran here.
+    Returns: the job's last event ('done' or 'failed'), or None if no daemon is running
+    """
+    token = read_token(TOKEN_PATH % port)
+    if token is None:
+        return None
+    headers = {'Authorization': 'Bearer ' + token}
+
+    job = {'service': service, 'parameters': parameters, 'directory': os.getcwd(), 'profile': profile,
+           'events': events_path}
+    connection = http.client.HTTPConnection(HOST, port, timeout=CONNECT_TIMEOUT)
+    try:
+        connection.request('POST', '/jobs', json.dumps(job), dict(headers, **{'Content-Type': 'application/json'}))
+        response = connection.getresponse()
+        submitted = json.loads(response.read())
+        # Whatever answers has to answer like the daemon, or the job runs here
+        if response.status == 400:
+            print('The extraction daemon refused the job: %s' % submitted['error'])
+            return {'type': 'failed', 'error': submitted['error']}
+        if response.status != 202:
+            return None
+        job_id, joined = submitted['id'], submitted['joined']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    finally:
+        connection.close()
+
+    if joined:
+        print('Following the identical job %s already on the extraction daemon' % job_id)
+    else:
+        print('Running as job %s on the extraction daemon' % job_id)
+
+    # The job can take as long as it needs
+    connection = http.client.HTTPConnection(HOST, port)
+    try:
+        connection.request('GET', '/jobs/%s/events?rows=0' % job_id, headers=headers)
+        for line in connection.getresponse():
+            event = json.loads(line)
+            if event['type'] == 'log':
+                sys.stdout.write(event['text'])
+                sys.stdout.flush()
+            elif event['type'] in FINISHED:
+                if event['type'] == 'failed':
+                    print('Job failed: %s' % event['error'])
+                return event
+    except KeyboardInterrupt:
+        print('\nStopped following, job %s keeps running on the extraction daemon' % job_id)
+        return {'type': 'failed', 'error': 'interrupted'}
+    finally:
+        connection.close()
+    return {'type': 'failed', 'error': 'the extraction daemon stopped'}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Runs extractions submitted over a local HTTP API, keeping browsers '
+                    'and sessions warm between them.')
+    parser.add_argument('--port=', dest='port', type=int, default=DEFAULT_PORT,
+                        help='Port to listen on (default: %d).' % DEFAULT_PORT)
+    parser.add_argument('--workers=', dest='workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes (default: one per core).')
+    parser.add_argument('--limit=', dest='limit', action='append', default=[],
+                        help='Most jobs of a service to run at once, e.g. --limit=hulu=1.')
+    parser.add_argument('--recycle=', dest='recycle', type=int, default=25,
+                        help='Replace a worker\'s browser after this many jobs.')
+    parser.add_argument('--config=', dest='config', default='userconfig.ini',
+                        help='Config file jobs take missing credentials and settings from.')
+    args = parser.parse_args()
+
+    limits = {}
+    for limit in args.limit:
+        service, _, count = limit.partition('=')
+        if not count.isdigit() or int(count) < 1:
+            print('--limit must look like service=N with N of at least 1')
+            sys.exit(2)
+        limits[service.lower()] = int(count)
+
+    ExtractionDaemon(args.port, args.workers, limits, args.recycle, os.path.abspath(args.config)).serve()
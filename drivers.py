@@ -0,0 +1,222 @@
+"""
+Module for launching browsers and keeping a pool of warm ones
+"""
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+import blocking
+import profiling
+import threading
+
+# Browser each service is extracted with
+BROWSERS = {
+    'AMAZON': 'phantomjs',
+    'HULU': 'chrome',
+    'NETFLIX': 'phantomjs'
+}
+
+# Browser for services from other packages
+DEFAULT_BROWSER = 'chrome'
+
+# Clears the storage a job left behind in the page it finished on
+RESET_SCRIPT = '''
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+'''
+
+# Page heap size in bytes where the browser exposes it (Chrome)
+MEMORY_SCRIPT = '''
+return window.performance && window.performance.memory
+    ? window.performance.memory.usedJSHeapSize : null;
+'''
+
+# Deletes PhantomJS's cookies for every domain
+PHANTOM_CLEAR_COOKIES_SCRIPT = 'phantom.clearCookies();'
+
+
+@profiling.phase('browser')
+def create_driver(browser, headless=False):
+    """
+    Launches a new browser of the given kind ('phantomjs' or 'chrome')
+    """
+    if browser == 'chrome':
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument('--headless')
+        return webdriver.Chrome(options=options)
+    return webdriver.PhantomJS()
+
+
+def browser_for(service):
+    """
+    Returns the kind of browser service is extracted with
+    """
+    return BROWSERS.get(service.upper(), DEFAULT_BROWSER)
+
+
+@profiling.phase('browser')
+def get_driver(parameters, service):
+    """
+    Returns the driver handed in through parameters['driver'], or launches
+    the service's browser if there is none, with the resources listed in
+    parameters['block'] blocked (the service's blocking profile by default)
+    """
+    if parameters.get('driver') is not None:
+        driver = parameters['driver']
+    else:
+        driver = create_driver(browser_for(service))
+
+    # Count the driver's commands when profiling
+    profiling.instrument(driver)
+
+    kinds = parameters.get('block')
+    if kinds is None:
+        kinds = blocking.PROFILES.get(service, [])
+    blocking.apply_blocking(driver, kinds)
+    return driver
+
+
+@profiling.phase('browser')
+def release_driver(parameters, driver):
+    """
+    Quits driver, unless it was handed in through parameters, in which case
+    whoever handed it in releases it
+    """
+    if parameters.get('driver') is None:
+        driver.quit()
+
+
+def memory_usage(driver):
+    """
+    Returns the memory used by driver's browser in MB, or None if unknown
+    """
+    try:
+        used = driver.execute_script(MEMORY_SCRIPT)
+        if used:
+            return used / 2 ** 20
+    except WebDriverException:
+        pass
+
+    # Fall back to the resident size of the browser process (PhantomJS)
+    try:
+        with open('/proc/%d/status' % driver.service.process.pid) as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+class DriverPool:
+
+    """
+    Keeps launched headless browsers around between jobs, so a run only pays
+    the browser start-up cost once
+
+    Browsers are reset when released, and replaced once they have run max_jobs
+    jobs or use more than max_memory MB.
+    """
+
+    def __init__(self, max_jobs=25, max_memory=1024):
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.lock = threading.Lock()
+        # Idle drivers per browser kind, and the kind and job count of every driver
+        self.idle = {}
+        self.browsers = {}
+        self.jobs = {}
+
+    def prelaunch(self, browser, count):
+        """
+        Launches count browsers of the given kind ahead of time
+        """
+        for _ in range(count):
+            driver = create_driver(browser, headless=True)
+            self.add(driver, browser)
+
+    def add(self, driver, browser):
+        """
+        Adds a launched driver to the idle drivers
+        """
+        with self.lock:
+            self.browsers[driver] = browser
+            self.jobs[driver] = 0
+            self.idle.setdefault(browser, []).append(driver)
+
+    def acquire(self, browser):
+        """
+        Hands out an idle browser of the given kind, launching one if none is idle
+        """
+        with self.lock:
+            if self.idle.get(browser):
+                driver = self.idle[browser].pop()
+                self.jobs[driver] += 1
+                return driver
+
+        driver = create_driver(browser, headless=True)
+        with self.lock:
+            self.browsers[driver] = browser
+            self.jobs[driver] = 1
+        return driver
+
+    def release(self, driver):
+        """
+        Resets driver and makes it idle again, or quits it if it is due for recycling
+        """
+        try:
+            memory = memory_usage(driver)
+            due = self.jobs[driver] >= self.max_jobs or (memory is not None and memory > self.max_memory)
+            # A browser that can't be reset can't be trusted with another job
+            reusable = not due and self.reset(driver)
+        except Exception:
+            # A browser that crashed or hung can fail in any way, e.g. with a refused connection
+            reusable = False
+        if not reusable:
+            self.discard(driver)
+            return
+
+        with self.lock:
+            self.idle.setdefault(self.browsers[driver], []).append(driver)
+
+    def reset(self, driver):
+        """
+        Clears cookies and storage left by the last job. delete_all_cookies()
+        only reaches the current page's domain, so every domain's cookies are
+        cleared through the browser itself.
+        Returns: Boolean, whether every cookie could be cleared
+        """
+        driver.execute_script(RESET_SCRIPT)
+        if hasattr(driver, 'execute_cdp_cmd'):
+            # Chrome
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        elif driver.name == 'phantomjs':
+            driver.command_executor._commands['executePhantomScript'] = \
+                ('POST', '/session/$sessionId/phantom/execute')
+            driver.execute('executePhantomScript', {'script': PHANTOM_CLEAR_COOKIES_SCRIPT, 'args': []})
+        else:
+            return False
+        driver.get('about:blank')
+        return True
+
+    def discard(self, driver):
+        """
+        Quits driver and forgets it
+        """
+        with self.lock:
+            self.browsers.pop(driver, None)
+            self.jobs.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Quits every idle driver
+        """
+        with self.lock:
+            idle = [driver for drivers in self.idle.values() for driver in drivers]
+            self.idle = {}
+        for driver in idle:
+            self.discard(driver)
@@ -0,0 +1,446 @@
+"""
+Module for serving stand-in Netflix, Hulu and Amazon login and history pages
+locally, so extraction can be run and timed without real accounts
+"""
+# !/usr/bin/python3
+
+from datetime import date, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+import zlib
+
+# Cookies the stand-in pages use to remember the login and the chosen Netflix profile
+SESSION_COOKIE = 'fixture_session'
+PROFILE_COOKIE = 'fixture_profile'
+
+# Path each service's login page is served at, the same as in userconfig.ini
+LOGIN_PATHS = {
+    'AMAZON': '/gp/sign-in.html',
+    'HULU': '/welcome',
+    'NETFLIX': '/Login'
+}
+
+# Rows on each history page (Hulu and Amazon) or in each batch loaded by scrolling (Netflix)
+PAGE_SIZES = {
+    'AMAZON': 50,
+    'HULU': 20,
+    'NETFLIX': 20
+}
+
+# Netflix build identifier the stand-in API is versioned with
+BUILD_IDENTIFIER = 'fixture'
+
+# Profiles on the stand-in Netflix account
+PROFILES = ['Bench', 'Kids']
+
+# Made-up history the pages are filled with
+SERIES = ['The Office (U.S.)', 'Parks and Recreation', 'Seinfeld', 'Brooklyn Nine-Nine',
+          'Stranger Things', 'The Crown', 'Friends', 'Broad City']
+MOVIES = ['Okja', 'Roma', 'The Irishman', 'Bird Box', 'Manchester by the Sea', 'Paddington 2']
+NEWEST_DATE = date(2019, 3, 31)
+
+# Netflix 'Viewing activity' page: appends the next batch of rows whenever
+# the page is scrolled to the bottom, until the API returns a short batch
+NETFLIX_SCROLL_SCRIPT = '''
+var next = 1, size = %d, loading = false, finished = %s;
+function more() {
+    if (loading || finished) { return; }
+    if (window.innerHeight + window.pageYOffset < document.body.scrollHeight - 100) { return; }
+    loading = true;
+    var request = new XMLHttpRequest();
+    request.open('GET', '/api/shakti/%s/viewingactivity?pg=' + next + '&pgSize=' + size);
+    request.onload = function () {
+        var items = JSON.parse(request.responseText).viewedItems;
+        var list = document.getElementById('activity');
+        for (var i = 0; i < items.length; i++) {
+            var item = items[i];
+            var title = item.seriesTitle
+                ? [item.seriesTitle, item.seasonDescriptor, item.episodeTitle].join(': ') : item.title;
+            var row = document.createElement('li');
+            row.className = 'retableRow';
+            var cell = document.createElement('div');
+            cell.className = 'col date nowrap';
+            cell.textContent = item.dateStr;
+            row.appendChild(cell);
+            cell = document.createElement('div');
+            cell.className = 'col title';
+            cell.textContent = title;
+            row.appendChild(cell);
+            list.appendChild(row);
+        }
+        next += 1;
+        finished = items.length < size;
+        loading = false;
+    };
+    request.send();
+}
+window.addEventListener('scroll', more);
+// Rows removed while scrolling can leave the page at the bottom without a scroll event
+setInterval(more, 100);
+'''
+
+
+def make_entry(index):
+    """
+    Returns the index'th newest entry of the made-up history, the same on every run
+    Returns: dict with 'date', 'series', 'season', 'episode' and 'title'
+    """
+    day = NEWEST_DATE - timedelta(days=index // 3)
+    if index % 5 == 4:
+        return {'date': day, 'series': None, 'season': None, 'episode': None,
+                'title': MOVIES[index // 5 % len(MOVIES)]}
+    return {'date': day, 'series': SERIES[index % len(SERIES)], 'season': index // 40 % 6 + 1,
+            'episode': index % 23 + 1, 'title': 'Chapter %d' % (index % 97 + 1)}
+
+
+def netflix_title(entry):
+    """
+    Returns an entry's title the way Netflix shows it, e.g. 'Series: Season 2: Episode'
+    """
+    if entry['series'] is None:
+        return entry['title']
+    return '%s: Season %d: %s' % (entry['series'], entry['season'], entry['title'])
+
+
+def netflix_date(entry):
+    """
+    Returns an entry's date the way Netflix shows it, e.g. '3/14/19'
+    """
+    return '%d/%d/%s' % (entry['date'].month, entry['date'].day, entry['date'].strftime('%y'))
+
+
+def page(title, body, script=''):
+    """
+    Returns a complete HTML page
+    """
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s</title></head>'
+            '<body>%s<script>%s</script></body></html>' % (escape(title), body, script))
+
+
+class FixtureServer:
+
+    """
+    Serves the login and history pages of one service on 127.0.0.1, with a
+    made-up history of rows entries and latency seconds added to every
+    response. site and login_url are what an extraction is pointed at.
+
+    With an encoding ('gzip' or 'deflate') responses are compressed for
+    clients that accept it, as the real sites do.
+    """
+
+    def __init__(self, service, rows=1000, latency=0.0, page_size=None, port=0, encoding=None):
+        self.service = service
+        self.rows = rows
+        self.latency = latency
+        self.page_size = page_size or PAGE_SIZES[service]
+        self.encoding = encoding
+        # Requests answered, and connections they came in on
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+        self.server.daemon_threads = True
+        self.server.fixture = self
+        self.site = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.login_url = self.site + LOGIN_PATHS[service]
+        self.thread = None
+
+    def start(self):
+        """
+        Starts serving in a background thread
+        Returns: self
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def entries(self, first, count):
+        """
+        Returns up to count entries of the history starting at first
+        """
+        return [make_entry(index) for index in range(first, min(first + count, self.rows))]
+
+    def last_page(self):
+        """
+        Returns the number of history pages
+        """
+        return max(1, -(-self.rows // self.page_size))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+
+    """
+    Answers requests for the pages of the FixtureServer it belongs to
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        fixture = self.server.fixture
+        with fixture.lock:
+            fixture.connections += 1
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        # Login forms are the only thing posted, and their fields aren't checked
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        """
+        Routes a request to the current service's pages
+        """
+        fixture = self.server.fixture
+        with fixture.lock:
+            fixture.requests += 1
+        if fixture.latency:
+            time.sleep(fixture.latency)
+
+        parts = urlsplit(self.path)
+        self.query = dict((key, values[0]) for key, values in parse_qs(parts.query).items())
+        self.cookies = {}
+        for pair in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = pair.strip().partition('=')
+            self.cookies[name] = value
+        self.logged_in = self.cookies.get(SESSION_COOKIE) == 'ok'
+
+        route = getattr(self, '%s_%s' % (fixture.service.lower(), method.lower()))
+        route(parts.path)
+
+    def respond(self, body, content_type='text/html; charset=utf-8', status=200, cookies=(), location=None):
+        """
+        Sends a response with the given body, cookies to set and redirect location
+        """
+        data = body.encode('utf8')
+        encoding = self.server.fixture.encoding
+        if encoding is not None and encoding in (self.headers.get('Accept-Encoding') or ''):
+            data = gzip.compress(data) if encoding == 'gzip' else zlib.compress(data)
+        else:
+            encoding = None
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        for cookie in cookies:
+            self.send_header('Set-Cookie', cookie + '; Path=/')
+        if location is not None:
+            self.send_header('Location', location)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def redirect(self, location, cookies=()):
+        self.respond('', status=302, cookies=cookies, location=location)
+
+    def not_found(self):
+        self.respond(page('Not found', '<h1>Not found</h1>'), status=404)
+
+    def page_number(self):
+        """
+        Returns the page number asked for in the query, 1 if none
+        """
+        try:
+            return max(1, int(self.query.get('page', 1)))
+        except ValueError:
+            return 1
+
+    # Amazon
+
+    def amazon_login_form(self):
+        return page('Amazon Sign-In',
+                    '<form method="post" action="%s">'
+                    '<input type="email" id="ap_email" name="email">'
+                    '<input type="password" id="ap_password" name="password">'
+                    '<input type="submit" id="signInSubmit" value="Sign-In">'
+                    '</form>' % LOGIN_PATHS['AMAZON'])
+
+    def amazon_get(self, path):
+        fixture = self.server.fixture
+        if path == LOGIN_PATHS['AMAZON']:
+            return self.respond(self.amazon_login_form())
+        if path == '/':
+            return self.respond(page('Amazon', '<h1>Amazon</h1>'))
+        if not path.startswith('/gp/yourstore/iyr'):
+            return self.not_found()
+        if not self.logged_in:
+            return self.respond(self.amazon_login_form())
+
+        number = self.page_number()
+        rows = []
+        for index, entry in enumerate(fixture.entries((number - 1) * fixture.page_size, fixture.page_size)):
+            title = entry['title'] if entry['series'] is None else '%s - Season %d' % (entry['series'], entry['season'])
+            rows.append('<div class="iyrListItem"><span id="iyrListItemTitle_%d">%s</span></div>'
+                        % (index, escape(title)))
+        links = ''
+        if number < fixture.last_page():
+            links = ('<a id="iyrNext" href="/gp/yourstore/iyr/ref=pd_ys_iyr_next?ie=UTF8&amp;collection=watched'
+                     '&amp;page=%d">Next</a>' % (number + 1))
+        self.respond(page('Your Watched Videos', ''.join(rows) + links))
+
+    def amazon_post(self, path):
+        if path != LOGIN_PATHS['AMAZON']:
+            return self.not_found()
+        self.redirect('/', ['%s=ok' % SESSION_COOKIE])
+
+    # Hulu
+
+    def hulu_get(self, path):
+        fixture = self.server.fixture
+        if path == LOGIN_PATHS['HULU']:
+            return self.respond(page(
+                'Hulu',
+                '<a class="login" href="#" onclick="document.getElementById(\'login-iframe\')'
+                '.style.display = \'block\'; return false;">Log In</a>'
+                '<iframe id="login-iframe" src="/login-frame" style="display: none" width="400" height="300">'
+                '</iframe>'))
+        if path == '/login-frame':
+            return self.respond(page(
+                'Log In',
+                '<form method="post" action="/login-frame">'
+                '<input type="button" name="dummy_login" value="Log in with email">'
+                '<input type="email" id="user_email" name="email">'
+                '<input type="password" id="password" name="password">'
+                '<button type="submit" class="btn-login">Log In</button>'
+                '</form>'))
+        if path == '/':
+            return self.respond(page('Hulu', '<a href="/tv">TV</a>'))
+        if path != '/account/history':
+            return self.not_found()
+        if not self.logged_in:
+            return self.redirect(LOGIN_PATHS['HULU'])
+
+        number = self.page_number()
+        rows = []
+        for entry in fixture.entries((number - 1) * fixture.page_size, fixture.page_size):
+            cells = ['<div class="title">%s</div>' % escape(entry['series'] or entry['title'])]
+            if entry['series'] is not None:
+                cells.append('<div class="episode">S%d E%d %s</div>'
+                             % (entry['season'], entry['episode'], escape(entry['title'])))
+            cells.append('<div class="date">%s</div>' % entry['date'].strftime('%m/%d/%Y'))
+            rows.append('<div class="beaconid">%s</div>' % ''.join(cells))
+
+        # Pagination is shown above and below the rows, and hidden on the last page
+        last_page = fixture.last_page()
+        style = ' style="display: none"' if number >= last_page else ''
+        pagination = ('<div class="pagination"><a class="next-page-button" href="/account/history?page=%d"%s>'
+                      'Next</a><button class="last-page-button">%d</button></div>' % (number + 1, style, last_page))
+        self.respond(page('History', pagination + ''.join(rows) + pagination))
+
+    def hulu_post(self, path):
+        if path != '/login-frame':
+            return self.not_found()
+        # The login frame shows the site's links once logged in
+        self.respond(page('Hulu', '<a href="/tv" target="_top">TV</a>'), cookies=['%s=ok' % SESSION_COOKIE])
+
+    # Netflix
+
+    def netflix_get(self, path):
+        fixture = self.server.fixture
+        if path == LOGIN_PATHS['NETFLIX']:
+            return self.respond(page(
+                'Netflix',
+                '<form method="post" action="%s">'
+                '<input type="email" name="email">'
+                '<input type="password" name="password">'
+                '<button type="submit" class="login-button">Sign In</button>'
+                '</form>' % LOGIN_PATHS['NETFLIX']))
+        if not self.logged_in:
+            return self.redirect(LOGIN_PATHS['NETFLIX'])
+
+        if path == '/ProfilesGate' or (path == '/browse' and PROFILE_COOKIE not in self.cookies):
+            profiles = ''.join(
+                '<li><a href="/SwitchProfile?name=%s"><div class="profile-icon" '
+                'style="width: 100px; height: 100px; background: #c00"></div>'
+                '<span class="profile-name">%s</span></a></li>' % (escape(name), escape(name))
+                for name in PROFILES)
+            return self.respond(page('Netflix', '<h1>Who\'s watching?</h1><ul>%s</ul>' % profiles))
+        if path == '/SwitchProfile':
+            return self.redirect('/browse', ['%s=%s' % (PROFILE_COOKIE, self.query.get('name', PROFILES[0]))])
+        if path == '/browse':
+            return self.respond(page(
+                'Netflix',
+                '<div class="account-menu"><div class="profile-icon" '
+                'style="width: 32px; height: 32px; background: #c00"></div>'
+                '<a href="/YourAccount">Your Account</a></div>',
+                'var netflix = {reactContext: {models: {serverDefs: {data: {BUILD_IDENTIFIER: %s}}}}};'
+                % json.dumps(BUILD_IDENTIFIER)))
+        if path == '/YourAccount':
+            return self.respond(page('Account', '<a href="/viewingactivity">Viewing activity</a>'))
+        if path == '/viewingactivity':
+            rows = ''.join('<li class="retableRow"><div class="col date nowrap">%s</div>'
+                           '<div class="col title"><a href="/title/%d">%s</a></div></li>'
+                           % (netflix_date(entry), index, escape(netflix_title(entry)))
+                           for index, entry in enumerate(fixture.entries(0, fixture.page_size)))
+            finished = 'true' if fixture.rows <= fixture.page_size else 'false'
+            return self.respond(page('Viewing Activity', '<ul id="activity" class="retable">%s</ul>' % rows,
+                                     NETFLIX_SCROLL_SCRIPT % (fixture.page_size, finished, BUILD_IDENTIFIER)))
+        if path == '/api/shakti/%s/viewingactivity' % BUILD_IDENTIFIER:
+            number = int(self.query.get('pg', 0))
+            size = int(self.query.get('pgSize', fixture.page_size))
+            items = []
+            for entry in fixture.entries(number * size, size):
+                item = {'title': entry['title'], 'dateStr': netflix_date(entry)}
+                if entry['series'] is not None:
+                    item.update({'seriesTitle': entry['series'],
+                                 'seasonDescriptor': 'Season %d' % entry['season'],
+                                 'episodeTitle': entry['title']})
+                items.append(item)
+            return self.respond(json.dumps({'page': number, 'size': size, 'viewedItems': items}),
+                                'application/json')
+        if path == '/viewingactivitycsv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['Title', 'Date'])
+            for entry in fixture.entries(0, fixture.rows):
+                writer.writerow([netflix_title(entry), netflix_date(entry)])
+            return self.respond(buffer.getvalue(), 'text/csv; charset=utf-8')
+        self.not_found()
+
+    def netflix_post(self, path):
+        if path != LOGIN_PATHS['NETFLIX']:
+            return self.not_found()
+        # A new login starts at the profile selection
+        self.redirect('/browse', ['%s=ok' % SESSION_COOKIE,
+                                  '%s=; Max-Age=0' % PROFILE_COOKIE])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Serves stand-in login and history pages of a service locally.')
+    parser.add_argument('service', help='Service to stand in for.')
+    parser.add_argument('--rows=', dest='rows', type=int, default=1000, help='Entries in the history.')
+    parser.add_argument('--latency=', dest='latency', type=float, default=0.0,
+                        help='Seconds added to every response.')
+    parser.add_argument('--port=', dest='port', type=int, default=8000, help='Port to serve on.')
+    parser.add_argument('--encoding=', dest='encoding', choices=['gzip', 'deflate'],
+                        help='Compress responses for clients that accept it.')
+    args = parser.parse_args()
+
+    fixture = FixtureServer(args.service.upper(), args.rows, args.latency, port=args.port, encoding=args.encoding)
+    print('Serving %d rows of %s history on %s' % (args.rows, fixture.service, fixture.site))
+    print('Extract with: python ActivityExtractor.py %s --site=%s' % (fixture.service.lower(), fixture.site))
+    try:
+        fixture.server.serve_forever()
+    except KeyboardInterrupt:
+        fixture.stop()
@@ -0,0 +1,174 @@
+"""
+Module for fetching history pages over plain HTTP with a browser's login cookies
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+import gzip
+import http.client
+import socket
+import threading
+import time
+import zlib
+
+
+class HttpError(http.client.HTTPException):
+
+    """
+    Raised for a page that was answered with an error status, e.g. 404 or a
+    500, once redirects are followed
+    """
+
+    def __init__(self, url, status):
+        super().__init__('%s answered with status %d' % (url, status))
+        self.url = url
+        self.status = status
+
+
+# What fetching a page can fail with: error statuses, and broken or timed out connections
+FETCH_ERRORS = (http.client.HTTPException, OSError)
+
+
+class HttpEngine:
+
+    """
+    Fetches pages over keep-alive HTTP connections using the cookies of a
+    logged-in WebDriver session, with up to workers requests in flight
+
+    If limiter is given (see ratelimit.py) every request waits for its budget,
+    and throttled or timed out requests slow it down.
+    """
+
+    def __init__(self, driver, workers=4, timeout=30, limiter=None):
+        self.cookies = driver.get_cookies()
+        self.user_agent = driver.execute_script('return navigator.userAgent;')
+        self.timeout = timeout
+        self.limiter = limiter
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Every worker thread keeps one connection per host
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.requests = 0
+        self.bytes = 0
+
+    def connection(self, scheme, host):
+        """
+        Returns the current thread's open connection to host, opening one if needed
+        """
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        key = (scheme, host)
+        if key not in self.local.connections:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            self.local.connections[key] = connection
+            with self.lock:
+                self.connections.append(connection)
+        return self.local.connections[key]
+
+    def drop_connection(self, scheme, host):
+        """
+        Closes the current thread's connection to host, e.g. after the server dropped it
+        """
+        connection = self.local.connections.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def cookie_header(self, host, path, secure):
+        """
+        Returns the Cookie header the browser would send to host and path
+        """
+        host = host.split(':')[0]
+        pairs = []
+        for cookie in self.cookies:
+            domain = cookie.get('domain', host).lstrip('.')
+            if host != domain and not host.endswith('.' + domain):
+                continue
+            if not path.startswith(cookie.get('path', '/')):
+                continue
+            if cookie.get('secure') and not secure:
+                continue
+            pairs.append('%s=%s' % (cookie['name'], cookie['value']))
+        return '; '.join(pairs)
+
+    def fetch(self, url, redirects=5):
+        """
+        Fetches url, following redirects
+        Returns: (final url, page text)
+        Raises: HttpError if the page is answered with an error status
+        """
+        parts = urlsplit(url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        headers = {
+            'User-Agent': self.user_agent,
+            'Accept': 'text/html,application/xhtml+xml',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Cookie': self.cookie_header(parts.netloc, parts.path or '/', parts.scheme == 'https')
+        }
+
+        # A kept-alive connection may have been closed by the server, so retry once on a new one
+        for attempt in range(2):
+            if self.limiter is not None:
+                self.limiter.wait()
+            connection = self.connection(parts.scheme, parts.netloc)
+            start = time.time()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as error:
+                self.drop_connection(parts.scheme, parts.netloc)
+                if self.limiter is not None and isinstance(error, socket.timeout):
+                    self.limiter.report('timeout')
+                if attempt == 1:
+                    raise
+                continue
+
+            # Asked too quickly, so back off and ask again
+            if response.status in (429, 503) and self.limiter is not None and attempt == 0:
+                self.limiter.report('throttled')
+                continue
+            if self.limiter is not None:
+                self.limiter.success(time.time() - start)
+            break
+
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location') and redirects > 0:
+            return self.fetch(urljoin(url, response.getheader('Location')), redirects - 1)
+        if not 200 <= response.status < 300:
+            raise HttpError(url, response.status)
+
+        encoding = response.getheader('Content-Encoding', '')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+
+        charset = response.headers.get_content_charset() or 'utf-8'
+        return url, body.decode(charset, errors='replace')
+
+    def fetch_all(self, urls):
+        """
+        Fetches every url concurrently
+        Returns: list of (final url, page text) in the order of urls
+        Raises: one of FETCH_ERRORS if any of them fails
+        """
+        return list(self.executor.map(self.fetch, urls))
+
+    def close(self):
+        """
+        Stops the worker threads and closes every connection
+        """
+        self.executor.shutdown()
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        print('HTTP engine made %d request(s), %d KB' % (self.requests, self.bytes / 1024))
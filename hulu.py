@@ -1,15 +1,39 @@
 #!/usr/bin/python3
 
-from selenium import webdriver
 from selenium.common.exceptions \
-    import TimeoutException, NoSuchElementException, ElementNotVisibleException, WebDriverException
+    import TimeoutException, ElementNotVisibleException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from http_engine import HttpEngine, FETCH_ERRORS
+import bulk
+import collections
 import common
+import drivers
+import profiling
+import progress
+import ratelimit
+import rowparser
+import selector_cache
+import sessions
 
 SERVICE = 'HULU'
 
+HISTORY_URL = 'https://secure.hulu.com/account/history'
+
+# Close buttons of pop-ups that may cover the welcome page
+POPUP_SELECTORS = ['.lightbox-close', '.cancel']
+
+# History page opened directly by number
+PAGE_URL = HISTORY_URL + '?page=%d'
+
+# Each 'beaconid' row is read as a whole
+ROW_SPEC = {
+    'rows': '.beaconid',
+    'cells': None,
+    'fields': ['text']
+}
+
 
 class HuluActivityExtractor:
 
@@ -19,15 +43,30 @@ class HuluActivityExtractor:
 
     def __init__(self, parameters):
         self.parameters = parameters
+        # Pages are loaded from parameters['site'] instead if it is given
+        self.history_url = common.site_url(parameters, HISTORY_URL)
+        self.page_url = common.site_url(parameters, PAGE_URL)
         self.driver = None
-        self.activity_list = []
+        # Paces requests to Hulu, see ratelimit.py
+        self.limiter = None
+        self.session = None
+        # What the activity is written into, see common.open_output
+        self.output = None
+        # Rows written by the run, None unless it finished
+        self.rows = None
+        # Rows of the page read last, and of the first page
+        self.last_rows = []
+        self.first_rows = []
 
     def get_activity(self):
         """
         The main function that lets the user download their Hulu activity
+        Returns: number of rows written, or None if the run didn't finish
         """
         self.login_hulu()
+        return self.rows
 
+    @profiling.phase('login')
     def login_hulu(self):
         """
         Logs into Hulu
@@ -37,19 +76,26 @@ class HuluActivityExtractor:
         # Keep track of whether login was successful
         logged_in = True
 
-        # Initialising PhantomJS driver
-        self.driver = webdriver.Chrome()
-        self.driver.get(self.parameters['url'])
+        # Initialising driver
+        self.driver = drivers.get_driver(self.parameters, SERVICE)
+        self.limiter = ratelimit.for_service(SERVICE, self.history_url)
 
-        # Close potential pop-ups
-        try:
-            self.driver.find_element_by_class_name('lightbox-close').click()
-        except NoSuchElementException:
-            pass
-        try:
-            self.driver.find_element_by_class_name('cancel').click()
-        except NoSuchElementException:
-            pass
+        # Skip the login flow if a saved session is still valid
+        if self.parameters.get('sessions', True):
+            self.session = sessions.SessionStore(SERVICE, self.parameters['email'], self.parameters['password'])
+            if self.session.restore(self.driver, self.history_url, self.is_logged_in):
+                self.navigate_pages()
+                return
+
+        with self.limiter.request():
+            self.driver.get(common.site_url(self.parameters, self.parameters['url']))
+
+        # Close potential pop-ups, checking for all of them in one call
+        for selector in selector_cache.visible(self.driver, POPUP_SELECTORS):
+            try:
+                self.driver.find_element_by_css_selector(selector).click()
+            except WebDriverException:
+                pass
 
         # Press login to open up login window
         try:
@@ -73,14 +119,17 @@ class HuluActivityExtractor:
         # Typing in user's password
         self.driver.find_element_by_id('password').send_keys(self.parameters['password'])
 
-        # Clicking on submit button
+        # Clicking on submit button, logins being what Hulu is quickest to answer with a reCAPTCHA
+        self.limiter.wait()
         self.driver.find_element_by_class_name('btn-login').click()
 
         # Sometimes Hulu displays a reCAPTCHA container
-        # Incase that happens, ask user to retry script in a few minutes
+        # Incase that happens, ask user to retry script in a few minutes,
+        # and slow down later logins to Hulu
         try:
             WebDriverWait(self.driver, 5).until(EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, 'reCAPTCHA')))
             print('A reCAPTCHA appeared, try running script again in a few minutes.')
+            self.limiter.report('captcha')
         except TimeoutException:
             pass
 
@@ -96,11 +145,15 @@ class HuluActivityExtractor:
 
         # Only navigate site if login was successful
         if logged_in:
+            # Save the logged-in session for later runs
+            if self.session is not None:
+                self.session.save(self.driver.get_cookies())
             self.navigate_site()
         else:
             print('Error: Incorrect Credentials.\n' 
                   + '       Please check if you entered the correct email and password in \'userconfig.ini\'')
 
+    @profiling.phase('navigation')
     def navigate_site(self):
         """
         Navigates to 'History' page
@@ -108,11 +161,24 @@ class HuluActivityExtractor:
         # Wait for browse page to load
         print('Navigating Site')
 
-        self.driver.get('https://secure.hulu.com/account/history')
+        with self.limiter.request():
+            self.driver.get(self.history_url)
 
         # Call next function to get viewing activity and proceed to next pages
         self.navigate_pages()
 
+    @profiling.phase('login')
+    def is_logged_in(self):
+        """
+        Checks whether the browser session is logged in, leaving it on the 'History' page
+        Returns: Boolean
+        """
+        with self.limiter.request():
+            self.driver.get(self.history_url)
+        # Logged out sessions are redirected away from the history page
+        return 'account/history' in self.driver.current_url
+
+    @profiling.phase('navigation')
     def navigate_pages(self):
         """
         Scrolls to bottom of 'Watch History' page
@@ -120,8 +186,8 @@ class HuluActivityExtractor:
 
         print('Retrieving viewing activity')
 
-        # List that is filled with strings of viewing activity
-        self.activity_list = []
+        # Output that viewing activity is streamed into page by page
+        self.output = common.open_output(SERVICE, self.parameters)
 
         last_page = 1
         current_page = 1
@@ -131,33 +197,197 @@ class HuluActivityExtractor:
         except:
             pass
 
-        print('Progress:')
-        done = False
+        # A site that ignores page numbers shows the first page for every one of them,
+        # which a resumed run can't tell from the page it read last
+        self.first_rows = bulk.extract_rows(self.driver, ROW_SPEC)
+
+        if self.output.resume_state is not None:
+            current_page = common.resume_page(self.driver, self.output.resume_state, self.next_page)
+
+        # Number of pages to load at once when opening pages directly by number
+        window = self.parameters.get('window') or 1
+
+        if current_page is not None and self.parameters.get('engine') == 'http':
+            page = self.read_pages_over_http(current_page, last_page, window)
+            if page is not None:
+                print('Pages can\'t be fetched over HTTP, using the browser')
+                if not self.skip_pages(page - current_page):
+                    page = None
+            current_page = page
+
+        done = current_page is None
         while not done:
-            self.get_page_activity(last_page, current_page)
-            try:
-                self.driver.find_elements_by_class_name('next-page-button')[1].click()
+            reached = self.get_page_activity(last_page, current_page)
+            self.output.checkpoint(page=current_page, url=self.driver.current_url)
+            if reached:
+                done = True
+            elif window > 1 and current_page < last_page:
+                read_page = self.fetch_pages(current_page, last_page, window)
+                done = read_page is None
+                if not done:
+                    # Carry on from the page after the last one read, one page at a time
+                    print('Pages can\'t be opened by number, reading them one at a time')
+                    window = 1
+                    done = not self.skip_pages(read_page + 1 - current_page)
+                    current_page = read_page + 1
+            elif self.next_page():
                 current_page += 1
-            except ElementNotVisibleException:
+            else:
                 done = True
 
-        print('\t[' + ('#' * 20) + ']' + ' 100%')
         # Close driver
-        self.driver.close()
+        drivers.release_driver(self.parameters, self.driver)
+
+        self.rows = self.output.finish()
+
+    @profiling.phase('extraction')
+    def read_pages_over_http(self, current_page, last_page, window):
+        """
+        Reads pages current_page to last_page over plain HTTP with the
+        browser's cookies, fetching window pages at a time by number
+        Returns: None once done, or the first page that has to be read in the
+                 browser because it couldn't be fetched, or not by number
+        """
+        print('Fetching pages over HTTP')
+        engine = HttpEngine(self.driver, workers=window, limiter=self.limiter)
+        previous_rows = None
+        try:
+            for first in range(current_page, last_page + 1, window):
+                pages = range(first, min(first + window, last_page + 1))
+                try:
+                    fetched = engine.fetch_all([self.page_url % page for page in pages])
+                except FETCH_ERRORS as error:
+                    print('Page %d couldn\'t be fetched: %s' % (first, error))
+                    return first
+                for page, (url, html) in zip(pages, fetched):
+                    row_list = rowparser.parse_rows(html, ROW_SPEC)
+                    if self.ignored_page_number(row_list, previous_rows, page):
+                        return page
+                    previous_rows = row_list
+
+                    self.output.record(html, page)
+                    reached = self.add_page(row_list, last_page, page)
+                    self.output.checkpoint(page=page, url=self.page_url % page)
+                    if reached:
+                        return None
+            return None
+        finally:
+            engine.close()
+
+    @profiling.phase('navigation')
+    def skip_pages(self, count):
+        """
+        Clicks through count pages without reading them
+        Returns: Boolean, False if there were fewer pages left
+        """
+        return all(self.next_page() for _ in range(count))
+
+    @profiling.phase('navigation')
+    def next_page(self):
+        """
+        Clicks through to the next page of viewing activity
+        Returns: Boolean
+        """
+        self.limiter.wait()
+        try:
+            self.driver.find_elements_by_class_name('next-page-button')[1].click()
+            return True
+        except ElementNotVisibleException:
+            return False
+
+    @profiling.phase('navigation')
+    def fetch_pages(self, current_page, last_page, window):
+        """
+        Reads the pages after current_page by opening them directly by number,
+        keeping up to window of them loading at once in separate tabs, and
+        writes them out in page order
+        Returns: None once done, or the last page read if pages can't be opened by number
+        """
+        main_window = self.driver.current_window_handle
+        tabs = collections.OrderedDict()
+        next_page = current_page + 1
+        previous_rows = self.last_rows
+
+        try:
+            while tabs or next_page <= last_page:
+                # Keep the window full
+                while len(tabs) < window and next_page <= last_page:
+                    tabs[next_page] = self.open_tab(self.page_url % next_page)
+                    next_page += 1
+
+                page, handle = tabs.popitem(last=False)
+                self.driver.switch_to.window(handle)
+                row_list = self.wait_for_rows()
+                html = self.driver.page_source if self.output.recording else None
+                self.driver.close()
+
+                if self.ignored_page_number(row_list, previous_rows, page):
+                    return page - 1
+                previous_rows = row_list
+
+                self.output.record(html, page)
+                reached = self.add_page(row_list, last_page, page)
+                self.output.checkpoint(page=page, url=self.page_url % page)
+                if reached:
+                    return None
+            return None
+        finally:
+            for handle in tabs.values():
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.driver.switch_to.window(main_window)
+
+    def ignored_page_number(self, row_list, previous_rows, page):
+        """
+        Tells whether page, opened by number, shows no rows, the rows of the
+        page before or (past the first page) those of the first page, as it
+        does when the site ignores the page number
+        Returns: Boolean
+        """
+        return not row_list or row_list == previous_rows or (page > 1 and row_list == self.first_rows)
+
+    @profiling.phase('navigation')
+    def open_tab(self, url):
+        """
+        Opens url in a new tab without switching to it
+        Returns: the new tab's window handle
+        """
+        self.limiter.wait()
+        handles = set(self.driver.window_handles)
+        self.driver.execute_script('window.open(arguments[0]);', url)
+        return (set(self.driver.window_handles) - handles).pop()
 
-        common.output_activity(SERVICE, self.activity_list)
+    @profiling.phase('extraction')
+    def wait_for_rows(self):
+        """
+        Waits for the current tab's rows to appear and reads them
+        Returns: list of rows, empty if none appeared in time
+        """
+        try:
+            return WebDriverWait(self.driver, 10).until(lambda driver: bulk.extract_rows(driver, ROW_SPEC))
+        except TimeoutException:
+            self.limiter.report('timeout')
+            return []
 
+    @profiling.phase('extraction')
     def get_page_activity(self, last_page, current_page):
         """
         Gets all viewing activity on current page
+        Returns: Boolean, whether an incremental run reached activity it already has
+        """
+        # Read every row on the current page in one call
+        row_list = bulk.extract_rows(self.driver, ROW_SPEC)
+        if self.output.recording:
+            self.output.record(self.driver.page_source, current_page)
+        return self.add_page(row_list, last_page, current_page)
+
+    def add_page(self, row_list, last_page, current_page):
+        """
+        Writes out the rows read from a page
+        Returns: Boolean, whether an incremental run reached activity it already has
         """
-        # List that contains all row elements on viewing activity page
-        row_list = self.driver.find_elements_by_class_name('beaconid')
+        self.last_rows = row_list
+        reached = self.output.write(row_list)
+        progress.set_page(current_page, last_page)
 
-        for row, i in zip(row_list, range(len(row_list))):
-            self.activity_list.append(row.text + '\n')
-            page_percent_comp = i / len(row_list)
-            percent_comp = page_percent_comp * (current_page / last_page)
-            fill_bar = round(19 * percent_comp)
-            print('\t[' + ('#' * fill_bar) + (' ' * (20 - fill_bar)) + '] ' + str(round(percent_comp * 100)) + '%',
-                  end='\r')
+        return reached
@@ -1,17 +1,118 @@
 #!/usr/bin/python3
 
-from selenium import webdriver
 from selenium.common.exceptions \
-    import StaleElementReferenceException, WebDriverException, TimeoutException, NoSuchElementException
+    import TimeoutException, NoSuchElementException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
+from scroll import InfiniteScroller
+from selector_cache import SelectorCache
+import bulk
 import common
-import time
+import csv
+import drivers
+import io
+import profiling
+import progress
+import ratelimit
+import re
+import sessions
 
 SERVICE = 'NETFLIX'
 
+PROFILES_URL = 'https://www.netflix.com/browse'
+
+# Page that lists the account's profiles to switch between
+PROFILE_GATE_URL = 'https://www.netflix.com/ProfilesGate'
+
+# Each 'retableRow' holds the date in its first div and the title in its second
+ROW_SPEC = {
+    'rows': '.retableRow',
+    'cells': 'div',
+    'fields': ['date', 'title']
+}
+
+# Elements that open the account menu when hovered, depending on how the site is displayed
+ACCOUNT_MENU_SELECTORS = [
+    '.profile-icon',
+    '.profile-name',
+    '.profile-arrow',
+    '.avatar',
+    '.profile-link',
+    '.account-dropdown-button',
+    '.account-menu-item',
+    '.current-profile'
+]
+
+# JSON API behind the 'Viewing activity' page, and how much of it to fetch per call
+ACTIVITY_API_URL = '/api/shakti/%s/viewingactivity'
+PAGE_SIZE = 100
+PAGES_PER_CALL = 5
+
+# Times a throttled API call is retried after backing off
+API_RETRIES = 3
+
+# Statuses the API answers with when asked too quickly
+THROTTLED_STATUSES = (': 429', ': 503')
+
+# CSV behind the 'Download all' link of the 'Viewing activity' page
+ACTIVITY_CSV_URL = '/viewingactivitycsv'
+
+# Build identifier the API URL is versioned with, or null if the page doesn't expose it
+BUILD_ID_SCRIPT = '''
+try { return netflix.reactContext.models.serverDefs.data.BUILD_IDENTIFIER; } catch (e) {}
+try { return netflix.appContext.state.model.models.serverDefs.data.BUILD_IDENTIFIER; } catch (e) {}
+return null;
+'''
+
+# Fetches several API pages at once and returns each page's rows, or an error
+ACTIVITY_API_SCRIPT = '''
+var url = arguments[0], pages = arguments[1], size = arguments[2];
+var done = arguments[arguments.length - 1];
+var results = [], remaining = pages.length, failed = false;
+pages.forEach(function (page, index) {
+    var request = new XMLHttpRequest();
+    request.open('GET', url + '?pg=' + page + '&pgSize=' + size);
+    request.withCredentials = true;
+    request.onload = function () {
+        if (failed) { return; }
+        try {
+            var data = JSON.parse(request.responseText);
+            results[index] = (data.viewedItems || []).map(function (item) {
+                var title = item.seriesTitle
+                    ? [item.seriesTitle, item.seasonDescriptor, item.episodeTitle || item.title]
+                        .filter(function (part) { return part; }).join(': ')
+                    : item.title;
+                return {date: item.dateStr || '', title: title || ''};
+            });
+        } catch (e) {
+            failed = true;
+            done({error: 'page ' + page + ': ' + request.status});
+            return;
+        }
+        if (--remaining === 0) { done({pages: results}); }
+    };
+    request.onerror = function () {
+        if (!failed) { failed = true; done({error: 'page ' + page + ': request failed'}); }
+    };
+    request.send();
+});
+'''
+
+# Fetches a URL with the page's cookies and returns its text, or an error
+FETCH_TEXT_SCRIPT = '''
+var done = arguments[arguments.length - 1];
+var request = new XMLHttpRequest();
+request.open('GET', arguments[0]);
+request.withCredentials = true;
+request.onload = function () {
+    done(request.status === 200 ? {text: request.responseText} : {error: String(request.status)});
+};
+request.onerror = function () { done({error: 'request failed'}); };
+request.send();
+'''
+
 
 class NetflixActivityExtractor:
 
@@ -21,14 +122,37 @@ class NetflixActivityExtractor:
 
     def __init__(self, parameters):
         self.parameters = parameters
+        # Pages are loaded from parameters['site'] instead if it is given
+        self.profiles_url = common.site_url(parameters, PROFILES_URL)
+        self.profile_gate_url = common.site_url(parameters, PROFILE_GATE_URL)
         self.driver = None
+        # Paces requests to Netflix, see ratelimit.py
+        self.limiter = None
+        self.session = None
+        self.scroller = None
+        # What the current profile's activity is written into, see common.open_output
+        self.output = None
+        # Whether the current profile's activity stopped loading part way
+        self.interrupted = False
+        # Rows written by the profiles that finished, None until one does
+        self.rows = None
+        # Name of the profile being extracted
+        self.profile = None
 
     def get_activity(self):
         """
         The main function that lets the user download their Netflix activity
+        Returns: number of rows written, or None if no profile's run finished
         """
-        self.login_netflix()
-
+        try:
+            self.login_netflix()
+        finally:
+            # Close driver
+            if self.driver is not None:
+                drivers.release_driver(self.parameters, self.driver)
+        return self.rows
+
+    @profiling.phase('login')
     def login_netflix(self):
         """
         Logs into Netflix
@@ -38,9 +162,18 @@ class NetflixActivityExtractor:
         # Keep track of whether login was successful
         logged_in = True
 
-        # Initialising PhantomJS driver
-        self.driver = webdriver.PhantomJS()
-        self.driver.get(self.parameters['url'])
+        # Initialising driver
+        self.driver = drivers.get_driver(self.parameters, SERVICE)
+        self.limiter = ratelimit.for_service(SERVICE, self.profiles_url)
+
+        # Skip the login flow if a saved session is still valid
+        if self.parameters.get('sessions', True):
+            self.session = sessions.SessionStore(SERVICE, self.parameters['email'], self.parameters['password'])
+            if self.session.restore(self.driver, self.profiles_url, self.is_logged_in):
+                self.get_active_profile()
+                return
+
+        self.driver.get(common.site_url(self.parameters, self.parameters['url']))
         mutli_page_login = False
 
         # Clearing email textbox and typing in user's email
@@ -69,6 +202,7 @@ class NetflixActivityExtractor:
             pass
 
         # Clicking on submit button
+        self.limiter.wait()
         self.driver.find_element_by_class_name('login-button').click()
 
         try:
@@ -80,93 +214,126 @@ class NetflixActivityExtractor:
             logged_in = False
 
         if logged_in:
+            # Save the logged-in session for later runs
+            if self.session is not None:
+                self.session.save(self.driver.get_cookies())
             self.get_active_profile()
         else:
             print('Error: Incorrect Credentials.\n' 
                   + '       Please check if you entered the correct email and password in \'userconfig.ini\'')
 
+    @profiling.phase('login')
+    def is_logged_in(self):
+        """
+        Checks whether the browser session is logged in, leaving it on the profiles page
+        Returns: Boolean
+        """
+        self.driver.get(self.profiles_url)
+        try:
+            WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.CLASS_NAME, 'profile-icon')))
+            return True
+        except TimeoutException:
+            return False
+
+    @profiling.phase('navigation')
     def get_active_profile(self):
         """
-        Selects Netflix profile
+        Selects Netflix profile, or with 'all_profiles' every profile in turn
+        """
+        # Obtain profile names
+        names = [user.text for user in self.driver.find_elements_by_class_name('profile-name')]
+
+        if self.parameters.get('all_profiles'):
+            selected = names
+            print('Found %d profile(s)' % len(names))
+        elif self.parameters['user'] in names:
+            selected = [self.parameters['user']]
+        else:
+            print('Error: Your profile name (\'%s\') was not found.\n' % self.parameters['user']
+                  + '       Please check if you entered the correct profile name in \'userconfig.ini\'')
+            return
+
+        for index, name in enumerate(selected):
+            if index > 0:
+                # Go back to the profile selection page for the next profile
+                self.driver.get(self.profile_gate_url)
+                WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.CLASS_NAME, 'profile-icon')))
+            print('Selecting Profile \'%s\'' % name)
+            self.profile = name
+            self.select_profile(name)
+            self.navigate_site()
+
+    @profiling.phase('navigation')
+    def select_profile(self, name):
+        """
+        Clicks the profile image associated with name
         """
-        # Obtain profiles and names
         profiles = self.driver.find_elements_by_class_name('profile-icon')
         users = self.driver.find_elements_by_class_name('profile-name')
+        for profile, user in zip(profiles, users):
+            if user.text == name:
+                profile.click()
+                return
 
-        # If profiles in empty, it means there is only one default profile on the account
-        if profiles is not None:
-            print('Selecting Profile')
-            # Iterate through names to check for a match with user's profile name
-            for i in range(len(profiles)):
-                try:
-                    if users[i].text == self.parameters['user']:
-                        # Click profile image associated with name
-                        profiles[i].click()
-                        self.navigate_site()
-                    elif i == len(profiles):
-                        print('Error: Your profile name (\'%s\') was not found.\n' % self.parameters['user']
-                              + '       Please check if you entered the correct profile name in \'userconfig.ini\'')
-                except StaleElementReferenceException:
-                    pass
-                except WebDriverException:
-                    pass
-
+    @profiling.phase('navigation')
     def navigate_site(self):
         """
         Navigates to 'Viewing Activity' page
         """
         # Wait for browse page to load
         WebDriverWait(self.driver, 10).until(EC.visibility_of_element_located((By.CLASS_NAME, 'profile-icon')))
-        print('Navigating Site')
-
-        time.sleep(1)
-        hover_clicked = self.hover_click()
-
-        # Navigate to page containing viewing activity
-        if hover_clicked:
-            self.driver.find_element_by_link_text('Viewing activity').click()
-            self.scroll_to_bottom()
-        else:
-            print('Closing Program')
 
+        try:
+            # The data behind the 'Viewing activity' page can be fetched from here,
+            # so the page only has to be opened and scrolled if that doesn't work
+            if self.parameters.get('fast_path', True) and self.read_activity_fast():
+                return
+
+            print('Navigating Site')
+
+            self.limiter.wait()
+            hover_clicked = self.hover_click()
+
+            # Navigate to page containing viewing activity
+            if hover_clicked:
+                self.driver.find_element_by_link_text('Viewing activity').click()
+                self.scroll_to_bottom()
+            else:
+                print('Closing Program')
+        finally:
+            # A profile that didn't finish leaves its previous output alone,
+            # and the next profile gets an output of its own
+            if self.output is not None:
+                self.output.abandon()
+                self.output = None
+
+    @profiling.phase('navigation')
     def hover_click(self):
         """
         Hovers on user avatar and clicks 'Your Account'
         Returns: Boolean
         """
-        error_count = 0
-        prof_icon_classes = [
-            'profile-icon',
-            'profile-name',
-            'profile-arrow',
-            'avatar',
-            'profile-link',
-            'account-dropdown-button',
-            'account-menu-item',
-            'current-profile'
-        ]
-        while True:
-            try:
-                # On some systems the profile icon is displayed differently.
-                # For this reason the first attempt doesn't work,
-                # the program searches for a different item that will do the same thing when clicked as the profile-icon
-                if error_count <= 7:
-                    hov_profile = self.driver.find_element_by_class_name(prof_icon_classes[error_count])
-                else:
-                    print('Error: Program was unable to find profile picture.\n'
-                          + '       Please report this issue to m13basra@gmail.com')
-                    return False
-
-                # Attempt to move to profile icon
-                hov = ActionChains(self.driver).move_to_element(hov_profile)
-                hov.perform()
-
-                # Click on 'Your Account' which appears from drop-down menu provoked in previous step
-                self.driver.find_element_by_link_text('Your Account').click()
-                return True
-            except:
-                error_count += 1
+        # On some systems the profile icon is displayed differently, so the
+        # element that opens the account menu is looked up from the candidates,
+        # starting with the one that worked last time in this browser
+        cache = SelectorCache(SERVICE, self.driver.name)
+        if cache.resolve(self.driver, 'account-menu', ACCOUNT_MENU_SELECTORS, self.open_account_page):
+            return True
+
+        print('Error: Program was unable to find profile picture.\n'
+              + '       Please report this issue to m13basra@gmail.com')
+        return False
+
+    def open_account_page(self, element):
+        """
+        Hovers on element and clicks 'Your Account' in the drop-down menu it opens
+        Returns: Boolean
+        """
+        ActionChains(self.driver).move_to_element(element).perform()
+        self.driver.find_element_by_link_text('Your Account').click()
+        return True
 
+    @profiling.phase('scrolling')
     def scroll_to_bottom(self):
         """
         Scrolls to bottom of 'Viewing Activity' page
@@ -174,46 +341,152 @@ class NetflixActivityExtractor:
 
         print('Scrolling to bottom of page (this may take a while)')
 
-        # Scroll to the bottom of the page
-        len_of_page_script = \
-            'window.scrollTo(0, document.body.scrollHeight);' \
-            'var len_of_page=document.body.scrollHeight;return len_of_page;'
-        len_of_page = self.driver.execute_script(len_of_page_script)
-        match = False
-        while not match:
-            last_count = len_of_page
-            time.sleep(1)
-            len_of_page = self.driver.execute_script(len_of_page_script)
-            if last_count == len_of_page:
-                match=True
+        self.open_output()
+
+        if self.parameters.get('prune') or self.output.incremental:
+            # Read rows as they load and remove them, so the page stays small
+            # and an incremental run can stop as soon as it reaches old rows
+            self.scroller = InfiniteScroller(self.driver, ROW_SPEC['rows'],
+                                             harvest=lambda: self.get_page_activity(prune=True),
+                                             limiter=self.limiter)
+            self.scroller.scroll()
+        else:
+            # Keep scrolling for as long as the page keeps appending rows
+            self.scroller = InfiniteScroller(self.driver, ROW_SPEC['rows'], limiter=self.limiter)
+            self.scroller.scroll()
+            print('Retrieving viewing activity')
+            self.get_page_activity()
+
+        self.finish()
+
+    def open_output(self):
+        """
+        Opens the output that the current profile's viewing activity is streamed
+        into, tagged with the profile's name when extracting every profile
+        """
+        if self.output is not None:
+            return
+        tag = None
+        if self.parameters.get('all_profiles'):
+            tag = '_'.join(re.findall(r'\w+', self.profile.lower())) or 'profile'
+        self.output = common.open_output(SERVICE, self.parameters, tag=tag, profile=self.profile, resumable=False)
+        self.interrupted = False
+
+    def finish(self):
+        """
+        Closes the current profile's output, keeping the previous one and the
+        watermark as they were if its activity stopped loading part way
+        """
+        if self.interrupted:
+            self.output.abandon()
+        else:
+            self.rows = (self.rows or 0) + self.output.finish()
+        self.output = None
+
+    @profiling.phase('extraction')
+    def read_activity_fast(self):
+        """
+        Reads viewing activity straight from the data behind the 'Viewing
+        activity' page: its JSON API, or failing that its CSV download
+        Returns: Boolean, False if neither could be used
+        """
+        self.driver.set_script_timeout(60)
+        self.open_output()
+
+        if self.read_activity_api() or self.read_activity_csv():
+            self.finish()
+            return True
 
-        self.get_page_activity()
+        print('Activity data not available, reading the \'Viewing activity\' page instead')
+        return False
 
-    def get_page_activity(self):
+    def read_activity_api(self):
         """
-        Gets viewing activity and outputs into 'netflix_activity.txt'
+        Reads viewing activity from the JSON API, PAGES_PER_CALL pages per call
+        Returns: Boolean, False if the API couldn't be used
         """
+        build = self.driver.execute_script(BUILD_ID_SCRIPT)
+        if not build:
+            return False
+
         print('Retrieving viewing activity')
+        url = ACTIVITY_API_URL % build
+        page = 0
+        retries = 0
+        while True:
+            pages = list(range(page, page + PAGES_PER_CALL))
+            # Every page of the call is a request of its own
+            try:
+                with self.limiter.request(len(pages)):
+                    result = self.driver.execute_async_script(ACTIVITY_API_SCRIPT, url, pages, PAGE_SIZE)
+            except TimeoutException:
+                # The call outlasted the script timeout, which counts as an error like any other
+                self.limiter.report('timeout')
+                result = {'error': 'script timeout'}
+            if 'error' in result and result['error'].endswith(THROTTLED_STATUSES) and retries < API_RETRIES:
+                # Back off and ask for the same pages again
+                self.limiter.report('throttled')
+                retries += 1
+                continue
+            retries = 0
+            if 'error' in result:
+                # Nothing has been written yet, so another way can still be tried
+                if page == 0:
+                    return False
+                print('Error: Viewing activity stopped loading at %s' % result['error'])
+                self.interrupted = True
+                return True
 
-        # List that is filled with strings of viewing activity
-        activity_list = []
-        # List that contains all row elements on viewing activity page
-        row_list = self.driver.find_elements_by_class_name('retableRow')
-        # For every item viewed, appends to activity_list
-        print('Progress:')
-        print('\t[' + (' ' * 20) + ']' + ' 0%', end='\r')
-        for row, i in zip(row_list, range(1, len(row_list))):
-            date_cell = row.find_elements_by_tag_name('div')[0]
-            title_cell = row.find_elements_by_tag_name('div')[1]
-            activity_list.append(date_cell.text + ' - ' + title_cell.text + '\n')
-            # Display progress bar to user
-            percent_comp = i / len(row_list)
-            fill_bar = round(19 * percent_comp)
-            print('\t[' + ('#' * fill_bar) + (' ' * (20-fill_bar)) + '] ' + str(round(percent_comp*100)) + '%',
-                  end='\r')
-
-        print('\t[' + ('#' * 20) + ']' + ' 100%')
-        # Close driver
-        self.driver.close()
-
-        common.output_activity(SERVICE, activity_list)
+            for index, rows in enumerate(result['pages']):
+                self.output.record_rows(rows, pages[index])
+                if self.output.write(rows):
+                    return True
+                # A short page is the last one
+                if len(rows) < PAGE_SIZE:
+                    return True
+            self.output.checkpoint(page=pages[-1])
+            progress.set_page(pages[-1] + 1)
+            page += PAGES_PER_CALL
+
+    def read_activity_csv(self):
+        """
+        Reads viewing activity from the CSV download
+        Returns: Boolean, False if it couldn't be downloaded
+        """
+        try:
+            with self.limiter.request():
+                result = self.driver.execute_async_script(FETCH_TEXT_SCRIPT, ACTIVITY_CSV_URL)
+        except TimeoutException:
+            self.limiter.report('timeout')
+            return False
+        if 'error' in result:
+            return False
+
+        print('Retrieving viewing activity')
+        reader = csv.DictReader(io.StringIO(result['text']))
+        if reader.fieldnames is None or 'Title' not in reader.fieldnames or 'Date' not in reader.fieldnames:
+            return False
+        row_list = [{'date': row['Date'], 'title': row['Title']} for row in reader]
+        self.output.record_rows(row_list)
+        self.output.write(row_list)
+        return True
+
+    @profiling.phase('extraction')
+    def get_page_activity(self, prune=False):
+        """
+        Gets the viewing activity currently on the page
+        If prune is True the rows are removed from the page once read
+        Returns: int
+        """
+        if self.output.recording:
+            self.output.record(self.driver.page_source)
+        # Read every row on the viewing activity page in one call
+        row_list = bulk.extract_rows(self.driver, ROW_SPEC, remove=prune)
+
+        if self.output.write(row_list):
+            self.scroller.stop()
+        if prune:
+            # Pruned rows are gone from the page, so record how far the run got
+            self.output.checkpoint()
+
+        return len(row_list)
@@ -0,0 +1,215 @@
+"""
+Module for timing the phases of an extraction and the WebDriver commands it sends
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Profiler of the run in progress, None when not profiling
+active = None
+
+# Returned by span() when not profiling
+NO_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+
+    """
+    Records a span for every call of a phase function (see phase), every
+    WebDriver command sent and the number of rows extracted, as Chrome trace
+    events and as totals
+
+    A phase's self time excludes the time spent in phases it called, so the
+    self times of a thread add up to the time it spent in phases.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        # Self seconds and calls per phase, and calls and seconds per WebDriver command
+        self.phases = {}
+        self.commands = {}
+        self.rows = 0
+
+    def timestamp(self, moment):
+        """
+        Returns moment in microseconds since the profiler started, as trace events use
+        """
+        return (moment - self.start) * 1e6
+
+    @contextlib.contextmanager
+    def span(self, name, category):
+        """
+        Records the time spent inside the with block as a span of phase category
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        # Time spent in inner phases, which doesn't count towards this one's self time
+        entry = [0.0]
+        self.local.stack.append(entry)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.local.stack.pop()
+            elapsed = end - start
+            if self.local.stack:
+                self.local.stack[-1][0] += elapsed
+            with self.lock:
+                total = self.phases.setdefault(category, [0.0, 0])
+                total[0] += elapsed - entry[0]
+                total[1] += 1
+                self.events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid,
+                                    'tid': threading.get_ident(), 'ts': self.timestamp(start),
+                                    'dur': elapsed * 1e6})
+
+    def command(self, name, start, end):
+        """
+        Records a WebDriver command sent from start to end
+        """
+        with self.lock:
+            total = self.commands.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += end - start
+            self.events.append({'name': name, 'cat': 'webdriver', 'ph': 'X', 'pid': self.pid,
+                                'tid': threading.get_ident(), 'ts': self.timestamp(start),
+                                'dur': (end - start) * 1e6})
+
+    def add_rows(self, count):
+        """
+        Adds count to the rows extracted
+        """
+        with self.lock:
+            self.rows += count
+            self.events.append({'name': 'rows', 'ph': 'C', 'pid': self.pid,
+                                'ts': self.timestamp(time.perf_counter()), 'args': {'rows': self.rows}})
+
+    def wall(self):
+        """
+        Returns the seconds from the profiler's start to its stop, or to now
+        """
+        return (self.end or time.perf_counter()) - self.start
+
+    def write_trace(self, path):
+        """
+        Writes the recorded events to path in Chrome trace format, for
+        chrome://tracing or https://ui.perfetto.dev
+        """
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+
+    def results(self):
+        """
+        Returns the totals as a dict of 'wall', 'phases', 'commands' and 'rows'
+        """
+        return {'wall': self.wall(), 'phases': self.phases, 'commands': self.commands, 'rows': self.rows}
+
+    def print_summary(self):
+        """
+        Prints where the time went, phase by phase and command by command
+        """
+        wall = self.wall()
+        print('\nPhase             Calls   Self (s)   Share')
+        for name, (seconds, calls) in sorted(self.phases.items(), key=lambda item: -item[1][0]):
+            print('%-15s %7d %10.2f %6.1f%%' % (name, calls, seconds, 100 * seconds / wall))
+        print('%-15s %7s %10.2f' % ('total', '', wall))
+
+        calls = sum(count for count, _ in self.commands.values())
+        seconds = sum(total for _, total in self.commands.values())
+        print('\nWebDriver commands: %d in %.2f s' % (calls, seconds))
+        if self.commands:
+            print('Command                          Calls  Total (s)  Mean (ms)')
+            for name, (count, total) in sorted(self.commands.items(), key=lambda item: -item[1][1]):
+                print('%-30s %7d %10.2f %10.1f' % (name, count, total, 1000 * total / count))
+
+        print('\nRows extracted: %d (%.0f rows/s)' % (self.rows, self.rows / wall if wall else 0))
+
+
+def start():
+    """
+    Starts profiling
+    Returns: the Profiler
+    """
+    global active
+    active = Profiler()
+    return active
+
+
+def stop(trace_path=None):
+    """
+    Stops profiling, writing the trace to trace_path if given
+    Returns: the stopped Profiler, or None if not profiling
+    """
+    global active
+    profiler = active
+    active = None
+    if profiler is not None:
+        profiler.end = time.perf_counter()
+        if trace_path is not None:
+            profiler.write_trace(trace_path)
+    return profiler
+
+
+def span(name, category=None):
+    """
+    Returns a context manager recording the with block as a span of phase
+    category (name by default) while profiling
+    """
+    if active is None:
+        return NO_SPAN
+    return active.span(name, category or name)
+
+
+def phase(category):
+    """
+    Decorator recording every call of the function as a span of phase category while profiling
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+            with active.span(function.__qualname__, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_rows(count):
+    """
+    Counts count more rows as extracted while profiling
+    """
+    if active is not None:
+        active.add_rows(count)
+
+
+def instrument(driver):
+    """
+    Makes driver record each WebDriver command it sends while profiling.
+    Every command, element commands included, goes through driver.execute.
+    """
+    if getattr(driver, 'profiled', False):
+        return
+    execute = driver.execute
+
+    def timed_execute(driver_command, params=None):
+        profiler = active
+        if profiler is None:
+            return execute(driver_command, params)
+        start_time = time.perf_counter()
+        try:
+            return execute(driver_command, params)
+        finally:
+            profiler.command(driver_command, start_time, time.perf_counter())
+
+    driver.execute = timed_execute
+    driver.profiled = True
@@ -0,0 +1,313 @@
+"""
+Module for reporting how far an extraction has got without slowing it down
+"""
+
+import collections
+import json
+import sys
+import threading
+import time
+
+# Seconds between redraws of a progress bar
+BAR_INTERVAL = 0.2
+
+# Seconds between progress lines written to something that isn't a terminal, e.g. a log file
+LOG_INTERVAL = 5.0
+
+# Characters in a full progress bar
+BAR_WIDTH = 20
+
+# Reporter of the run in progress, None when not reporting
+active = None
+
+
+class Reporter:
+
+    """
+    Counts the rows written, rows loaded and pages read by a run, and every
+    interval seconds hands a snapshot of the counts, with the events published
+    since the last one, to its renderers from a thread of its own. Publishing
+    a count is only an assignment, so extractors can publish as often as they like.
+    """
+
+    def __init__(self, name, renderers, interval=BAR_INTERVAL):
+        self.name = name
+        self.renderers = renderers
+        self.interval = interval
+        self.rows = 0
+        # Rows loaded into the page so far, which may be ahead of the rows written
+        self.loaded = 0
+        self.page = 0
+        self.pages = None
+        self.events = collections.deque()
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def snapshot(self):
+        """
+        Returns the counts as a dict of 'name', 'rows', 'loaded', 'page',
+        'pages' (None if unknown), 'elapsed' seconds and 'rows_per_second',
+        counting the rows loaded if those are ahead
+        """
+        elapsed = time.time() - self.start_time
+        rows = max(self.rows, self.loaded)
+        return {'name': self.name, 'rows': self.rows, 'loaded': self.loaded, 'page': self.page, 'pages': self.pages,
+                'elapsed': elapsed, 'rows_per_second': rows / elapsed if elapsed else 0.0}
+
+    def render(self, final=False):
+        """
+        Hands the current snapshot and new events to every renderer
+        """
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        snapshot = self.snapshot()
+        for renderer in self.renderers:
+            renderer.render(snapshot, events, final)
+
+    def stop(self):
+        """
+        Stops the rendering thread and renders the final counts
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.render(final=True)
+
+
+class BarRenderer:
+
+    """
+    Draws a progress bar over the last line of a terminal, or writes a
+    progress line every LOG_INTERVAL seconds to anything else, e.g. a log file
+
+    It can also stand in for stdout (see contextlib.redirect_stdout), so that
+    what is printed goes above the bar instead of through it.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.line = None
+        self.written = 0.0
+        # Printed text not ended by a newline yet
+        self.text = ''
+
+    def render(self, snapshot, events, final):
+        if final and self.text:
+            self.write('\n')
+        line = describe(snapshot)
+        with self.lock:
+            if self.tty:
+                if line != self.line or final:
+                    self.stream.write('\r' + line + '\x1b[K' + ('\n' if final else ''))
+                    self.stream.flush()
+            elif final or (line != self.line and time.time() - self.written >= LOG_INTERVAL):
+                self.stream.write(line + '\n')
+                self.stream.flush()
+                self.written = time.time()
+            self.line = None if final else line
+
+    def print(self, text):
+        """
+        Prints a line of text above the progress bar
+        """
+        with self.lock:
+            if self.tty and self.line is not None:
+                self.stream.write('\r\x1b[K' + text + '\n' + self.line)
+            else:
+                self.stream.write(text + '\n')
+            self.stream.flush()
+
+    def write(self, text):
+        self.text += text
+        while '\n' in self.text:
+            line, self.text = self.text.split('\n', 1)
+            self.print(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class JsonRenderer:
+
+    """
+    Appends the counts, whenever they changed, and every published event to
+    a JSON lines file
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf8')
+        self.counts = None
+
+    def render(self, snapshot, events, final):
+        now = time.time()
+        lines = [json.dumps(dict(event, name=snapshot['name'], time=now)) for event in events]
+        counts = (snapshot['rows'], snapshot['loaded'], snapshot['page'], snapshot['pages'])
+        if counts != self.counts or final:
+            lines.append(json.dumps(dict(snapshot, event='finish' if final else 'progress', time=now)))
+            self.counts = counts
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+        if final:
+            self.file.close()
+
+
+class SharedRenderer:
+
+    """
+    Puts the counts, whenever they changed, into a dict shared between
+    processes (e.g. a multiprocessing.Manager dict) under key, for an
+    AggregateView in another process to add up
+    """
+
+    def __init__(self, shared, key):
+        self.shared = shared
+        self.key = key
+        self.counts = None
+
+    def render(self, snapshot, events, final):
+        counts = (snapshot['rows'], snapshot['loaded'], snapshot['page'], snapshot['pages'])
+        if counts != self.counts or final:
+            self.shared[self.key] = dict(snapshot, finished=final)
+            self.counts = counts
+
+
+class AggregateView:
+
+    """
+    Draws the combined progress of the runs publishing to a shared dict
+    through SharedRenderer, e.g. the accounts of a batch run in parallel
+    workers, as one bar
+    """
+
+    def __init__(self, shared, stream=None, interval=BAR_INTERVAL):
+        self.shared = shared
+        self.bar = BarRenderer(stream)
+        self.interval = interval
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Starts drawing in a background thread
+        Returns: self
+        """
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def render(self, final=False):
+        snapshots = list(self.shared.values())
+        elapsed = time.time() - self.start_time
+        rows = sum(snapshot['rows'] for snapshot in snapshots)
+        loaded = sum(snapshot['loaded'] for snapshot in snapshots)
+        running = sum(1 for snapshot in snapshots if not snapshot['finished'])
+        rate = max(rows, loaded) / elapsed if elapsed else 0.0
+        self.bar.render({'name': 'all', 'rows': rows, 'loaded': loaded,
+                         'page': sum(snapshot['page'] for snapshot in snapshots), 'pages': None,
+                         'elapsed': elapsed, 'rows_per_second': rate, 'running': running}, [], final)
+
+    def print(self, text):
+        """
+        Prints a line of text above the bar
+        """
+        self.bar.print(text)
+
+    def stop(self):
+        """
+        Stops drawing, leaving the final totals on screen
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.render(final=True)
+
+
+def describe(snapshot):
+    """
+    Returns a line showing the counts of a snapshot, with a bar if the number of pages is known
+    """
+    parts = []
+    if snapshot['pages']:
+        done = min(1.0, snapshot['page'] / snapshot['pages'])
+        fill = round(BAR_WIDTH * done)
+        parts.append('[%s%s] %3d%%' % ('#' * fill, ' ' * (BAR_WIDTH - fill), round(done * 100)))
+        parts.append('page %d/%d' % (snapshot['page'], snapshot['pages']))
+    elif snapshot['page']:
+        parts.append('%d page(s)' % snapshot['page'])
+    if snapshot['loaded'] > snapshot['rows']:
+        # Rows are still being loaded, e.g. by scrolling, before they are written
+        parts.append('%d rows loaded, %d written (%.0f rows/s)'
+                     % (snapshot['loaded'], snapshot['rows'], snapshot['rows_per_second']))
+    else:
+        parts.append('%d rows (%.0f rows/s)' % (snapshot['rows'], snapshot['rows_per_second']))
+    if 'running' in snapshot:
+        parts.append('%d running' % snapshot['running'])
+    return '\t' + '  '.join(parts)
+
+
+def start(name, renderers, interval=BAR_INTERVAL):
+    """
+    Starts reporting a run called name to renderers
+    Returns: the Reporter
+    """
+    global active
+    active = Reporter(name, renderers, interval)
+    active.thread.start()
+    return active
+
+
+def stop():
+    """
+    Stops reporting, rendering the final counts
+    """
+    global active
+    reporter = active
+    active = None
+    if reporter is not None:
+        reporter.stop()
+
+
+def add_rows(count):
+    """
+    Counts count more rows as written
+    """
+    if active is not None:
+        active.rows += count
+
+
+def set_loaded(count):
+    """
+    Records the rows loaded so far, for runs that load rows well before writing them
+    """
+    if active is not None:
+        active.loaded = count
+
+
+def set_page(page, pages=None):
+    """
+    Records the page (or batch of rows) reached, out of pages if known
+    """
+    if active is not None:
+        active.page = page
+        if pages is not None:
+            active.pages = pages
+
+
+def event(name, **fields):
+    """
+    Publishes an event, e.g. a backoff, for the renderers that keep events
+    """
+    if active is not None:
+        active.events.append(dict(fields, event=name))
@@ -0,0 +1,213 @@
+"""
+Module for pacing the requests made to each service, so extraction runs as
+fast as a service keeps up with without running into its captchas or throttling
+"""
+
+from functools import lru_cache
+from urllib.parse import urlsplit
+import contextlib
+import ipaddress
+import json
+import os
+import progress
+import socket
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Requests per second each service starts at, and the most it speeds up to
+RATES = {
+    'AMAZON': (1.0, 10.0),
+    'HULU': (2.0, 10.0),
+    'NETFLIX': (2.0, 10.0)
+}
+DEFAULT_RATE = (1.0, 5.0)
+
+# Slowest a service is ever slowed down to
+MIN_RATE = 0.05
+
+# Requests that can be made at once after a quiet spell
+BURST = 5
+
+# What each signal from a service multiplies its rate by, and the seconds nothing is sent to it afterwards
+BACKOFF = {
+    'captcha': (0.25, 60.0),
+    'throttled': (0.5, 10.0),
+    'timeout': (0.5, 2.0)
+}
+
+# Responses faster than this many seconds speed the rate up by SPEEDUP requests per second
+FAST_RESPONSE = 1.0
+SPEEDUP = 0.25
+
+# Budgets unused for this many seconds start over from the service's starting rate
+RESET_AFTER = 3600
+
+# File the budgets are shared through by every run of the same user (batch workers,
+# daemon workers and separate runs alike), so they add up to one budget per service and address
+STATE_PATH = os.path.join(os.path.expanduser('~'), '.activity_extractor_rates.json')
+
+
+class RateLimiter:
+
+    """
+    A token bucket of requests to one service from one source address. wait()
+    takes a token, blocking until one is free. report() slows the rate down
+    on a captcha, throttling or a timeout, and success() speeds it up again
+    after a fast response, up to the service's maximum.
+    """
+
+    def __init__(self, service, source, path=STATE_PATH):
+        self.service = service
+        self.key = '%s@%s' % (service, source)
+        self.initial, self.maximum = RATES.get(service, DEFAULT_RATE)
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def budget(self):
+        """
+        Yields the limiter's budget, a dict of 'rate', 'tokens', 'updated' and
+        'paused_until', locked against other threads and processes, and stores
+        it again afterwards
+        """
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path) as file:
+                        budgets = json.load(file)
+                except (OSError, ValueError):
+                    budgets = {}
+
+                now = time.time()
+                budget = budgets.get(self.key)
+                if budget is None or now - budget['updated'] > RESET_AFTER:
+                    budget = {'rate': self.initial, 'tokens': BURST, 'updated': now, 'paused_until': 0}
+                # Refill the tokens earned since the last update
+                budget['tokens'] = min(BURST, budget['tokens'] + (now - budget['updated']) * budget['rate'])
+                budget['updated'] = now
+
+                yield budget
+
+                budgets[self.key] = budget
+                temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+                with open(temp_path, 'w') as file:
+                    json.dump(budgets, file)
+                os.replace(temp_path, self.path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def wait(self, cost=1):
+        """
+        Blocks until cost more requests fit the budget, and takes them from it,
+        BURST at a time if cost is more than the budget ever holds
+        """
+        while cost > 0:
+            chunk = min(cost, BURST)
+            with self.budget() as budget:
+                delay = budget['paused_until'] - budget['updated']
+                if delay <= 0:
+                    if budget['tokens'] >= chunk:
+                        budget['tokens'] -= chunk
+                        cost -= chunk
+                        continue
+                    delay = (chunk - budget['tokens']) / budget['rate']
+            time.sleep(delay)
+
+    def report(self, signal):
+        """
+        Slows down after a signal from the service: 'captcha', 'throttled' or 'timeout'
+        """
+        factor, pause = BACKOFF[signal]
+        with self.budget() as budget:
+            budget['rate'] = max(MIN_RATE, budget['rate'] * factor)
+            budget['tokens'] = 0
+            budget['paused_until'] = max(budget['paused_until'], budget['updated'] + pause)
+            rate = budget['rate']
+        print('%s: %s, pausing %.0fs and slowing down to %.2f requests/s'
+              % (self.service.title(), signal, pause, rate))
+        progress.event('backoff', service=self.service, signal=signal, pause=pause, rate=rate)
+
+    def success(self, seconds):
+        """
+        Counts a response that took seconds, speeding up if it was fast
+        """
+        if seconds >= FAST_RESPONSE:
+            return
+        with self.budget() as budget:
+            budget['rate'] = min(self.maximum, budget['rate'] + SPEEDUP)
+
+    @contextlib.contextmanager
+    def request(self, cost=1):
+        """
+        Waits for the budget, then times the with block as a response
+        """
+        self.wait(cost)
+        start = time.time()
+        yield
+        self.success(time.time() - start)
+
+
+class Unlimited:
+
+    """
+    Stands in for a RateLimiter where nothing needs pacing
+    """
+
+    def wait(self, cost=1):
+        pass
+
+    def report(self, signal):
+        pass
+
+    def success(self, seconds):
+        pass
+
+    @contextlib.contextmanager
+    def request(self, cost=1):
+        yield
+
+
+# Limiters of this process by service and source address
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def source_address(host):
+    """
+    Returns the local address requests to host are sent from, or None for
+    hosts on this machine
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            # Connecting a UDP socket sends nothing, it only picks the route
+            probe.connect((host, 80))
+            address = probe.getsockname()[0]
+    except OSError:
+        return 'unknown'
+    if ipaddress.ip_address(address).is_loopback:
+        return None
+    return address
+
+
+def for_service(service, url):
+    """
+    Returns the limiter of requests to service, whose pages are at url, from
+    this machine's address. Local servers (e.g. fixtures.py) aren't paced.
+    """
+    source = source_address(urlsplit(url).hostname or '')
+    if source is None:
+        return Unlimited()
+    with LIMITERS_LOCK:
+        key = (service, source)
+        if key not in LIMITERS:
+            LIMITERS[key] = RateLimiter(service, source)
+        return LIMITERS[key]
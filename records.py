@@ -0,0 +1,197 @@
+"""
+Module for turning rows read from history pages into compact activity records
+"""
+
+from datetime import datetime
+from functools import lru_cache
+import csv
+import io
+import json
+import re
+import sys
+
+# Output formats, and the file extension of each
+FORMATS = ['txt', 'csv', 'jsonl']
+
+# Columns of CSV output and keys of JSONL output
+FIELDS = ['service', 'date', 'title', 'series', 'season', 'episode', 'episode_number']
+
+# Date formats the services show, tried in order
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%y', '%m/%d/%Y', '%B %d, %Y', '%b %d, %Y', '%d %B %Y']
+
+# A date somewhere in a row's text
+DATE_PATTERN = re.compile(r'\b\d{1,2}/\d{1,2}/\d{2,4}\b|\b[A-Z][a-z]+ \d{1,2}, \d{4}\b')
+
+# The season part of a Netflix title, e.g. 'Season 2', 'Part 1' or 'Volume 3'
+NETFLIX_SEASON = re.compile(r'^(?:Season|Series|Part|Volume|Book|Collection|Chapter) (\d+)$')
+
+# Season and episode numbers in Hulu row text, e.g. 'S2 E5' or 'Season 2, Episode 5'
+HULU_EPISODE = re.compile(r'\bS(?:eason)?\s*(\d+)\W*E(?:pisode)?\s*(\d+)\b', re.IGNORECASE)
+
+# A season at the end of an Amazon title, e.g. 'Transparent - Season 1' or 'The Grand Tour Season 2'
+AMAZON_SEASON = re.compile(r'^(.*?)(?:\s*[-:,–]\s*|\s+)Season (\d+)\b(.*)$')
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text):
+    """
+    Parses a date as the services show it. Repeated dates share one object.
+    Returns: datetime.date, or None if text isn't in a known format
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def intern(text):
+    """
+    Returns text interned, so the many repeats of a series name or title are
+    kept once, or None if text is empty
+    """
+    return sys.intern(text) if text else None
+
+
+class Activity:
+
+    """
+    One entry of viewing activity. date_text and title are kept as the site
+    shows them, date holds the parsed date, and series, season, episode (the
+    episode's title) and episode_number are split out of the title where it
+    names them. text is the row as the site shows it, for text output, if that
+    isn't just its date and title.
+    """
+
+    __slots__ = ('service', 'date_text', 'date', 'title', 'series', 'season', 'episode', 'episode_number', 'text')
+
+    def __init__(self, service, date_text, title, series=None, season=None, episode=None, episode_number=None,
+                 text=None):
+        self.service = service
+        self.date_text = intern(date_text) or ''
+        self.date = parse_date(date_text) if date_text else None
+        self.title = intern(title) or ''
+        self.series = intern(series)
+        self.season = season
+        self.episode = intern(episode)
+        self.episode_number = episode_number
+        self.text = text
+
+    def iso_date(self):
+        """
+        Returns the date as YYYY-MM-DD, or as the site shows it if it couldn't be parsed
+        """
+        return self.date.isoformat() if self.date is not None else self.date_text
+
+    def line(self):
+        """
+        Returns the entry as a line of text output
+        """
+        if self.text is not None:
+            return self.text + '\n'
+        if self.date_text:
+            return self.date_text + ' - ' + self.title + '\n'
+        return self.title + '\n'
+
+    def values(self):
+        """
+        Returns the entry's fields in the order of FIELDS
+        """
+        return [self.service, self.iso_date(), self.title, self.series, self.season, self.episode,
+                self.episode_number]
+
+
+def from_netflix(row):
+    """
+    Makes a record of a Netflix row ('date' and 'title' cells). Episode titles
+    look like 'Series: Season 2: Episode'.
+    """
+    title = row['title']
+    parts = title.split(': ')
+    series = season = episode = None
+    if len(parts) >= 3:
+        match = NETFLIX_SEASON.match(parts[1])
+        series = parts[0]
+        if match:
+            season = int(match.group(1))
+            episode = ': '.join(parts[2:])
+        else:
+            episode = ': '.join(parts[1:])
+    elif len(parts) == 2:
+        series, episode = parts
+    return Activity('NETFLIX', row['date'], title, series, season, episode)
+
+
+def from_hulu(row):
+    """
+    Makes a record of a Hulu row, whose text has the series or movie on its
+    first line, then for an episode a line like 'S2 E5 Episode title', and the
+    date. The title is every line but the date, e.g. 'Series: S2 E5 Episode title'.
+    """
+    text = row['text']
+    date = DATE_PATTERN.search(text)
+    lines = [line.strip() for line in text.split('\n')]
+    lines = [line for line in lines if line and (date is None or line != date.group(0))]
+    series = season = episode = episode_number = None
+    match = HULU_EPISODE.search(text)
+    if match and lines:
+        series = lines[0]
+        season = int(match.group(1))
+        episode_number = int(match.group(2))
+        episode = DATE_PATTERN.sub('', text[match.end():].split('\n')[0]).strip(' -:,') or None
+    # Hulu rows are written out whole in text output, as they always were
+    return Activity('HULU', date.group(0) if date else '', ': '.join(lines) or text, series, season, episode,
+                    episode_number, text)
+
+
+def from_amazon(row):
+    """
+    Makes a record of an Amazon row, a title that may end with its season
+    """
+    text = row['text']
+    series = season = None
+    match = AMAZON_SEASON.match(text)
+    if match:
+        series = match.group(1)
+        season = int(match.group(2))
+    return Activity('AMAZON', '', text, series, season)
+
+
+NORMALIZERS = {
+    'NETFLIX': from_netflix,
+    'HULU': from_hulu,
+    'AMAZON': from_amazon
+}
+
+
+def normalize(service, rows):
+    """
+    Turns rows read from service's history pages into records
+    Returns: list of Activity
+    """
+    normalizer = NORMALIZERS[service]
+    return [normalizer(row) for row in rows]
+
+
+def header(output_format):
+    """
+    Returns the text an output file of the format starts with
+    """
+    if output_format == 'csv':
+        return ','.join(FIELDS) + '\r\n'
+    return ''
+
+
+def serialize(entries, output_format):
+    """
+    Returns entries as text in the output format
+    """
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(entry.values() for entry in entries)
+        return buffer.getvalue()
+    if output_format == 'jsonl':
+        return ''.join(json.dumps(dict(zip(FIELDS, entry.values())), ensure_ascii=False) + '\n'
+                       for entry in entries)
+    return ''.join(entry.line() for entry in entries)
@@ -0,0 +1,212 @@
+"""
+Module for reading history rows out of page HTML without a browser
+"""
+
+from html.parser import HTMLParser
+import re
+
+# Elements that never have an end tag
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+# Elements that start a new line in the rendered text
+BLOCK_ELEMENTS = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div',
+                  'dl', 'dt', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'section', 'table',
+                  'tbody', 'td', 'th', 'thead', 'tr', 'ul'}
+
+# Elements whose content is never rendered as text
+HIDDEN_ELEMENTS = {'script', 'style', 'template', 'noscript'}
+
+SELECTOR_PART = re.compile(r'\.([\w-]+)|#([\w-]+)|\[([\w-]+)(\*?=)"?([^"\]]*)"?\]')
+
+
+def parse_selector(selector):
+    """
+    Splits a simple CSS selector such as 'div', '.retableRow', 'a#iyrNext' or
+    '[id*="iyrListItemTitle"]' into the tests an element must pass
+    Returns: (tag or None, list of (attribute, operator, value))
+    """
+    match = re.match(r'[a-zA-Z][\w-]*', selector)
+    tag = match.group(0).lower() if match else None
+    rest = selector[match.end():] if match else selector
+
+    tests = []
+    position = 0
+    for part in SELECTOR_PART.finditer(rest):
+        if part.start() != position:
+            raise ValueError('Unsupported selector \'%s\'' % selector)
+        position = part.end()
+        if part.group(1):
+            tests.append(('class', '~=', part.group(1)))
+        elif part.group(2):
+            tests.append(('id', '=', part.group(2)))
+        else:
+            tests.append((part.group(3).lower(), part.group(4), part.group(5)))
+    if position != len(rest):
+        raise ValueError('Unsupported selector \'%s\'' % selector)
+
+    return tag, tests
+
+
+def matches(selector, tag, attrs):
+    """
+    Checks whether an element passes a parsed selector
+    Returns: Boolean
+    """
+    wanted_tag, tests = selector
+    if wanted_tag is not None and wanted_tag != tag:
+        return False
+    for name, operator, value in tests:
+        actual = attrs.get(name)
+        if actual is None:
+            return False
+        if operator == '~=' and value not in actual.split():
+            return False
+        if operator == '=' and actual != value:
+            return False
+        if operator == '*=' and value not in actual:
+            return False
+    return True
+
+
+def rendered_text(chunks):
+    """
+    Joins text chunks the way a browser renders them: whitespace collapsed
+    within lines and blank lines dropped
+    """
+    lines = ''.join(chunks).split('\n')
+    return '\n'.join(' '.join(line.split()) for line in lines if line.strip())
+
+
+class RowParser(HTMLParser):
+
+    """
+    Collects the text of every element matching a row spec (see bulk.extract_rows),
+    and the attributes of elements matching any extra selectors
+    """
+
+    def __init__(self, spec, extra_selectors=()):
+        super().__init__(convert_charrefs=True)
+        self.spec = spec
+        self.row_selector = parse_selector(spec['rows'])
+        self.cell_selector = parse_selector(spec['cells']) if spec.get('cells') else None
+        self.extra_selectors = [(selector, parse_selector(selector)) for selector in extra_selectors]
+
+        self.stack = []
+        self.hidden = 0
+        # Row being read: its stack depth, text chunks and cells
+        self.row_depth = None
+        self.row_chunks = []
+        self.cells = []
+        # Cells still open, as (stack depth, chunks)
+        self.open_cells = []
+
+        self.rows = []
+        self.found = {selector: [] for selector in extra_selectors}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict((name, value or '') for name, value in attrs)
+
+        for selector, parsed in self.extra_selectors:
+            if matches(parsed, tag, attrs):
+                self.found[selector].append(attrs)
+
+        if tag in BLOCK_ELEMENTS:
+            self.add_text('\n')
+        if tag in VOID_ELEMENTS:
+            return
+
+        self.stack.append(tag)
+        if tag in HIDDEN_ELEMENTS:
+            self.hidden += 1
+
+        if self.row_depth is None:
+            if matches(self.row_selector, tag, attrs):
+                self.row_depth = len(self.stack)
+                self.row_chunks = []
+                self.cells = []
+        elif self.cell_selector is not None and matches(self.cell_selector, tag, attrs):
+            chunks = []
+            self.cells.append(chunks)
+            self.open_cells.append((len(self.stack), chunks))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Ignore end tags that don't close anything
+        if tag not in self.stack:
+            return
+
+        while self.stack:
+            closed = self.stack.pop()
+            depth = len(self.stack) + 1
+            if closed in HIDDEN_ELEMENTS:
+                self.hidden -= 1
+            while self.open_cells and self.open_cells[-1][0] >= depth:
+                self.open_cells.pop()
+            if self.row_depth is not None and depth <= self.row_depth:
+                self.finish_row()
+            if closed == tag:
+                break
+
+        if tag in BLOCK_ELEMENTS:
+            self.add_text('\n')
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.add_text(data)
+
+    def add_text(self, text):
+        """
+        Adds text to the row and every cell that is open
+        """
+        if self.row_depth is None:
+            return
+        self.row_chunks.append(text)
+        for _, chunks in self.open_cells:
+            chunks.append(text)
+
+    def finish_row(self):
+        """
+        Turns the row that just closed into a dict keyed by the spec's fields
+        """
+        fields = self.spec['fields']
+        if self.cell_selector is not None:
+            cells = [rendered_text(chunks) for chunks in self.cells]
+            record = dict((field, cells[i] if i < len(cells) else '') for i, field in enumerate(fields))
+        else:
+            record = {fields[0]: rendered_text(self.row_chunks)}
+        self.rows.append(record)
+        self.row_depth = None
+        self.open_cells = []
+
+    def close(self):
+        super().close()
+        # Rows left open by truncated HTML still count
+        if self.row_depth is not None:
+            self.finish_row()
+
+
+def parse_rows(html, spec):
+    """
+    Reads the rows matching spec out of html, the way bulk.extract_rows reads
+    them from a live page
+    Returns: list of row dicts
+    """
+    return parse_page(html, spec)[0]
+
+
+def parse_page(html, spec, extra_selectors=()):
+    """
+    Reads the rows matching spec out of html, along with the attributes of
+    the elements matching extra_selectors (e.g. a next page link)
+    Returns: (list of row dicts, dict of selector to list of attribute dicts)
+    """
+    parser = RowParser(spec, extra_selectors)
+    parser.feed(html)
+    parser.close()
+    return parser.rows, parser.found
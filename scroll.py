@@ -0,0 +1,128 @@
+"""
+Module for loading infinite-scroll pages by waiting on the page's own signals
+"""
+
+import progress
+import time
+
+# Scrolls to the bottom, then resolves as soon as a DOM mutation brings the row
+# count above the known count, or once the timeout (ms) runs out
+WAIT_FOR_ROWS_SCRIPT = '''
+var selector = arguments[0], known = arguments[1], timeout = arguments[2];
+var done = arguments[arguments.length - 1];
+var start = Date.now();
+var finished = false;
+var count = function () { return document.querySelectorAll(selector).length; };
+var observer = new MutationObserver(function () {
+    if (count() > known) { finish(); }
+});
+var timer = setTimeout(finish, timeout);
+function finish() {
+    if (finished) { return; }
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    done({count: count(), elapsed: Date.now() - start});
+}
+observer.observe(document.body, {childList: true, subtree: true});
+window.scrollTo(0, document.body.scrollHeight);
+if (count() > known) { finish(); }
+'''
+
+
+class InfiniteScroller:
+
+    """
+    Scrolls an infinite-scroll page until no more rows load
+
+    If harvest is given it is called whenever new rows appear. It should read
+    the rows, remove them from the page and return how many it removed, so the
+    page only ever holds the rows loaded since the last call.
+
+    If limiter is given (see ratelimit.py) every scroll that loads more rows
+    waits for its budget first.
+    """
+
+    def __init__(self, driver, row_selector, harvest=None, min_timeout=0.25, max_timeout=8.0, limiter=None):
+        self.driver = driver
+        self.row_selector = row_selector
+        self.harvest = harvest
+        self.limiter = limiter
+        # Bounds in seconds for how long to wait for a batch of rows
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        # Moving average of how long a batch takes to load
+        self.load_time = min_timeout
+        # Rows currently on the page, and rows already harvested and removed
+        self.row_count = 0
+        self.harvested = 0
+        self.stopped = False
+
+    def scroll(self):
+        """
+        Scrolls until the row count stops growing and returns the number of rows
+        Returns: int
+        """
+        start = time.time()
+        # Leave enough room for the longest wait inside the script
+        self.driver.set_script_timeout(self.max_timeout + 5)
+
+        # Rows may already be on the page before the first scroll
+        self.harvest_rows()
+
+        batches = 0
+        while not self.stopped:
+            grew = self.wait_for_rows(self.timeout())
+            # A slow batch may just be late, so give it the full timeout before stopping
+            if not grew and self.timeout() < self.max_timeout:
+                grew = self.wait_for_rows(self.max_timeout)
+            if not grew:
+                break
+            self.harvest_rows()
+            batches += 1
+            progress.set_page(batches)
+            progress.set_loaded(self.harvested + self.row_count)
+
+        elapsed = time.time() - start
+        total = self.harvested + self.row_count
+        print('\t%d rows loaded in %.1fs' % (total, elapsed) + ' ' * 10)
+        return total
+
+    def stop(self):
+        """
+        Stops scrolling once the current batch is done, e.g. from within harvest
+        """
+        self.stopped = True
+
+    def harvest_rows(self):
+        """
+        Hands the rows on the page to harvest, if set, and forgets them
+        """
+        if self.harvest is not None:
+            self.harvested += self.harvest()
+            self.row_count = 0
+
+    def timeout(self):
+        """
+        Returns how long to wait for the next batch, adapted to recent load times
+        Returns: float
+        """
+        return min(self.max_timeout, max(self.min_timeout, self.load_time * 4))
+
+    def wait_for_rows(self, timeout):
+        """
+        Scrolls to the bottom and waits up to timeout seconds for new rows
+        Returns: Boolean
+        """
+        if self.limiter is not None:
+            self.limiter.wait()
+        result = self.driver.execute_async_script(WAIT_FOR_ROWS_SCRIPT, self.row_selector,
+                                                  self.row_count, int(timeout * 1000))
+        if result['count'] <= self.row_count:
+            return False
+
+        self.row_count = result['count']
+        self.load_time = 0.7 * self.load_time + 0.3 * result['elapsed'] / 1000
+        if self.limiter is not None:
+            self.limiter.success(result['elapsed'] / 1000)
+        return True
@@ -0,0 +1,90 @@
+"""
+Module for remembering which of several fallback selectors works on a site
+"""
+
+from selenium.common.exceptions import WebDriverException
+import json
+import os
+
+# File the working selectors are remembered in
+CACHE_PATH = 'selectors.json'
+
+# Returns the indexes of the selectors that match a visible element
+PROBE_SCRIPT = '''
+var selectors = arguments[0], found = [];
+for (var i = 0; i < selectors.length; i++) {
+    var element = document.querySelector(selectors[i]);
+    if (element && (element.offsetWidth || element.offsetHeight || element.getClientRects().length)) {
+        found.push(i);
+    }
+}
+return found;
+'''
+
+
+def visible(driver, candidates):
+    """
+    Checks every candidate CSS selector in one call
+    Returns: the candidates that match a visible element, in order
+    """
+    return [candidates[index] for index in driver.execute_script(PROBE_SCRIPT, candidates)]
+
+
+class SelectorCache:
+
+    """
+    Remembers, per service and site variant, which candidate selector worked
+    for each purpose, so later runs try it first and only probe the other
+    candidates when it stops working
+    """
+
+    def __init__(self, service, variant, path=CACHE_PATH):
+        self.prefix = '%s:%s:' % (service, variant)
+        self.path = path
+        self.cache = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.cache = json.load(file)
+
+    def resolve(self, driver, purpose, candidates, attempt):
+        """
+        Calls attempt with the element of the remembered selector for purpose,
+        or else with the element of each visible candidate in turn, until it
+        succeeds. attempt fails by raising a WebDriverException.
+        Returns: what attempt returned, or None if it failed on every candidate
+        """
+        key = self.prefix + purpose
+        known = self.cache.get(key)
+        if known is not None:
+            try:
+                return attempt(driver.find_element_by_css_selector(known))
+            except WebDriverException:
+                pass
+
+        for selector in visible(driver, candidates):
+            if selector == known:
+                continue
+            try:
+                result = attempt(driver.find_element_by_css_selector(selector))
+            except WebDriverException:
+                continue
+            self.remember(key, selector)
+            return result
+
+        if known is not None:
+            self.remember(key, None)
+        return None
+
+    def remember(self, key, selector):
+        """
+        Stores selector as the working one for key, or forgets key if selector is None
+        """
+        if selector is None:
+            self.cache.pop(key, None)
+        else:
+            self.cache[key] = selector
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.cache, file, indent=2)
+        os.replace(temp_path, self.path)
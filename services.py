@@ -0,0 +1,127 @@
+"""
+Module for the registry of services activity can be extracted from
+"""
+
+import importlib
+
+# Entry point group other packages register services under, e.g. in setup.py:
+#   entry_points={'activity_extractor.services': ['disney = disney:DisneyActivityExtractor']}
+ENTRY_POINT_GROUP = 'activity_extractor.services'
+
+
+class Service:
+
+    """
+    A service activity can be extracted from. target names its extractor
+    class as 'module:Class', which is only imported when the service is used.
+    config_keys maps extra keys of the service's section of 'userconfig.ini'
+    to the parameters they fill, e.g. Netflix's profile_name to user; for
+    services from entry points it is read from the class's CONFIG_KEYS.
+
+    Calling a Service with parameters returns a new extractor, like calling
+    the extractor class.
+    """
+
+    def __init__(self, name, target, config_keys=None):
+        self.name = name
+        self.target = target
+        self.keys = config_keys
+        self.extractor_class = None
+
+    def load(self):
+        """
+        Imports the extractor class
+        Returns: the class
+        """
+        if self.extractor_class is None:
+            module_name, _, class_name = self.target.partition(':')
+            self.extractor_class = getattr(importlib.import_module(module_name), class_name)
+        return self.extractor_class
+
+    @property
+    def config_keys(self):
+        if self.keys is None:
+            self.keys = getattr(self.load(), 'CONFIG_KEYS', {})
+        return self.keys
+
+    def read_config(self, parser, section):
+        """
+        Reads the parameters a section of a parsed 'userconfig.ini' can set
+        besides url: email, password, block, engine and the service's
+        config_keys, None where the section doesn't set them
+        Returns: dict
+        """
+        parameters = {
+            'email': parser.get(section, 'email', fallback=None),
+            'password': parser.get(section, 'password', fallback=None),
+            # Resources to block and engine can be set per service too
+            'block': parser.get(section, 'block', fallback=None),
+            'engine': parser.get(section, 'engine', fallback='browser')
+        }
+        for key, parameter in self.config_keys.items():
+            parameters[parameter] = parser.get(section, key, fallback=None)
+        return parameters
+
+    def __call__(self, parameters):
+        return self.load()(parameters)
+
+
+# Registered services by lower-case name
+SUPPORTED_SERVICES = {}
+
+# Whether the entry points have been read into SUPPORTED_SERVICES yet
+plugins_loaded = False
+
+
+def register(name, target, config_keys=None):
+    """
+    Adds a service to the registry, replacing any of the same name
+    """
+    SUPPORTED_SERVICES[name.lower()] = Service(name.lower(), target, config_keys)
+
+
+def load_plugins():
+    """
+    Registers the services other installed packages provide through entry
+    points, without importing them. Built-in services keep their names.
+    """
+    global plugins_loaded
+    if plugins_loaded:
+        return
+    plugins_loaded = True
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    found = entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=ENTRY_POINT_GROUP)
+    else:
+        found = found.get(ENTRY_POINT_GROUP, [])
+    for entry_point in found:
+        if entry_point.name.lower() not in SUPPORTED_SERVICES:
+            register(entry_point.name, entry_point.value)
+
+
+def get(name):
+    """
+    Returns the registered service called name, or None. Entry points are only
+    read if name isn't a built-in service.
+    """
+    if name.lower() not in SUPPORTED_SERVICES:
+        load_plugins()
+    return SUPPORTED_SERVICES.get(name.lower())
+
+
+def names():
+    """
+    Returns the names of every registered service, built-in or from entry points
+    """
+    load_plugins()
+    return sorted(SUPPORTED_SERVICES)
+
+
+register('amazon', 'amazon:AmazonActivityExtractor', {})
+register('hulu', 'hulu:HuluActivityExtractor', {})
+register('netflix', 'netflix:NetflixActivityExtractor', {'profile_name': 'user'})
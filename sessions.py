@@ -0,0 +1,113 @@
+"""
+Module for caching logged-in browser sessions between runs
+"""
+
+from functools import lru_cache
+import base64
+import hashlib
+import json
+import os
+from selenium.common.exceptions import WebDriverException
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+# Directory that encrypted session files are kept in
+SESSION_DIR = 'sessions'
+
+
+class SessionStore:
+
+    """
+    Stores a service's login cookies on disk, encrypted with a key derived
+    from the account's password, so later runs can skip the login flow
+    """
+
+    def __init__(self, service, email, password, directory=SESSION_DIR):
+        self.service = service
+        name = hashlib.sha256(('%s:%s' % (service, email)).encode('utf8')).hexdigest()[:32]
+        self.path = os.path.join(directory, name + '.session')
+
+        self.fernet = None
+        if Fernet is None:
+            print('Session caching needs the \'cryptography\' package, logging in normally')
+        else:
+            self.fernet = Fernet(derive_key(password, name))
+
+    def load(self):
+        """
+        Returns the stored cookies, or None if there are none that can be read
+        """
+        if self.fernet is None or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as file:
+            try:
+                return json.loads(self.fernet.decrypt(file.read()).decode('utf8'))
+            except (InvalidToken, ValueError):
+                # Written with a different password, or damaged
+                return None
+
+    def save(self, cookies):
+        """
+        Encrypts and stores cookies
+        """
+        if self.fernet is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.fernet.encrypt(json.dumps(cookies).encode('utf8')))
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """
+        Removes the stored session
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def restore(self, driver, url, is_valid):
+        """
+        Loads url, adds the stored cookies to driver and checks the session
+        with is_valid. Expired sessions are removed.
+        Returns: Boolean
+        """
+        cookies = self.load()
+        if cookies is None:
+            return False
+
+        # Cookies can only be added for the domain that is currently loaded
+        driver.get(url)
+        for cookie in cookies:
+            # Some drivers reject fractional expiry times
+            if 'expiry' in cookie:
+                cookie['expiry'] = int(cookie['expiry'])
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException:
+                pass
+
+        if is_valid():
+            print('Restored saved %s session' % self.service.title())
+            return True
+
+        print('Saved %s session has expired, logging in' % self.service.title())
+        self.clear()
+        driver.delete_all_cookies()
+        return False
+
+
+@lru_cache(maxsize=32)
+def derive_key(password, name):
+    """
+    Derives the key a session file is encrypted with from the account's
+    password, salted with the file name so every account gets its own key.
+    Deriving is slow on purpose, so a long-running process (see daemon.py)
+    only does it once per account.
+    Returns: the key, as Fernet takes it
+    """
+    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf8'), name.encode('utf8'), 100000)
+    return base64.urlsafe_b64encode(key)
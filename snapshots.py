@@ -0,0 +1,159 @@
+"""
+Module for recording the history pages an extraction reads, and replaying
+them through the row parsing later without a browser or network
+"""
+# !/usr/bin/python3
+
+import argparse
+import common
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import records
+import rowparser
+import sys
+import time
+
+# Directory snapshots are kept in, one subdirectory per output
+SNAPSHOT_DIRECTORY = 'snapshots'
+
+# File listing a recording's snapshots in the order they were read
+MANIFEST = 'manifest.jsonl'
+
+# File marking a recording made by an incremental run
+INCREMENTAL_MARKER = 'incremental'
+
+
+class SnapshotRecorder:
+
+    """
+    Saves every history page or batch of rows an extraction reads as a
+    gzipped file named after the SHA-256 of its content, so pages that don't
+    change between runs are stored once, and lists them in order in
+    'snapshots/NAME/manifest.jsonl'
+
+    Pages read by an incremental run also hold the rows it left out as
+    already extracted, so its recording is marked as such (see replay()).
+    """
+
+    def __init__(self, name, resume_state=None, directory=SNAPSHOT_DIRECTORY, incremental=False):
+        self.directory = os.path.join(directory, name)
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_path = os.path.join(self.directory, MANIFEST)
+        self.count = 0
+        self.stored = 0
+
+        marker_path = os.path.join(self.directory, INCREMENTAL_MARKER)
+        if incremental:
+            open(marker_path, 'w').close()
+        elif os.path.exists(marker_path):
+            os.remove(marker_path)
+
+        entries = []
+        if resume_state is not None and os.path.exists(self.manifest_path):
+            # Keep what was recorded up to the checkpoint the run resumes from
+            with open(self.manifest_path) as file:
+                entries = [json.loads(line) for line in file if line.strip()]
+            entries = [entry for entry in entries
+                       if entry['page'] is not None and entry['page'] <= resume_state.get('page', 0)]
+        self.manifest = open(self.manifest_path, 'w')
+        for entry in entries:
+            self.manifest.write(json.dumps(entry) + '\n')
+
+    def record(self, content, page=None, kind='html'):
+        """
+        Saves content, the HTML of a history page (or JSON rows if kind is
+        'rows'), as the next snapshot
+        """
+        data = content.encode('utf8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, digest + '.gz')
+        if not os.path.exists(path):
+            temp_path = path + '.tmp'
+            with gzip.open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+            self.stored += 1
+
+        self.manifest.write(json.dumps({'hash': digest, 'kind': kind, 'page': page}) + '\n')
+        self.manifest.flush()
+        self.count += 1
+
+    def record_rows(self, rows, page=None):
+        """
+        Saves rows that were read from data rather than a page (e.g. an API) as the next snapshot
+        """
+        self.record(json.dumps(rows, ensure_ascii=False), page, 'rows')
+
+    def close(self):
+        """
+        Closes the manifest
+        """
+        self.manifest.close()
+        print('Recorded %d snapshot(s) in \'%s\', %d new' % (self.count, self.directory, self.stored))
+
+
+def read_snapshots(name, directory=SNAPSHOT_DIRECTORY):
+    """
+    Reads a recording's snapshots in the order they were recorded
+    Returns: generator of (kind, content)
+    """
+    path = os.path.join(directory, name)
+    with open(os.path.join(path, MANIFEST)) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    for entry in entries:
+        with gzip.open(os.path.join(path, entry['hash'] + '.gz'), 'rb') as file:
+            yield entry['kind'], file.read().decode('utf8')
+
+
+def replay(service, spec, tag=None, output_format='txt', database=None, account='', profile=''):
+    """
+    Runs the row parsing of service over its recorded snapshots and writes
+    the activity out the way an extraction would
+    Returns: Boolean, False if the recording can't be replayed
+    """
+    # Named the way the sink names its output
+    name = service.lower() if tag is None else '%s_%s' % (service.lower(), tag)
+    if os.path.exists(os.path.join(SNAPSHOT_DIRECTORY, name, INCREMENTAL_MARKER)):
+        # Its pages hold rows the run left out, and lack the older ones it kept
+        print('\'%s\' was recorded by an --incremental run and can\'t be replayed into a full output'
+              % os.path.join(SNAPSHOT_DIRECTORY, name))
+        return False
+
+    start = time.time()
+    sink = common.ActivitySink(service, tag=tag, database=database, account=account, profile=profile,
+                               output_format=output_format)
+    count = 0
+    for kind, content in read_snapshots(sink.name):
+        if kind == 'rows':
+            row_list = json.loads(content)
+        else:
+            row_list = rowparser.parse_rows(content, spec)
+        sink.write(records.normalize(service, row_list))
+        count += 1
+    rows = sink.count
+    sink.close()
+    print('Replayed %d snapshot(s), %d rows in %.1f s' % (count, rows, time.time() - start))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Re-extracts viewing activity from recorded snapshots, without a browser.')
+    parser.add_argument('service', help='Service whose snapshots to replay.')
+    parser.add_argument('--tag=', dest='tag', help='Tag of the recording, e.g. the profile of a Netflix '
+                                                   'recording made with --all-profiles.')
+    parser.add_argument('--format=', dest='format', choices=records.FORMATS, default='txt',
+                        help='Output format: txt (default), csv or jsonl.')
+    parser.add_argument('--database=', dest='database', help='Also add the activity to this SQLite database.')
+    parser.add_argument('--account=', dest='account', default='', help='Account to store the activity under.')
+    parser.add_argument('--profile=', dest='profile', default='', help='Profile to store the activity under.')
+    args = parser.parse_args()
+
+    service = args.service.upper()
+    # Each service module defines how its rows are read
+    row_spec = importlib.import_module(service.lower()).ROW_SPEC
+    if not replay(service, row_spec, args.tag, args.format, args.database, args.account, args.profile):
+        sys.exit(2)
@@ -0,0 +1,120 @@
+"""
+Module for keeping viewing activity from every run in an indexed SQLite database
+"""
+# !/usr/bin/python3
+
+from datetime import datetime
+import argparse
+import sqlite3
+
+# Database activity builds up in unless another path is given
+DB_PATH = 'activity.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS activity (
+    service        TEXT NOT NULL,
+    account        TEXT NOT NULL,
+    profile        TEXT NOT NULL DEFAULT '',
+    date           TEXT NOT NULL DEFAULT '',
+    title          TEXT NOT NULL,
+    series         TEXT,
+    season         INTEGER,
+    episode        TEXT,
+    episode_number INTEGER,
+    first_seen     TEXT NOT NULL,
+    last_seen      TEXT NOT NULL,
+    PRIMARY KEY (service, account, profile, date, title)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS activity_date ON activity (date);
+CREATE INDEX IF NOT EXISTS activity_title ON activity (title);
+'''
+
+# Adds a row, or marks an existing one as seen again
+UPSERT = '''
+INSERT INTO activity (service, account, profile, date, title, series, season, episode, episode_number,
+                      first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (service, account, profile, date, title) DO UPDATE SET last_seen = excluded.last_seen
+'''
+
+
+class ActivityStore:
+
+    """
+    SQLite database of viewing activity keyed by service, account, profile,
+    date and title. Activity seen again in a later run is not duplicated.
+    """
+
+    def __init__(self, path=DB_PATH):
+        # Several batch workers may write at once, so wait for each other's transactions
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def add(self, service, account, profile, entries):
+        """
+        Inserts records (see records.Activity) in one transaction. Dates are
+        stored as YYYY-MM-DD so they sort and range correctly.
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection:
+            self.connection.executemany(UPSERT, [
+                (service, account, profile or '', entry.iso_date(), entry.title,
+                 entry.series, entry.season, entry.episode, entry.episode_number, now, now)
+                for entry in entries
+            ])
+
+    def query(self, service=None, account=None, profile=None, start=None, end=None, title=None):
+        """
+        Returns the stored activity matching every given filter, newest first.
+        start and end are inclusive YYYY-MM-DD dates, and title matches any part
+        of the title.
+        Returns: list of (service, account, profile, date, title)
+        """
+        conditions = []
+        values = []
+        for column, value in (('service', service), ('account', account), ('profile', profile)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                values.append(value)
+        if start is not None:
+            conditions.append('date >= ?')
+            values.append(start)
+        if end is not None:
+            conditions.append('date <= ?')
+            values.append(end)
+        if title is not None:
+            conditions.append('title LIKE ?')
+            values.append('%' + title + '%')
+
+        sql = 'SELECT service, account, profile, date, title FROM activity'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY date DESC, service, account, profile, title'
+        return self.connection.execute(sql, values).fetchall()
+
+    def close(self):
+        """
+        Closes the database
+        """
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Lists viewing activity stored in the activity database.')
+    parser.add_argument('--database=', dest='database', default=DB_PATH, help='Database to read.')
+    parser.add_argument('--service=', dest='service', help='Only this service, e.g. NETFLIX.')
+    parser.add_argument('--account=', dest='account', help='Only this account (email).')
+    parser.add_argument('--profile=', dest='profile', help='Only this profile.')
+    parser.add_argument('--from=', dest='start', help='Earliest date, YYYY-MM-DD.')
+    parser.add_argument('--to=', dest='end', help='Latest date, YYYY-MM-DD.')
+    parser.add_argument('--title=', dest='title', help='Only titles containing this text.')
+    args = parser.parse_args()
+
+    store = ActivityStore(args.database)
+    service = args.service.upper() if args.service else None
+    for row in store.query(service, args.account, args.profile, args.start, args.end, args.title):
+        print('\t'.join(row))
+    store.close()
@@ -0,0 +1,29 @@
+"""
+Shared setup of the tests: the modules live at the top of the repository
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures
+
+
+@pytest.fixture
+def fixture_server(request):
+    """
+    Starts a FixtureServer with the keyword arguments of the test's
+    'fixture_options' marker, and stops it after the test
+    """
+    marker = request.node.get_closest_marker('fixture_options')
+    options = dict(marker.kwargs) if marker else {}
+    server = fixtures.FixtureServer(**dict({'service': 'HULU', 'rows': 50}, **options)).start()
+    yield server
+    server.stop()
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'fixture_options(**options): options of the fixture_server fixture')
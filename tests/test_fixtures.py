@@ -0,0 +1,116 @@
+"""
+Tests of the stand-in pages served by fixtures.py
+"""
+
+from urllib.parse import urlsplit
+import csv
+import gzip
+import http.client
+import io
+import json
+import zlib
+
+import pytest
+
+import fixtures
+
+
+def get(server, path, cookies=None, headers=None, method='GET'):
+    """
+    Requests path from server without following redirects
+    Returns: (status, dict of headers, body bytes)
+    """
+    connection = http.client.HTTPConnection(urlsplit(server.site).netloc)
+    headers = dict(headers or {})
+    if cookies:
+        headers['Cookie'] = '; '.join('%s=%s' % pair for pair in cookies.items())
+    connection.request(method, path, body=b'' if method == 'POST' else None, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, dict(response.getheaders()), body
+
+
+LOGGED_IN = {fixtures.SESSION_COOKIE: 'ok'}
+
+
+def test_entries_are_the_same_on_every_run():
+    assert fixtures.make_entry(7) == fixtures.make_entry(7)
+    assert fixtures.make_entry(0)['date'] == fixtures.NEWEST_DATE
+    # Every fifth entry is a movie
+    assert fixtures.make_entry(4)['series'] is None
+
+
+@pytest.mark.fixture_options(service='HULU', rows=50)
+def test_hulu_history_needs_a_login(fixture_server):
+    status, headers, _ = get(fixture_server, '/account/history')
+    assert status == 302
+    assert headers['Location'] == fixtures.LOGIN_PATHS['HULU']
+
+    status, headers, _ = get(fixture_server, '/login-frame', method='POST')
+    assert status == 200
+    assert headers['Set-Cookie'].startswith('%s=ok' % fixtures.SESSION_COOKIE)
+
+
+@pytest.mark.fixture_options(service='HULU', rows=50)
+def test_hulu_pages(fixture_server):
+    assert fixture_server.last_page() == 3
+
+    _, _, body = get(fixture_server, '/account/history?page=1', LOGGED_IN)
+    assert body.decode('utf8').count('class="beaconid"') == 20
+    assert 'style="display: none"' not in body.decode('utf8')
+
+    # The last page is short, and hides the next page button
+    _, _, body = get(fixture_server, '/account/history?page=3', LOGGED_IN)
+    assert body.decode('utf8').count('class="beaconid"') == 10
+    assert 'style="display: none"' in body.decode('utf8')
+
+
+@pytest.mark.fixture_options(service='AMAZON', rows=120)
+def test_amazon_next_links(fixture_server):
+    _, _, body = get(fixture_server, '/gp/yourstore/iyr/?page=2', LOGGED_IN)
+    assert body.decode('utf8').count('iyrListItemTitle_') == 50
+    assert 'page=3' in body.decode('utf8')
+
+    _, _, body = get(fixture_server, '/gp/yourstore/iyr/?page=3', LOGGED_IN)
+    assert body.decode('utf8').count('iyrListItemTitle_') == 20
+    assert 'iyrNext' not in body.decode('utf8')
+
+
+@pytest.mark.fixture_options(service='NETFLIX', rows=45)
+def test_netflix_api_and_csv(fixture_server):
+    path = '/api/shakti/%s/viewingactivity?pg=%d&pgSize=20'
+    sizes = [len(json.loads(get(fixture_server, path % (fixtures.BUILD_IDENTIFIER, number), LOGGED_IN)[2])
+                 ['viewedItems']) for number in range(3)]
+    assert sizes == [20, 20, 5]
+
+    _, headers, body = get(fixture_server, '/viewingactivitycsv', LOGGED_IN)
+    assert headers['Content-Type'].startswith('text/csv')
+    rows = list(csv.DictReader(io.StringIO(body.decode('utf8'))))
+    assert len(rows) == 45
+    assert rows[0]['Title'] == fixtures.netflix_title(fixtures.make_entry(0))
+
+
+@pytest.mark.fixture_options(service='HULU', rows=20, encoding='gzip')
+def test_gzip_only_when_accepted(fixture_server):
+    _, headers, plain = get(fixture_server, '/account/history', LOGGED_IN)
+    assert 'Content-Encoding' not in headers
+
+    _, headers, body = get(fixture_server, '/account/history', LOGGED_IN, {'Accept-Encoding': 'gzip, deflate'})
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == plain
+
+
+@pytest.mark.fixture_options(service='HULU', rows=20, encoding='deflate')
+def test_deflate(fixture_server):
+    _, headers, body = get(fixture_server, '/account/history', LOGGED_IN, {'Accept-Encoding': 'deflate'})
+    assert headers['Content-Encoding'] == 'deflate'
+    assert b'beaconid' in zlib.decompress(body)
+
+
+@pytest.mark.fixture_options(service='HULU', rows=20)
+def test_counts_requests_and_connections(fixture_server):
+    for _ in range(3):
+        get(fixture_server, '/')
+    assert fixture_server.requests == 3
+    assert fixture_server.connections == 3
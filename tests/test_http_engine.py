@@ -0,0 +1,107 @@
+"""
+Tests of fetching history pages over plain HTTP, against pages served by fixtures.py
+"""
+
+import pytest
+
+import fixtures
+from http_engine import HttpEngine, HttpError
+
+
+class CookieDriver:
+
+    """
+    Stands in for a logged-in WebDriver session, which HttpEngine only asks
+    for its cookies and user agent
+    """
+
+    def __init__(self, cookies):
+        self.cookies = cookies
+
+    def get_cookies(self):
+        return self.cookies
+
+    def execute_script(self, script):
+        return 'Mozilla/5.0 (test)'
+
+
+LOGGED_IN = CookieDriver([{'name': fixtures.SESSION_COOKIE, 'value': 'ok', 'domain': '127.0.0.1', 'path': '/'}])
+
+
+@pytest.mark.fixture_options(service='HULU', rows=100)
+def test_keeps_connections_alive(fixture_server):
+    engine = HttpEngine(LOGGED_IN, workers=1)
+    try:
+        for number in range(1, 6):
+            url, html = engine.fetch(fixture_server.site + '/account/history?page=%d' % number)
+            assert html.count('class="beaconid"') == 20
+    finally:
+        engine.close()
+    assert engine.requests == 5
+    assert fixture_server.requests == 5
+    assert fixture_server.connections == 1
+
+
+@pytest.mark.fixture_options(service='HULU', rows=100)
+def test_fetch_all_keeps_order(fixture_server):
+    engine = HttpEngine(LOGGED_IN, workers=3)
+    urls = [fixture_server.site + '/account/history?page=%d' % number for number in range(1, 6)]
+    try:
+        pages = engine.fetch_all(urls)
+    finally:
+        engine.close()
+    assert [url for url, _ in pages] == urls
+    # Every page shows the next page's number in its pagination
+    for number, (_, html) in enumerate(pages, 1):
+        assert 'page=%d' % (number + 1) in html
+    assert fixture_server.connections <= 3
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_decodes_compressed_pages(encoding):
+    server = fixtures.FixtureServer('HULU', rows=100, encoding=encoding).start()
+    engine = HttpEngine(LOGGED_IN, workers=1)
+    try:
+        _, html = engine.fetch(server.site + '/account/history')
+    finally:
+        engine.close()
+        server.stop()
+    assert html.count('class="beaconid"') == 20
+    # What came over the wire was compressed
+    assert engine.bytes < len(html.encode('utf8'))
+
+
+@pytest.mark.fixture_options(service='HULU', rows=20)
+def test_follows_redirects_without_a_login(fixture_server):
+    engine = HttpEngine(CookieDriver([]), workers=1)
+    try:
+        url, html = engine.fetch(fixture_server.site + '/account/history')
+    finally:
+        engine.close()
+    assert url == fixture_server.site + fixtures.LOGIN_PATHS['HULU']
+    assert 'login-iframe' in html
+
+
+def test_cookie_header_matches_domain_path_and_scheme():
+    engine = HttpEngine(CookieDriver([
+        {'name': 'site', 'value': '1', 'domain': '.example.com', 'path': '/'},
+        {'name': 'history', 'value': '2', 'domain': 'www.example.com', 'path': '/account'},
+        {'name': 'secure', 'value': '3', 'domain': 'www.example.com', 'path': '/', 'secure': True},
+        {'name': 'other', 'value': '4', 'domain': 'example.org', 'path': '/'}
+    ]))
+    try:
+        assert engine.cookie_header('www.example.com', '/account/history', True) == 'site=1; history=2; secure=3'
+        assert engine.cookie_header('www.example.com:80', '/', False) == 'site=1'
+    finally:
+        engine.close()
+
+
+@pytest.mark.fixture_options(service='HULU', rows=20)
+def test_raises_for_error_statuses(fixture_server):
+    engine = HttpEngine(LOGGED_IN, workers=1)
+    try:
+        with pytest.raises(HttpError) as error:
+            engine.fetch(fixture_server.site + '/missing')
+    finally:
+        engine.close()
+    assert error.value.status == 404
@@ -0,0 +1,18 @@
+"""
+Tests of pacing requests with the shared token bucket
+"""
+
+import time
+
+import ratelimit
+
+
+def test_takes_costs_above_burst_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setitem(ratelimit.RATES, 'TEST', (100.0, 100.0))
+    limiter = ratelimit.RateLimiter('TEST', '127.0.0.1', path=str(tmp_path / 'rates.json'))
+    start = time.time()
+    limiter.wait(ratelimit.BURST * 3)
+    # The first BURST are free, the rest come at 100 a second
+    assert time.time() - start < 2
+    with limiter.budget() as budget:
+        assert budget['tokens'] < 1
@@ -0,0 +1,23 @@
+"""
+Tests of turning rows read from history pages into activity records
+"""
+
+import records
+
+
+def test_hulu_episode():
+    entry = records.from_hulu({'text': 'Show\nS2 E5 The Pilot\n01/02/2020'})
+    assert entry.values() == ['HULU', '2020-01-02', 'Show: S2 E5 The Pilot', 'Show', 2, 'The Pilot', 5]
+    # Text output keeps the row as Hulu shows it
+    assert entry.line() == 'Show\nS2 E5 The Pilot\n01/02/2020\n'
+
+
+def test_hulu_movie():
+    entry = records.from_hulu({'text': 'Movie\nMarch 4, 2019'})
+    assert entry.values() == ['HULU', '2019-03-04', 'Movie', None, None, None, None]
+
+
+def test_netflix_episode():
+    entry = records.from_netflix({'date': '1/2/20', 'title': 'Show: Season 2: The Pilot'})
+    assert entry.values() == ['NETFLIX', '2020-01-02', 'Show: Season 2: The Pilot', 'Show', 2, 'The Pilot', None]
+    assert entry.line() == '1/2/20 - Show: Season 2: The Pilot\n'
@@ -0,0 +1,76 @@
+"""
+Tests of reading history rows out of page HTML, on pages served by fixtures.py
+"""
+
+import urllib.request
+
+import pytest
+
+import amazon
+import fixtures
+import hulu
+import netflix
+import rowparser
+
+
+def read_page(server, path):
+    """
+    Returns the HTML of a logged-in page of server
+    """
+    request = urllib.request.Request(server.site + path,
+                                     headers={'Cookie': '%s=ok' % fixtures.SESSION_COOKIE})
+    with urllib.request.urlopen(request) as response:
+        return response.read().decode('utf8')
+
+
+def test_parse_selector():
+    assert rowparser.parse_selector('div') == ('div', [])
+    assert rowparser.parse_selector('.retableRow') == (None, [('class', '~=', 'retableRow')])
+    assert rowparser.parse_selector('a#iyrNext') == ('a', [('id', '=', 'iyrNext')])
+    assert rowparser.parse_selector('[id*="iyrListItemTitle"]') == (None, [('id', '*=', 'iyrListItemTitle')])
+    with pytest.raises(ValueError):
+        rowparser.parse_selector('div > a')
+
+
+@pytest.mark.fixture_options(service='HULU', rows=30)
+def test_hulu_rows(fixture_server):
+    rows = rowparser.parse_rows(read_page(fixture_server, '/account/history?page=1'), hulu.ROW_SPEC)
+    assert len(rows) == 20
+    assert rows[0] == {'text': 'The Office (U.S.)\nS1 E1 Chapter 1\n03/31/2019'}
+
+    # The second page starts where the first one ended
+    rows = rowparser.parse_rows(read_page(fixture_server, '/account/history?page=2'), hulu.ROW_SPEC)
+    assert len(rows) == 10
+    entry = fixtures.make_entry(20)
+    assert rows[0]['text'].startswith(entry['series'] or entry['title'])
+
+
+@pytest.mark.fixture_options(service='AMAZON', rows=60)
+def test_amazon_rows_and_next_link(fixture_server):
+    html = read_page(fixture_server, '/gp/yourstore/iyr/?page=1')
+    rows, found = rowparser.parse_page(html, amazon.ROW_SPEC, [amazon.NEXT_SELECTOR])
+    assert len(rows) == 50
+    assert rows[0] == {'text': 'The Office (U.S.) - Season 1'}
+    assert found[amazon.NEXT_SELECTOR][0]['href'].endswith('page=2')
+    assert rowparser.parse_rows(html, amazon.ROW_SPEC) == rows
+
+    # The last page has no next link
+    rows, found = rowparser.parse_page(read_page(fixture_server, '/gp/yourstore/iyr/?page=2'),
+                                       amazon.ROW_SPEC, [amazon.NEXT_SELECTOR])
+    assert len(rows) == 10
+    assert found[amazon.NEXT_SELECTOR] == []
+
+
+@pytest.mark.fixture_options(service='NETFLIX', rows=30)
+def test_netflix_cells(fixture_server):
+    rows = rowparser.parse_rows(read_page(fixture_server, '/viewingactivity'), netflix.ROW_SPEC)
+    assert len(rows) == 20
+    entry = fixtures.make_entry(0)
+    assert rows[0] == {'date': fixtures.netflix_date(entry), 'title': fixtures.netflix_title(entry)}
+
+
+def test_hidden_text_and_truncated_html():
+    spec = {'rows': '.row', 'cells': None, 'fields': ['text']}
+    html = ('<div class="row">Shown<script>var hidden = 1;</script></div>'
+            '<div class="row">Cut off')
+    assert rowparser.parse_rows(html, spec) == [{'text': 'Shown'}, {'text': 'Cut off'}]
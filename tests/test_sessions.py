@@ -0,0 +1,108 @@
+"""
+Tests of caching encrypted login sessions, against the Hulu pages served by fixtures.py
+"""
+
+import os
+import urllib.request
+
+import pytest
+
+import fixtures
+
+pytest.importorskip('cryptography')
+import sessions
+
+
+class CookieBrowser:
+
+    """
+    Stands in for a WebDriver session: loads pages with the cookies it was
+    given, the only part of a browser SessionStore.restore uses
+    """
+
+    def __init__(self):
+        self.cookies = []
+        self.page_source = ''
+
+    def get(self, url):
+        cookie = '; '.join('%s=%s' % (cookie['name'], cookie['value']) for cookie in self.cookies)
+        with urllib.request.urlopen(urllib.request.Request(url, headers={'Cookie': cookie})) as response:
+            self.page_source = response.read().decode('utf8')
+
+    def add_cookie(self, cookie):
+        self.cookies.append(cookie)
+
+    def delete_all_cookies(self):
+        self.cookies = []
+
+
+def log_in(server):
+    """
+    Logs into the stand-in Hulu
+    Returns: the session cookies, as WebDriver's get_cookies() lists them
+    """
+    request = urllib.request.Request(server.site + '/login-frame', data=b'', method='POST')
+    with urllib.request.urlopen(request) as response:
+        name, _, value = response.headers['Set-Cookie'].split(';')[0].partition('=')
+    return [{'name': name, 'value': value, 'domain': '127.0.0.1', 'path': '/', 'expiry': 2000000000.5}]
+
+
+@pytest.fixture
+def hulu(tmp_path):
+    server = fixtures.FixtureServer('HULU', rows=20).start()
+    browser = CookieBrowser()
+
+    def is_valid():
+        browser.get(server.site + '/account/history')
+        return 'class="beaconid"' in browser.page_source
+
+    yield server, browser, is_valid, str(tmp_path)
+    server.stop()
+
+
+def test_save_and_load(hulu):
+    server, _, _, directory = hulu
+    cookies = log_in(server)
+    store = sessions.SessionStore('HULU', 'someone@example.com', 'secret', directory)
+    store.save(cookies)
+
+    assert store.load() == cookies
+    # Stored encrypted, and readable by the user only
+    with open(store.path, 'rb') as file:
+        assert b'fixture_session' not in file.read()
+    assert os.stat(store.path).st_mode & 0o777 == 0o600
+    # Every account has a file of its own
+    assert sessions.SessionStore('HULU', 'other@example.com', 'secret', directory).path != store.path
+
+
+def test_restore_logs_in(hulu):
+    server, browser, is_valid, directory = hulu
+    assert not is_valid()
+    sessions.SessionStore('HULU', 'someone@example.com', 'secret', directory).save(log_in(server))
+
+    store = sessions.SessionStore('HULU', 'someone@example.com', 'secret', directory)
+    assert store.restore(browser, server.site + '/', is_valid)
+    # Expiry times are handed to the browser as whole seconds
+    assert browser.cookies[0]['expiry'] == 2000000000
+
+
+def test_wrong_password_logs_in_normally(hulu):
+    server, browser, is_valid, directory = hulu
+    sessions.SessionStore('HULU', 'someone@example.com', 'secret', directory).save(log_in(server))
+
+    store = sessions.SessionStore('HULU', 'someone@example.com', 'wrong', directory)
+    assert store.load() is None
+    assert not store.restore(browser, server.site + '/', is_valid)
+    assert browser.cookies == []
+    # The session stays for the right password
+    assert os.path.exists(store.path)
+
+
+def test_expired_session_is_removed(hulu):
+    server, browser, is_valid, directory = hulu
+    store = sessions.SessionStore('HULU', 'someone@example.com', 'secret', directory)
+    store.save([{'name': fixtures.SESSION_COOKIE, 'value': 'expired', 'domain': '127.0.0.1', 'path': '/'}])
+
+    assert not store.restore(browser, server.site + '/', is_valid)
+    assert not os.path.exists(store.path)
+    assert browser.cookies == []
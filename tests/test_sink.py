@@ -0,0 +1,48 @@
+"""
+Tests of resuming the activity output from a checkpoint
+"""
+
+import os
+
+import common
+import records
+
+
+def entries(count):
+    return records.normalize('HULU', [{'text': 'Show %d\nEpisode' % number} for number in range(count)])
+
+
+def interrupted_run(count):
+    sink = common.ActivitySink('HULU')
+    sink.write(entries(count))
+    sink.checkpoint(page=1)
+    sink.abandon()
+    return sink
+
+
+def test_resumes_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    interrupted_run(3)
+    sink = common.ActivitySink('HULU', resume=True)
+    assert sink.resume_state['page'] == 1
+    assert sink.count == 3
+    sink.abandon()
+
+
+def test_fresh_run_removes_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    interrupted_run(3)
+    common.ActivitySink('HULU').abandon()
+    assert not os.path.exists('hulu_checkpoint.json')
+    assert common.ActivitySink('HULU', resume=True).resume_state is None
+
+
+def test_refuses_output_shorter_than_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    interrupted_run(3)
+    with open('hulu_activity.txt.new', 'r+b') as file:
+        file.truncate(10)
+    sink = common.ActivitySink('HULU', resume=True)
+    assert sink.resume_state is None
+    assert sink.count == 0
+    sink.abandon()